@@ -0,0 +1,82 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+import secrets
+
+from eth_keys import keys
+
+class BenchmarkAccounts:
+
+    # Funded accounts for load generators, so that each sender has its own nonce sequence. Keys are stored in a flat
+    # binary file of fixed size records: 20 bytes of address followed by 32 bytes of private key, in generation order.
+
+    ADDRESS_SIZE = 20
+    KEY_SIZE = 32
+    RECORD_SIZE = ADDRESS_SIZE + KEY_SIZE
+    DEFAULT_BALANCE = "0x200000000000000000000000000000000000000000000000000000000000000"
+
+    def __init__(self, path, processes=None, chunk_size=1000):
+        self.path = path
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger("BenchmarkAccounts")
+
+    def generate(self, count):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        chunks = [self.chunk_size] * (count // self.chunk_size)
+        if count % self.chunk_size:
+            chunks.append(count % self.chunk_size)
+        with open(self.path, "wb") as accounts_file:
+            if chunks:
+                with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                    for records in executor.map(create_records, chunks):
+                        accounts_file.write(records)
+        self.logger.info("Generated %d benchmark accounts in %s" % (count, self.path))
+
+    def __len__(self):
+        if not os.path.isfile(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.RECORD_SIZE
+
+    def keys(self):
+        # Yields (address, private key) pairs, reading the file a chunk at a time
+        with open(self.path, "rb") as accounts_file:
+            for records in iter(lambda: accounts_file.read(self.RECORD_SIZE * self.chunk_size), b""):
+                for offset in range(0, len(records), self.RECORD_SIZE):
+                    record = records[offset:offset + self.RECORD_SIZE]
+                    yield "0x" + record[:self.ADDRESS_SIZE].hex(), record[self.ADDRESS_SIZE:]
+
+    def addresses(self):
+        for address, _ in self.keys():
+            yield address
+
+def create_records(count):
+    records = bytearray()
+    for _ in range(count):
+        private_key = keys.PrivateKey(secrets.token_bytes(BenchmarkAccounts.KEY_SIZE))
+        records += private_key.public_key.to_canonical_address()
+        records += private_key.to_bytes()
+    return bytes(records)
+
+def write_genesis(path, genesis_dict, alloc_key, extra_addresses=(), balance=BenchmarkAccounts.DEFAULT_BALANCE):
+    # Writes genesis_dict adding extra_addresses to its alloc_key section one at a time, so that the genesis of tens
+    # of thousands of accounts is never held in memory. Addresses already in the section keep their entry.
+    genesis_dict = genesis_dict.copy()
+    alloc = genesis_dict.pop(alloc_key, {})
+    with open(path, "w") as genesis_file:
+        genesis_file.write("{")
+        for key, value in genesis_dict.items():
+            genesis_file.write("%s: %s, " % (json.dumps(key), json.dumps(value)))
+        genesis_file.write("%s: {" % json.dumps(alloc_key))
+        separator = ""
+        for address, entry in alloc.items():
+            genesis_file.write("%s%s: %s" % (separator, json.dumps(address), json.dumps(entry)))
+            separator = ", "
+        balance_entry = json.dumps({"balance": balance})
+        for address in extra_addresses:
+            if address in alloc:
+                continue
+            genesis_file.write("%s%s: %s" % (separator, json.dumps(address), balance_entry))
+            separator = ", "
+        genesis_file.write("}}")
@@ -15,6 +15,7 @@ class BlockPropagationManager(DeployManager):
     docker_network_name = "benchmark"
     docker_container_server_name = "block_propagation_server"
     docker_container_client_name = "block_propagation_client"
+    images = ("bp-client",)
 
     def __init__(self, hosts, container_node="geth"): #geth is the only currently supported
         super().__init__(hosts)
@@ -24,7 +25,8 @@ class BlockPropagationManager(DeployManager):
     def _init_setup(self):
         self.__init_datadir()
         self.local_connections = HostManager.get_local_connections()
-        self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
+        with self._step("connect"):
+            self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
         local_docker = self.local_connections["docker"]["client"]
         try:
             local_network = local_docker.networks.create(
@@ -42,9 +44,8 @@ class BlockPropagationManager(DeployManager):
         local_docker = self.local_connections["docker"]["client"]
         try:
             previous_execution_container = local_docker.containers.get(self.docker_container_server_name)
-            previous_execution_container.stop()
-            previous_execution_container.remove()
-            self.logger.debug("Previous execution server found, stopped and removed")
+            self._remove_containers([previous_execution_container])
+            self.logger.debug("Previous execution server found and removed")
         except docker.errors.NotFound:
             pass
         server_container = local_docker.containers.run(
@@ -65,9 +66,8 @@ class BlockPropagationManager(DeployManager):
         docker_client = self.hosts_connections[host]["docker"]["client"]
         try:
             previous_execution_container = docker_client.containers.get(self.docker_container_client_name)
-            previous_execution_container.stop()
-            previous_execution_container.remove()
-            self.logger.debug("[{0}]Previous execution container found, stopped and removed".format(host))
+            self._remove_containers([previous_execution_container])
+            self.logger.debug("[{0}]Previous execution container found and removed".format(host))
         except docker.errors.NotFound:
             pass
         node_container = docker_client.containers.run(
@@ -87,15 +87,16 @@ class BlockPropagationManager(DeployManager):
         self.logger.info("[%s]Deployed client" % host)
 
     def _stop_setup(self):
-        for _, container in self.local_connections["docker"]["containers"].items():
-            container.stop()
-            container.remove()
-        self.logger.info("[%s]Stopped log collector")
+        containers = self.local_connections["docker"]["containers"]
+        self._remove_containers(containers.values())
+        containers.clear()
+        self.logger.info("Stopped log collector")
 
     def _stop_loop(self, host):
-        for _, container in self.hosts_connections[host]["docker"]["containers"].items():
-            container.stop()
-            container.remove()
+        containers = self.hosts_connections[host]["docker"]["containers"]
+        with self._step("docker.remove"):
+            self._remove_containers(containers.values())
+        containers.clear()
         self.logger.info("[%s]Stopped" % host)
     
     def __init_datadir(self):
@@ -0,0 +1,13 @@
+#!/bin/sh
+# Builds the images this repository provides for hosts and pushes them where dinr.yaml resolves them.
+# REGISTRY overrides the dinr.yaml registry, e.g. to push to a local registry.
+set -e
+cd "$(dirname "$0")"
+REGISTRY=${REGISTRY:-$(sed -n 's/^registry: *"\{0,1\}\([^"]*\)"\{0,1\}$/\1/p' dinr.yaml)}
+
+build_and_push() {
+    docker build -f "$1" -t "$REGISTRY/$2" .
+    docker push "$REGISTRY/$2"
+}
+
+build_and_push loadgen-agent.Dockerfile bc-orch-loadgen-agent
@@ -6,6 +6,7 @@ import shutil
 import docker
 
 from deploy_manager import DeployManager
+from file_transfer import BulkUploader
 from host_manager import HostManager
 
 class BurrowManager(DeployManager):
@@ -15,6 +16,7 @@ class BurrowManager(DeployManager):
 
     docker_network_name = "benchmark"
     docker_node_name = "burrow-node"
+    images = ("burrow-node",)
 
     chain_name = "benchmark"
 
@@ -39,7 +41,8 @@ class BurrowManager(DeployManager):
 
     def _init_setup(self):
         self.local_connections = HostManager.get_local_connections()
-        self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
+        with self._step("connect"):
+            self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
         self.__init_local_dir()
         self.__init_local_network()
 
@@ -67,6 +70,8 @@ class BurrowManager(DeployManager):
         self.config_template["RPC"]["Profiler"]["ListenHost"] = "0.0.0.0"
         self.config_template["RPC"]["GRPC"]["ListenHost"] = "0.0.0.0"
         self.config_template["RPC"]["Metrics"]["ListenHost"] = "0.0.0.0"
+        # Validators are indexed as hosts
+        self.peers = self.topology.peers(range(len(self.hosts)))
     
     def _start_loop(self, host):
         host_index = self.hosts.index(host)
@@ -77,7 +82,7 @@ class BurrowManager(DeployManager):
         persistent_peers = ""
         tendermint_port = config["Tendermint"]["ListenPort"]
         for i, validator in enumerate(config["GenesisDoc"]["Validators"]):
-            if i != host_index:
+            if i in self.peers[host_index]:
                 if persistent_peers != "":
                     persistent_peers += ","
                 persistent_peers += "tcp://%s@%s:%s" % (validator["NodeAddress"].lower(), self.hosts[i], tendermint_port)
@@ -85,14 +90,12 @@ class BurrowManager(DeployManager):
         config_file = os.path.join(self.local_datadir, "config-%s.json" % host)
         with open(config_file, "w") as config_file_descriptor:
             json.dump(config, config_file_descriptor)
-        if not self.__init_remote_datadir(host):
-            raise Exception("[%s]Failed to initialiaze remote dir" % host)
-        self.__copy_validator_files(host, host_index, config_file)
+        with self._step("ssh.upload_files"):
+            self.__copy_validator_files(host, host_index, config_file)
         docker_client = self.hosts_connections[host]["docker"]["client"]
         try:
             burrow_node = docker_client.containers.get(self.docker_node_name)
-            burrow_node.stop()
-            burrow_node.remove(force=True)
+            self._remove_containers([burrow_node])
             self.logger.debug("[%s]An already existing burrow node has been removed")
         except docker.errors.NotFound:
             pass
@@ -100,33 +103,31 @@ class BurrowManager(DeployManager):
         for _, rpc_config in config["RPC"].items():
             if rpc_config["Enabled"]:
                 ports[rpc_config["ListenPort"] + "/tcp"] = rpc_config["ListenPort"]
-        burrow_node = docker_client.containers.run(
-            self.dinr.resolve("burrow-node"),
-            "start -c %s -v %d" % (os.path.basename(self.remote_config_file), host_index),
-            detach=True,
-            name=self.docker_node_name,
-            network=self.docker_network_name,
-            user="root",
-            ports=ports,
-            volumes={
-                self.remote_datadir: {
-                    "bind": "/home/burrow",
-                    "mode": "rw"
-                }
-            })
+        with self._step("docker.run"):
+            burrow_node = docker_client.containers.run(
+                self.dinr.resolve("burrow-node"),
+                "start -c %s -v %d" % (os.path.basename(self.remote_config_file), host_index),
+                detach=True,
+                name=self.docker_node_name,
+                network=self.docker_network_name,
+                user="root",
+                ports=ports,
+                volumes={
+                    self.remote_datadir: {
+                        "bind": "/home/burrow",
+                        "mode": "rw"
+                    }
+                })
         self.hosts_connections[host]["docker"]["containers"][self.docker_node_name] = burrow_node
         self.logger.info("[%s]Node successfully deployed" % host)
 
     def _stop_loop(self, host):
-        for container in self.hosts_connections[host]["docker"]["containers"].values():
-            container.stop()
-            container.remove(force=True)
+        containers = self.hosts_connections[host]["docker"]["containers"]
+        with self._step("docker.remove"):
+            self._remove_containers(containers.values())
+        containers.clear()
         self.logger.info("[%s]Node successfully stopped" % host)
     
-    def _deinit_loop(self, host):
-        self.hosts_connections[host]["docker"]["client"].close()
-        self.hosts_connections[host]["ssh"].close()
-
     def __init_local_dir(self):
         try:
             shutil.rmtree(self.local_datadir)
@@ -153,34 +154,18 @@ class BurrowManager(DeployManager):
             else:
                 self.logger.error(error)
         
-    def __init_remote_datadir(self, host):
-        ssh_cnx = self.hosts_connections[host]["ssh"]
-        ssh_cnx.sudo("rm -rf " + self.remote_datadir)
-        mkdir = ssh_cnx.run("mkdir -p " + self.remote_datadir)
-        if not mkdir.ok:
-            self.logger.error("[%s] Error in creating datadir (%s)" % (host, self.remote_datadir))
-            return False
-        mkdir = ssh_cnx.run("mkdir -p " + os.path.join(self.remote_datadir, ".keys/data"))
-        if not mkdir.ok:
-            self.logger.error("[%s] Error in creating key dir (%s) inside datadir" % (host, ".keys/data"))
-            return False
-        mkdir = ssh_cnx.run("mkdir -p " + os.path.join(self.remote_datadir, ".keys/names"))
-        if not mkdir.ok:
-            self.logger.error("[%s] Error in creating key dir (%s) inside datadir" % (host, ".keys/names"))
-            return False
-        return True
-    
     def __copy_validator_files(self, host, index, config_file):
         ssh_cnx = self.hosts_connections[host]["ssh"]
-        address_file = os.path.join(self.local_datadir, ".keys/names", self.config_template["GenesisDoc"]["Validators"][index]["Name"])
-        ssh_cnx.put(address_file, remote=os.path.join(self.remote_datadir, ".keys/names"))
-        nodekey_file = os.path.join(self.local_datadir, ".keys/names", "nodekey-" + self.config_template["GenesisDoc"]["Validators"][index]["Name"])
-        ssh_cnx.put(nodekey_file, remote=os.path.join(self.remote_datadir, ".keys/names"))
-        address_data_file = os.path.join(self.local_datadir, ".keys/data", self.config_template["GenesisDoc"]["Validators"][index]["Address"] + ".json")
-        ssh_cnx.put(address_data_file, remote=os.path.join(self.remote_datadir, ".keys/data"))
-        nodekey_data_file = os.path.join(self.local_datadir, ".keys/data", self.config_template["GenesisDoc"]["Validators"][index]["NodeAddress"] + ".json")
-        ssh_cnx.put(nodekey_data_file, remote=os.path.join(self.remote_datadir, ".keys/data"))
-        ssh_cnx.put(config_file, remote=self.remote_config_file)
+        self._remove_remote_dirs(host, self.remote_datadir) # Burrow runs as root, so its previous data is owned by root
+        validator = self.config_template["GenesisDoc"]["Validators"][index]
+        uploader = BulkUploader()
+        for key_file in [os.path.join(".keys/names", validator["Name"]),
+                         os.path.join(".keys/names", "nodekey-" + validator["Name"]),
+                         os.path.join(".keys/data", validator["Address"] + ".json"),
+                         os.path.join(".keys/data", validator["NodeAddress"] + ".json")]:
+            uploader.add_file(os.path.join(self.local_datadir, key_file), key_file)
+        uploader.add_file(config_file, os.path.basename(self.remote_config_file))
+        uploader.upload(ssh_cnx, self.remote_datadir)
         self.logger.info("[%s]All validator files upated" % host)
         
 
@@ -33,7 +33,7 @@ class CaliperEthereum(CaliperManagerAdapter):
     def init(self):
         if not os.path.exists(self.temp_dir):
             os.makedirs(self.temp_dir)
-        self.manager.cmd_events[DeployManager.CMD_START].wait()
+        self.manager.wait_cmd(DeployManager.CMD_START)
         self.__deploy_registry(self.manager.utility_node)
         with open(self.base_network_file) as conf_template_file:
             self.conf_template = json.load(conf_template_file)
@@ -23,6 +23,7 @@ class CaliperManager(DeployManager):
     remote_network_conf_file = os.path.join(remote_caliper_dir, "benchmark.json")
     docker_container_server_name = "caliper"
     docker_container_client_name = "zookeeper-client"
+    images = ("caliper-client",)
     reports_dir = "/home/ubuntu/reports"
     
     # If running in container, this must be externally reachable and its binding must be present in HostManager
@@ -37,6 +38,7 @@ class CaliperManager(DeployManager):
         self.original_workload_file = workload_file
     
     def parse_conf(self, conf_as_dict): # TODO integrate this function inside kwargs on __init__
+        super().parse_conf(conf_as_dict)
         if "REPORTS_DIR" in conf_as_dict:
             self.reports_dir = conf_as_dict["REPORTS_DIR"]
         if "LOCAL_CALIPER_DIR" in conf_as_dict:
@@ -46,15 +48,15 @@ class CaliperManager(DeployManager):
         self.__init_local_dir()
         shutil.copy(self.original_workload_file, self.local_datadir)
         self.workload_file = os.path.join(self.local_datadir, os.path.basename(self.original_workload_file))
-        self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
+        with self._step("connect"):
+            self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
         self.local_connections = HostManager.get_local_connections()
         if "docker" in self.local_connections:
             local_docker = self.local_connections["docker"]["client"]
             try:
                 local_zookeeper = local_docker.containers.get("zookeeper")
-                local_zookeeper.stop()
-                local_zookeeper.remove()
-                self.logger.info("Previous execution Zookeeper server found, stopped and removed")
+                self._remove_containers([local_zookeeper])
+                self.logger.info("Previous execution Zookeeper server found and removed")
             except docker.errors.NotFound:
                 self.logger.info("Zookeeper server not found")
             except:
@@ -177,7 +179,7 @@ class CaliperManager(DeployManager):
         local_docker = self.local_connections["docker"]["client"]
         try:
             caliper_server = local_docker.containers.get(self.docker_container_server_name)
-            caliper_server.remove(force=True)
+            self._remove_containers([caliper_server])
             self.logger.info("Caliper container found and removed")
         except docker.errors.APIError as error:
             if error.status_code == 404:
@@ -189,9 +191,9 @@ class CaliperManager(DeployManager):
         docker_client = self.hosts_connections[host]["docker"]["client"]
         try:
             zookeeper_client = docker_client.containers.get(self.docker_container_client_name)
-            zookeeper_client.stop()
-            zookeeper_client.remove()
-            self.logger.info("[{0}]Zookeeper client found, stopped and removed".format(host))
+            with self._step("docker.remove"):
+                self._remove_containers([zookeeper_client])
+            self.logger.info("[{0}]Zookeeper client found and removed".format(host))
         except docker.errors.APIError as error:
             if error.status_code == 404:
                 pass
@@ -243,14 +245,14 @@ if __name__ == "__main__":
     manager.init()
     manager.cleanup()
     manager.start()
-    manager.cmd_events[manager.CMD_START].wait()
+    manager.wait_cmd(manager.CMD_START)
     manager_adapter = CaliperEthereum(manager, "./caliper/ethereum.json")
     caliper_manager = CaliperManager(manager_adapter, "./caliper/config-ethereum.yaml")
     caliper_manager.parse_conf(os.environ)
     caliper_manager.init()
     caliper_manager.cleanup()
     caliper_manager.start()
-    caliper_manager.cmd_events[manager.CMD_START].wait()
+    caliper_manager.wait_cmd(manager.CMD_START)
     caliper_manager.stop()
     caliper_manager.deinit()
     manager.stop()
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+import tarfile
+
+class ChainSnapshots:
+
+    # Compressed chain databases of initialized nodes, kept on the controller. A snapshot is keyed by what determines
+    # its content but not the keys generated for it (genesis template, accounts count, client image), so that it's
+    # built once and then extracted on hosts instead of running the client init on each of them.
+    # A chain database is only usable with the accounts funded and sealing in its genesis: these, with the genesis
+    # itself, are stored in the snapshot as its identity, under IDENTITY_DIR, and restored by later deployments.
+
+    IDENTITY_DIR = "bc-benchmark-identity"
+
+    # Snapshots kept, least recently used ones are pruned
+    max_snapshots = 8
+
+    def __init__(self, snapshots_dir, compresslevel=6):
+        self.snapshots_dir = snapshots_dir
+        self.compresslevel = compresslevel
+        self.logger = logging.getLogger("ChainSnapshots")
+
+    @staticmethod
+    def key(spec):
+        # spec is a JSON serializable dict of what determines the snapshot content
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.snapshots_dir, "%s.tar.gz" % key)
+
+    def get(self, key):
+        snapshot_path = self.path(key)
+        if not os.path.isfile(snapshot_path):
+            return None
+        os.utime(snapshot_path)
+        return snapshot_path
+
+    def create(self, key, datadir, members, identity_dir=None):
+        # members are paths relative to datadir, extracting the snapshot in a datadir restores them. identity_dir
+        # files are stored first, so that extract_identity doesn't read through the chain database.
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        snapshot_path = self.path(key)
+        partial_path = snapshot_path + ".part"
+        with tarfile.open(partial_path, "w:gz", compresslevel=self.compresslevel) as snapshot:
+            if identity_dir is not None:
+                snapshot.add(identity_dir, arcname=self.IDENTITY_DIR)
+            for member in members:
+                if os.path.exists(os.path.join(datadir, member)):
+                    snapshot.add(os.path.join(datadir, member), arcname=member)
+        os.replace(partial_path, snapshot_path)
+        self.logger.info("Created snapshot %s (%d bytes)" % (snapshot_path, os.path.getsize(snapshot_path)))
+        self.prune()
+        return snapshot_path
+
+    def extract_identity(self, snapshot_path, target_dir):
+        # Extracts the snapshot identity in target_dir and returns its directory, None if the snapshot has none
+        members = []
+        with tarfile.open(snapshot_path, "r:gz") as snapshot:
+            for member in snapshot:
+                if member.name != self.IDENTITY_DIR and not member.name.startswith(self.IDENTITY_DIR + "/"):
+                    break
+                if ".." in member.name.split("/") or not (member.isfile() or member.isdir()):
+                    raise ValueError("Unexpected member %s in snapshot %s" % (member.name, snapshot_path))
+                members.append(member)
+            if not members:
+                return None
+            snapshot.extractall(target_dir, members=members)
+        return os.path.join(target_dir, self.IDENTITY_DIR)
+
+    def prune(self):
+        snapshots = [os.path.join(self.snapshots_dir, name) for name in os.listdir(self.snapshots_dir) if name.endswith(".tar.gz")]
+        snapshots.sort(key=os.path.getmtime, reverse=True)
+        for snapshot_path in snapshots[self.max_snapshots:]:
+            os.remove(snapshot_path)
+            self.logger.info("Pruned snapshot %s" % snapshot_path)
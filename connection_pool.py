@@ -0,0 +1,154 @@
+import docker
+from fabric import Connection
+import logging
+from threading import Lock, RLock
+import time
+
+class SharedConnection(Connection):
+
+    # fabric Connection shared by threads of several managers. Commands run concurrently, each on its own channel of
+    # the transport: only opening the transport and the sftp session is serialized, so that callers don't race on
+    # creating them.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._set(open_lock=RLock())
+
+    def open(self):
+        with self.open_lock:
+            return super().open()
+
+    def sftp(self):
+        with self.open_lock:
+            return super().sftp()
+
+class PooledConnection:
+
+    def __init__(self, host, docker_client, ssh):
+        self.host = host
+        self.docker_client = docker_client
+        self.ssh = ssh
+        self.leases = 0
+        # Evicted connections are out of the pool, and closed once their last lease is released
+        self.evicted = False
+        self.last_used = time.monotonic()
+        self.last_checked = time.monotonic()
+
+    def close(self):
+        self.docker_client.close()
+        self.ssh.close()
+
+class HostConnectionPool:
+
+    # Docker and ssh connections to hosts shared by every manager. A connection is leased by get_hosts_connections
+    # and must be released when the manager is done with the host. Idle connections are closed after idle_timeout.
+    # Health checks talk to the hosts outside the pool lock, so that a slow host doesn't hold up leases of the others.
+
+    def __init__(self, docker_port, ssh_username, idle_timeout=600, health_check_interval=30):
+        self.docker_port = docker_port
+        self.ssh_username = ssh_username
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._connections = {}
+        self._connections_lock = Lock()
+        self.logger = logging.getLogger("HostConnectionPool")
+
+    def lease(self, host):
+        # Returns a PooledConnection, to be given back to release
+        self.evict_idle()
+        with self._connections_lock:
+            connection = self.__lease_pooled(host)
+            check = connection is not None and time.monotonic() - connection.last_checked >= self.health_check_interval
+            if check:
+                # Other leases meanwhile skip the check
+                connection.last_checked = time.monotonic()
+        if check and not self.__healthy(connection):
+            self.logger.warning("[%s]Pooled connection is broken, reconnecting" % host)
+            self.evict(host, connection)
+            self.release(connection)
+            connection = None
+        if connection is None:
+            new_connection = PooledConnection(
+                host,
+                docker.DockerClient(base_url='tcp://%s:%d' % (host, self.docker_port)),
+                SharedConnection(host=host, user=self.ssh_username))
+            with self._connections_lock:
+                # Another lease may have connected meanwhile
+                connection = self.__lease_pooled(host)
+                if connection is None:
+                    connection = new_connection
+                    connection.leases += 1
+                    self._connections[host] = connection
+            if connection is not new_connection:
+                self.__close(new_connection)
+            else:
+                self.logger.debug("[%s]New pooled connection" % host)
+        return connection
+
+    def release(self, connection):
+        with self._connections_lock:
+            connection.leases = max(connection.leases - 1, 0)
+            connection.last_used = time.monotonic()
+            close = connection.evicted and connection.leases == 0
+        if close:
+            self.__close(connection)
+            self.logger.debug("[%s]Evicted connection closed on last release" % connection.host)
+
+    def evict(self, host, connection=None):
+        # Takes the host connection, or the given one, out of the pool. Next leases get a new connection, while the
+        # evicted one is closed when its holders have all released it.
+        with self._connections_lock:
+            if connection is None:
+                connection = self._connections.get(host)
+            if connection is None:
+                return
+            if self._connections.get(host) is connection:
+                del self._connections[host]
+            connection.evicted = True
+            close = connection.leases == 0
+        if close:
+            self.__close(connection)
+        self.logger.info("[%s]Connection evicted" % host)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._connections_lock:
+            idle = [host for host, connection in self._connections.items() if connection.leases == 0 and now - connection.last_used > self.idle_timeout]
+            evicted = [self._connections.pop(host) for host in idle]
+            for connection in evicted:
+                connection.evicted = True
+        for connection in evicted:
+            self.__close(connection)
+            self.logger.debug("[%s]Idle connection closed" % connection.host)
+
+    def close_all(self):
+        with self._connections_lock:
+            connections = list(self._connections.values())
+            self._connections = {}
+        for connection in connections:
+            self.__close(connection)
+
+    def __lease_pooled(self, host):
+        # Called holding the pool lock
+        connection = self._connections.get(host)
+        if connection is not None:
+            connection.leases += 1
+            connection.last_used = time.monotonic()
+        return connection
+
+    def __healthy(self, connection):
+        try:
+            connection.docker_client.ping()
+        except Exception as error:
+            self.logger.debug("[%s]Docker ping failed: %s" % (connection.host, error))
+            return False
+        # A dropped ssh transport is reopened by fabric on next command, a stale one is not
+        if connection.ssh.is_connected is False and connection.ssh.transport is not None:
+            connection.ssh.close()
+        return True
+
+    def __close(self, connection):
+        try:
+            connection.close()
+        except Exception as error:
+            self.logger.debug("[%s]Error closing connection: %s" % (connection.host, error))
@@ -1,26 +1,67 @@
+from concurrent import futures
+import docker
+import functools
 import logging
+import os
 from queue import Queue
-from threading import Event, Thread
-import time
+from threading import Event, Lock, Thread
 
+from deploy_metrics import DeployMetrics
 from docker_images_name_resolver import DockerImagesNameResolver
+from file_transfer import FanOutDistributor
+from host_manager import HostManager
+from network_readiness import NetworkReadiness
+from retry_policy import RetryPolicy
+from stage_scheduler import StageScheduler
+from topology import Topology
+from worker_pool import WorkerPool
 
 # TODO: catch SIGINT/SIGKILL signals
 # TODO: create events for each stage
 
 class DeployManager:
 
-    N_DEPLOYER_THREADS = 4
-    DEPLOYER_STOP_SIMBOL = "--STOP--"
+    DEFAULT_STAGE_CONCURRENCY = 4
 
     CMD_INIT = "init"
     CMD_CLEANUP = "cleanup"
     CMD_START = "start"
     CMD_STOP = "stop"
+    CMD_RESET = "reset"
     CMD_DEINIT = "deinit"
     CMD_CLOSE = "close"
 
-    AVAILABLE_CMDS = {CMD_INIT, CMD_CLEANUP, CMD_START, CMD_STOP, CMD_DEINIT, CMD_CLOSE}
+    AVAILABLE_CMDS = {CMD_INIT, CMD_CLEANUP, CMD_START, CMD_STOP, CMD_RESET, CMD_DEINIT, CMD_CLOSE}
+    TEARDOWN_CMDS = {CMD_CLEANUP, CMD_STOP, CMD_DEINIT}
+
+    STAGE_PREFETCH = "prefetch"
+
+    # Max parallel loop calls for each command. Commands not listed use DEFAULT_STAGE_CONCURRENCY, or
+    # teardown_concurrency for TEARDOWN_CMDS, that mostly wait on remote docker daemons.
+    stage_concurrency = {}
+    teardown_concurrency = 64
+    # Seconds containers get to exit on their own when removed by _remove_containers, before being killed.
+    # 0 kills them right away: benchmark nodes have nothing worth a clean shutdown.
+    stop_timeout = 0
+    # Seconds between two consecutive loop calls of the same command. 0 disables the ramp.
+    stage_ramp_interval = {}
+    # Setup, teardown and whole-command methods are barriers: they wait for everything scheduled before them and
+    # everything scheduled after waits for them. Loops instead flow host by host. Loops listed here don't wait for
+    # previous teardowns either, apart from the ones they name, e.g. {"start_loop": ("init_teardown",)}.
+    pipelined_stages = {}
+    # RetryPolicy of each command stages. Commands not listed are tried once.
+    stage_retry = {}
+    # Commands whose failed loops can be moved to a spare host, when a HostManager is given with enable_host_replacement
+    replaceable_cmds = set()
+    # Commands already run on a failed host that are run again on its replacement, before the failed command
+    replay_on_replacement = (CMD_CLEANUP,)
+    # dinr keys of the images run on the hosts. During init they are pulled on every host, so that start doesn't
+    # measure image downloads. Hosts already holding the image digest are skipped.
+    images = ()
+    # Max parallel host pulls
+    prefetch_concurrency = 16
+    # Files sent to every host that are at least this big are spread host to host by _distribute_files
+    fanout_min_size = 16 * 1024 * 1024
 
     def __init__(self, hosts):
         self.hosts = hosts
@@ -29,10 +70,87 @@ class DeployManager:
         self.enable_cmd(self.CMD_INIT)
         self.logger = logging.getLogger("DeployManager")
         self.dinr = DockerImagesNameResolver()
+        # cmd_events are set when commands succeed, errors of failed ones are kept in cmd_errors. See wait_cmd.
         self.cmd_events = {}
+        self._cmd_done = {}
         for cmd in self.AVAILABLE_CMDS:
             self.cmd_events[cmd] = Event()
+            self._cmd_done[cmd] = Event()
+        self.cmd_errors = {}
+        # Latest command with a running stage
         self.current_stage = False
+        self._cmd_index = 0
+        self._current_cmd_index = 0
+        self._current_stage_lock = Lock()
+        self.metrics = DeployMetrics()
+        # Peers of blockchain nodes, for managers that configure them
+        self.topology = Topology()
+        # Criterion of _wait_network_ready
+        self.network_readiness = NetworkReadiness()
+        self.stage_concurrency = self.stage_concurrency.copy()
+        self.stage_ramp_interval = self.stage_ramp_interval.copy()
+        self.stage_retry = self.stage_retry.copy()
+        self._pool = None
+        self.host_manager = None
+        self.failed_hosts = set()
+        self._replaced_hosts = {}
+        self._host_history = {}
+        self._hosts_lock = Lock()
+        self._image_digests = {}
+        self._image_digests_lock = Lock()
+
+    def parse_conf(self, conf_as_dict):
+        if "DEPLOYER_THREADS" in conf_as_dict:
+            self.DEFAULT_STAGE_CONCURRENCY = int(conf_as_dict["DEPLOYER_THREADS"])
+        if any(key.startswith("READY_") for key in conf_as_dict):
+            self.network_readiness = NetworkReadiness.from_conf(conf_as_dict)
+        if "TOPOLOGY" in conf_as_dict:
+            self.topology = Topology.from_conf(conf_as_dict)
+        if "DEPLOYER_THREADS_PREFETCH" in conf_as_dict:
+            self.prefetch_concurrency = int(conf_as_dict["DEPLOYER_THREADS_PREFETCH"])
+        if "DEPLOYER_THREADS_TEARDOWN" in conf_as_dict:
+            self.teardown_concurrency = int(conf_as_dict["DEPLOYER_THREADS_TEARDOWN"])
+        if "DEPLOYER_STOP_TIMEOUT" in conf_as_dict:
+            self.stop_timeout = int(conf_as_dict["DEPLOYER_STOP_TIMEOUT"])
+        if "DEPLOYER_FANOUT_MIN_MB" in conf_as_dict:
+            self.fanout_min_size = int(float(conf_as_dict["DEPLOYER_FANOUT_MIN_MB"]) * 1024 * 1024)
+        if "DEPLOYER_RAMP_INTERVAL" in conf_as_dict:
+            ramp_interval = float(conf_as_dict["DEPLOYER_RAMP_INTERVAL"])
+            for cmd in self.AVAILABLE_CMDS:
+                self.stage_ramp_interval.setdefault(cmd, ramp_interval)
+        for cmd in self.AVAILABLE_CMDS:
+            key = "DEPLOYER_THREADS_%s" % cmd.upper()
+            if key in conf_as_dict:
+                self.stage_concurrency[cmd] = int(conf_as_dict[key])
+        if "DEPLOYER_RETRY_ATTEMPTS" in conf_as_dict:
+            retry_policy = RetryPolicy(
+                attempts=int(conf_as_dict["DEPLOYER_RETRY_ATTEMPTS"]),
+                backoff=float(conf_as_dict.get("DEPLOYER_RETRY_BACKOFF", 1)),
+                timeout=float(conf_as_dict["DEPLOYER_RETRY_TIMEOUT"]) if "DEPLOYER_RETRY_TIMEOUT" in conf_as_dict else None)
+            for cmd in self.AVAILABLE_CMDS:
+                self.stage_retry.setdefault(cmd, retry_policy)
+
+    def set_stage_concurrency(self, cmd, workers, ramp_interval=None):
+        if cmd not in self.AVAILABLE_CMDS:
+            raise ValueError("{0} isn't an available command".format(cmd))
+        if workers < 1:
+            raise ValueError("At least one worker is required, given {0}".format(workers))
+        self.stage_concurrency[cmd] = workers
+        if ramp_interval is not None:
+            self.stage_ramp_interval[cmd] = ramp_interval
+        if self._pool is not None:
+            self.logger.warning("Worker pool already running, {0} concurrency will apply from next init".format(cmd))
+
+    def set_stage_retry(self, cmd, attempts, backoff=1, timeout=None):
+        if cmd not in self.AVAILABLE_CMDS:
+            raise ValueError("{0} isn't an available command".format(cmd))
+        self.stage_retry[cmd] = RetryPolicy(attempts=attempts, backoff=backoff, timeout=timeout)
+
+    def set_topology(self, topology):
+        self.topology = topology
+
+    def enable_host_replacement(self, host_manager):
+        self.host_manager = host_manager
 
     def enable_cmd(self, *commands):
         for cmd in commands:
@@ -63,8 +181,14 @@ class DeployManager:
         
     def init(self, **kwargs):
         self.check_enabled(self.CMD_INIT, raiseException=True)
+        self._pool = self.__create_pool()
+        self.failed_hosts = set()
+        self._replaced_hosts = {}
+        self._host_history = {}
+        self._image_digests = {}
         self.__cmd_th = Thread(target=self._main_cmd_thread)
         self.__cmd_th.start()
+        self.__reset_cmd_state(self.CMD_INIT)
         self.cmd_queue.put({
             "type": self.CMD_INIT,
             "args": kwargs
@@ -75,26 +199,39 @@ class DeployManager:
 
     def start(self, **kwargs):
         self.check_enabled(self.CMD_START, raiseException=True)
+        self.__reset_cmd_state(self.CMD_START)
         self.cmd_queue.put({
             "type": self.CMD_START,
             "args": kwargs
         })
         self.disable_cmd(self.CMD_START, self.CMD_CLEANUP, self.CMD_DEINIT)
-        self.enable_cmd(self.CMD_STOP)
+        self.enable_cmd(self.CMD_STOP, self.CMD_RESET)
         self.logger.debug("Start enqueued")
 
     def stop(self, **kwargs):
         self.check_enabled(self.CMD_STOP, raiseException=True)
+        self.__reset_cmd_state(self.CMD_STOP)
         self.cmd_queue.put({
             "type": self.CMD_STOP,
             "args": kwargs
         })
-        self.disable_cmd(self.CMD_STOP)
+        self.disable_cmd(self.CMD_STOP, self.CMD_RESET)
         self.enable_cmd(self.CMD_START, self.CMD_CLEANUP, self.CMD_DEINIT)
         self.logger.debug("Stop enqueued")
 
+    def reset(self, **kwargs):
+        # Rewinds the running network to its genesis state, restarting the same nodes in place
+        self.check_enabled(self.CMD_RESET, raiseException=True)
+        self.__reset_cmd_state(self.CMD_RESET)
+        self.cmd_queue.put({
+            "type": self.CMD_RESET,
+            "args": kwargs
+        })
+        self.logger.debug("Reset enqueued")
+
     def cleanup(self, **kwargs):
         self.check_enabled(self.CMD_CLEANUP, raiseException=True)
+        self.__reset_cmd_state(self.CMD_CLEANUP)
         self.cmd_queue.put({
             "type": self.CMD_CLEANUP,
             "args": kwargs
@@ -103,6 +240,7 @@ class DeployManager:
     
     def deinit(self, **kwargs):
         self.check_enabled(self.CMD_DEINIT, raiseException=True)
+        self.__reset_cmd_state(self.CMD_DEINIT)
         self.cmd_queue.put({
             "type": self.CMD_DEINIT,
             "args": kwargs
@@ -112,57 +250,337 @@ class DeployManager:
         self.enable_cmd(self.CMD_INIT)
         self.logger.debug("Deinit enqueued")
     
+    def wait_cmd(self, cmd, timeout=None):
+        # Blocks until cmd ends, raising an error if it failed
+        if not self._cmd_done[cmd].wait(timeout):
+            raise TimeoutError("{0} didn't end in {1}s".format(cmd, timeout))
+        if cmd in self.cmd_errors:
+            raise RuntimeError("{0} failed: {1}".format(cmd, self.cmd_errors[cmd]))
+
     def _main_cmd_thread(self):
+        self.__init_graph()
         cmd = self.cmd_queue.get()
         while cmd["type"] != self.CMD_CLOSE:
-            self.logger.debug("Executing %s" % cmd["type"])
-            self.current_stage = cmd["type"]
+            self.logger.debug("Scheduling %s" % cmd["type"])
+            self._cmd_index += 1
+            self.__reset_cmd_state(cmd["type"])
             cmd_method = getattr(self, "_%s" % cmd["type"], self._cmd)
             if cmd_method == self._cmd:
-                cmd_method(cmd["type"], cmd["args"])
+                nodes = cmd_method(cmd["type"], cmd["args"])
             else:
-                cmd_method(**cmd["args"])
-            # Calling start will reset stop and viceversa
-            if cmd["type"] == self.CMD_START:
-                self.cmd_events[self.CMD_STOP].clear()
-            elif cmd["type"] == self.CMD_STOP:
-                self.cmd_events[self.CMD_START].clear()
-            self.cmd_events[cmd["type"]].set()
+                nodes = [self.__schedule_barrier(cmd["type"], cmd["type"], self.__exec_cmd_method, cmd["type"], cmd_method, cmd["args"])]
+            if cmd["type"] == self.CMD_INIT:
+                nodes.extend(self.__schedule_prefetch())
+            self._scheduler.gather(nodes).add_done_callback(functools.partial(self.__cmd_completed, cmd["type"]))
             cmd = self.cmd_queue.get()
+        futures.wait(self.__outstanding())
+        self._pool.shutdown()
+        self._pool = None
         self.current_stage = self.CMD_CLOSE
         self.cmd_events[self.CMD_CLOSE].set()
+        self._cmd_done[self.CMD_CLOSE].set()
         self.logger.debug("Manager closed")
 
     def _cmd(self, cmd, args): #TODO: separe args namespaces
-        self.__exec_stage_method(cmd, "setup", args)
-        deployers = []
-        host_queue = Queue()
+        nodes = []
+        for stage in ["setup", "loop", "teardown"]:
+            if not self.__has_stage(cmd, stage):
+                self.__exec_stage_not_present(cmd, stage)
+            elif stage == "loop":
+                for host in self.hosts:
+                    loop_args = args.copy()
+                    loop_args["host"] = host
+                    nodes.append(self.__schedule_loop(cmd, host, loop_args))
+            else:
+                nodes.append(self.__schedule_barrier(cmd, "{0}_{1}".format(cmd, stage), self.__exec_stage_method, cmd, stage, args))
+        return nodes
+
+    def __cmd_completed(self, cmd, gathered):
+        # Calling start will reset stop and viceversa
+        if cmd == self.CMD_START:
+            self.__reset_cmd_state(self.CMD_STOP)
+        elif cmd == self.CMD_STOP:
+            self.__reset_cmd_state(self.CMD_START)
+        error = gathered.exception()
+        if error is None:
+            self.logger.debug("Executed %s" % cmd)
+            self.cmd_events[cmd].set()
+        else:
+            self.logger.error("%s failed: %s" % (cmd, error))
+            self.cmd_errors[cmd] = error
+        self._cmd_done[cmd].set()
+
+    def __reset_cmd_state(self, cmd):
+        # On enqueue, so that wait_cmd right after waits for this run, and again when scheduled
+        self.cmd_events[cmd].clear()
+        self._cmd_done[cmd].clear()
+        self.cmd_errors.pop(cmd, None)
+
+    def __schedule(self, key, cmd, name, fn, args, depends_on, requires):
+        # Teardown commands run whatever failed before them, to clean up what they can
+        if cmd in self.TEARDOWN_CMDS:
+            requires = ()
+        return self._scheduler.schedule(key, name, self.__run_stage, (self._cmd_index, cmd, fn, args), depends_on=depends_on, requires=requires)
+
+    def __run_stage(self, cmd_index, cmd, fn, args):
+        with self._current_stage_lock:
+            if cmd_index >= self._current_cmd_index:
+                self._current_cmd_index = cmd_index
+                self.current_stage = cmd
+        return fn(*args)
+
+    def __init_graph(self):
+        self._scheduler = StageScheduler(self._pool)
+        self._barrier = None # Last scheduled barrier of any kind
+        self._setup_barrier = None # Last scheduled barrier that is not a teardown
+        self._barrier_nodes = {}
+        self._host_lanes = {}
+        self._outstanding = []
+
+    def __outstanding(self):
+        self._outstanding = [node for node in self._outstanding if not node.done()]
+        return self._outstanding
+
+    def __schedule_barrier(self, cmd, name, fn, *args):
+        node = self.__schedule(cmd, cmd, name, fn, args, self.__outstanding(), [self._barrier])
+        self._outstanding = [node]
+        self._barrier = node
+        if not name.endswith("_teardown"):
+            self._setup_barrier = node
+        self._barrier_nodes[name] = node
+        return node
+
+    def __schedule_loop(self, cmd, host, args):
+        name = "{0}_loop".format(cmd)
+        if name in self.pipelined_stages:
+            requires = [self._setup_barrier]
+            requires.extend([self._barrier_nodes.get(barrier) for barrier in self.pipelined_stages[name]])
+        else:
+            requires = [self._barrier]
+        # A failed loop on the same host only delays this one: the host is skipped if it was marked failed
+        node = self.__schedule(cmd, cmd, "[{0}]{1}".format(host, name), self.__exec_stage_method, (cmd, "loop", args), [self._host_lanes.get(host)], requires)
+        self._host_lanes[host] = node
+        self._outstanding.append(node)
+        return node
+
+    def __schedule_prefetch(self):
+        # Pulls run on each host lane once init setup has opened the connections, so that the host's first loop
+        # after init waits for its images, while the other hosts keep going
+        nodes = []
+        if not self.images:
+            return nodes
         for host in self.hosts:
-            host_queue.put(host)
-        for _ in range(min(self.N_DEPLOYER_THREADS, len(self.hosts))):
-            deployer = Thread(target=self.__cmd_loop_thread, args=(cmd, host_queue, args,))
-            deployer.start()
-            deployers.append(deployer)
-            host_queue.put(self.DEPLOYER_STOP_SIMBOL) # The stop signal for the _start_node_thread
-            time.sleep(1) # TODO: this should be configurable
-        for deployer in deployers:
-            deployer.join()
-        self.__exec_stage_method(cmd, "teardown", args)
-    
-    def __cmd_loop_thread(self, cmd, host_queue, args):
-        host = host_queue.get()
-        while host != self.DEPLOYER_STOP_SIMBOL:
-            loop_args = args.copy()
-            loop_args["host"] = host
-            self.__exec_stage_method(cmd, "loop", loop_args)
-            host = host_queue.get()
+            name = "[{0}]{1}_{2}".format(host, self.CMD_INIT, self.STAGE_PREFETCH)
+            node = self.__schedule(self.STAGE_PREFETCH, self.CMD_INIT, name, self.__exec_prefetch, (host,), [self._host_lanes.get(host)], [self._setup_barrier])
+            self._host_lanes[host] = node
+            self._outstanding.append(node)
+            nodes.append(node)
+        return nodes
+
+    def __create_pool(self):
+        concurrency = {}
+        for cmd in self.AVAILABLE_CMDS:
+            concurrency[cmd] = self._cmd_concurrency(cmd)
+        concurrency[self.STAGE_PREFETCH] = self.prefetch_concurrency
+        pool = WorkerPool(max(concurrency.values()), name=type(self).__name__)
+        for cmd, workers in concurrency.items():
+            pool.set_limit(cmd, workers, self.stage_ramp_interval.get(cmd, 0))
+        return pool
+
+    def _cmd_concurrency(self, cmd):
+        default_concurrency = self.teardown_concurrency if cmd in self.TEARDOWN_CMDS else self.DEFAULT_STAGE_CONCURRENCY
+        return self.stage_concurrency.get(cmd, default_concurrency)
+
+    def _step(self, step, host=None):
+        # Times a sub-step of the stage call running on this thread, e.g. with self._step("docker.run"):
+        return self.metrics.step(step, host)
+
+    def __exec_cmd_method(self, cmd, cmd_method, args):
+        with self.metrics.stage(cmd, None):
+            cmd_method(**args)
+
+    def __exec_prefetch(self, host):
+        self.__exec_with_retry(self.CMD_INIT, self.STAGE_PREFETCH, self._prefetch_images, {"host": host})
+
+    def _prefetch_images(self, host):
+        docker_client = self.hosts_connections[host]["docker"]["client"]
+        for key in self.images:
+            image = self.dinr.resolve(key)
+            digest = self.__image_digest(docker_client, key, image)
+            if self.__holds_image(docker_client, image, digest):
+                self.logger.debug("[{0}]{1} already present".format(host, image))
+                continue
+            with self._step("docker.pull"):
+                docker_client.images.pull(image)
+            self.logger.info("[{0}]Pulled {1}".format(host, image))
+
+    def __image_digest(self, docker_client, key, image):
+        # Pinned digests come from dinr.yaml, tags are resolved against the registry once per deployment
+        digest = self.dinr.get_digest(key)
+        if digest:
+            return digest
+        with self._image_digests_lock:
+            if image in self._image_digests:
+                return self._image_digests[image]
+        try:
+            digest = docker_client.images.get_registry_data(image).id
+        except docker.errors.APIError as error:
+            self.logger.warning("Can't resolve {0} digest, hosts holding any {0} are skipped: {1}".format(image, error))
+            digest = None
+        with self._image_digests_lock:
+            self._image_digests[image] = digest
+        return digest
+
+    @staticmethod
+    def __holds_image(docker_client, image, digest):
+        try:
+            local_image = docker_client.images.get(image)
+        except docker.errors.ImageNotFound:
+            return False
+        if digest is None:
+            return True
+        return any(repo_digest.endswith("@" + digest) for repo_digest in local_image.attrs.get("RepoDigests", []))
+
+    def __has_stage(self, cmd, stage):
+        return hasattr(self, "_{0}_{1}".format(cmd, stage))
+
+    def _deinit_loop(self, host):
+        # Connections go back to the shared pool. Managers overriding this must call it.
+        if hasattr(self, "hosts_connections") and host in self.hosts_connections:
+            HostManager.release_hosts_connections({host: self.hosts_connections.pop(host)})
+
+    def _distribute_files(self, *local_paths):
+        # Primes the hosts' upload cache with files all of them will receive, so that per-host uploads just link them.
+        # Hosts the distribution misses get the files from the controller on their upload.
+        large_paths = [local_path for local_path in local_paths if os.path.getsize(local_path) >= self.fanout_min_size]
+        if not large_paths:
+            return
+        distributor = FanOutDistributor({host: self.hosts_connections[host]["ssh"] for host in self.hosts if host not in self.failed_hosts})
+        for local_path in large_paths:
+            with self._step("ssh.fanout"):
+                distributor.distribute(local_path)
+
+    def _run_on_hosts(self, cmd, stage, fn):
+        # Calls fn(host) on every working host in parallel and waits for all of them, for barrier stages that must act
+        # on all the hosts before loops go on. Errors are raised after all the calls end.
+        hosts = [host for host in self.hosts if host not in self.failed_hosts]
+        def run(host):
+            with self.metrics.stage(cmd, stage, host):
+                fn(host)
+        workers = self._cmd_concurrency(cmd)
+        with futures.ThreadPoolExecutor(max_workers=max(min(workers, len(hosts)), 1)) as executor:
+            calls = [executor.submit(run, host) for host in hosts]
+        for call in calls:
+            call.result()
+
+    def _remove_containers(self, containers):
+        # Removes containers in parallel, each with a single call when stop_timeout is 0. Containers already gone
+        # are skipped. Errors are raised after all the removals end.
+        containers = list(containers)
+        if not containers:
+            return
+        with futures.ThreadPoolExecutor(max_workers=len(containers)) as executor:
+            removals = [executor.submit(self.__remove_container, container) for container in containers]
+        for removal in removals:
+            removal.result()
+
+    def __remove_container(self, container):
+        try:
+            if self.stop_timeout > 0:
+                container.stop(timeout=self.stop_timeout)
+            container.remove(force=True)
+        except docker.errors.NotFound:
+            pass
+
+    def _remove_remote_dirs(self, host, *paths):
+        # Deletes all the paths, shell patterns allowed, in one ssh round trip. sudo as containers write as root.
+        self.hosts_connections[host]["ssh"].sudo("rm -rf %s" % " ".join(paths), hide=True)
+
+    def _wait_network_ready(self, nodes, expected_peers, cmd=CMD_START, since=None):
+        # Blocks until the network meets network_readiness criterion, recording its warm-up times since since,
+        # by default when cmd began. Raises TimeoutError if it doesn't within the network_readiness timeout, so that
+        # cmd fails instead of releasing benchmarks on a network that isn't ready.
+        since = self.metrics.first_start(cmd) if since is None else since
+        with self._step("network.ready"):
+            report = self.network_readiness.wait(nodes, expected_peers, since)
+        for key in ["time_to_first_block", "time_to_full_mesh"]:
+            if report[key] is not None:
+                self.metrics.record(cmd, "teardown", None, key, since, report[key])
+        if not report["ready"]:
+            raise TimeoutError("Network not ready after {0}s".format(self.network_readiness.timeout))
+        return report["ready"]
+
+    def _replace_host(self, failed_host, new_host):
+        # Moves per-host state from the failed host to its replacement. Managers extend it for their own state.
+        self.hosts[self.hosts.index(failed_host)] = new_host
+        if hasattr(self, "hosts_connections"):
+            self.hosts_connections.update(HostManager.get_hosts_connections([new_host]))
+            if failed_host in self.hosts_connections:
+                HostManager.release_hosts_connections({failed_host: self.hosts_connections.pop(failed_host)}, evict=True)
 
     def __exec_stage_method(self, cmd, stage, args):
         stage_method = getattr(self, "_{0}_{1}".format(cmd, stage), self.__exec_stage_not_present)
         if stage_method == self.__exec_stage_not_present:
             stage_method(cmd, stage)
+        elif stage == "loop":
+            self.__exec_loop(cmd, stage_method, args)
+        else:
+            self.__exec_with_retry(cmd, stage, stage_method, args)
+
+    def __exec_with_retry(self, cmd, stage, stage_method, args):
+        retry_policy = self.stage_retry.get(cmd)
+        def attempt():
+            with self.metrics.stage(cmd, stage, args.get("host")):
+                stage_method(**args)
+        if retry_policy is None:
+            attempt()
         else:
-            stage_method(**args)
+            name = "[{0}]{1}_{2}".format(args["host"], cmd, stage) if "host" in args else "{0}_{1}".format(cmd, stage)
+            retry_policy.call(name, attempt)
+
+    def __exec_loop(self, cmd, stage_method, args):
+        args = args.copy()
+        with self._hosts_lock:
+            while args["host"] in self._replaced_hosts:
+                args["host"] = self._replaced_hosts[args["host"]]
+        host = args["host"]
+        if host in self.failed_hosts:
+            self.logger.warning("[{0}]Skipping {1} on failed host".format(host, cmd))
+            return
+        try:
+            self.__exec_with_retry(cmd, "loop", stage_method, args)
+        except Exception:
+            new_host = self.__replace_failed_host(cmd, host)
+            if not new_host:
+                self.failed_hosts.add(host)
+                raise
+            replayed_cmds = [previous for previous in self._host_history.get(host, []) if previous in self.replay_on_replacement]
+            host = new_host
+            args["host"] = new_host
+            try:
+                if self.images:
+                    self.__exec_prefetch(new_host)
+                for previous_cmd in replayed_cmds:
+                    self.__exec_with_retry(previous_cmd, "loop", getattr(self, "_{0}_loop".format(previous_cmd)), {"host": new_host})
+                self.__exec_with_retry(cmd, "loop", stage_method, args)
+            except Exception:
+                self.failed_hosts.add(host)
+                raise
+            self._host_history[host] = replayed_cmds
+        self._host_history.setdefault(host, []).append(cmd)
+
+    def __replace_failed_host(self, cmd, host):
+        if self.host_manager is None or cmd not in self.replaceable_cmds:
+            return False
+        new_host = self.host_manager.replace_host(host)
+        if not new_host:
+            self.logger.error("[{0}]No spare host available to replace it".format(host))
+            return False
+        self.logger.warning("[{0}]Replacing failed host with {1}".format(host, new_host))
+        with self._hosts_lock:
+            self._replaced_hosts[host] = new_host
+            self._replace_host(host, new_host)
+        return new_host
     
     def __exec_stage_not_present(self, cmd, stage):
         # If you don't really need it, you can suppress this log entry implementing the method with pass as body.
@@ -0,0 +1,98 @@
+from contextlib import contextmanager
+from threading import Lock, local
+import time
+
+class DeployMetrics:
+
+    # Wall-clock spans of a deployment. A span is a whole stage call when step is None, otherwise a sub-step
+    # (docker API call, ssh command, ...) of the stage call running on the same thread.
+
+    PROMETHEUS_PREFIX = "bc_deploy"
+
+    def __init__(self):
+        self._spans = []
+        self._spans_lock = Lock()
+        self._context = local()
+
+    @contextmanager
+    def stage(self, command, stage, host=None):
+        previous = getattr(self._context, "current", None)
+        self._context.current = (command, stage, host)
+        try:
+            with self.__span(command, stage, host, None):
+                yield
+        finally:
+            self._context.current = previous
+
+    @contextmanager
+    def step(self, step, host=None):
+        command, stage, stage_host = getattr(self._context, "current", (None, None, None))
+        with self.__span(command, stage, host if host is not None else stage_host, step):
+            yield
+
+    def record(self, command, stage, host, step, start, duration, ok=True):
+        with self._spans_lock:
+            self._spans.append({
+                "command": command,
+                "stage": stage,
+                "host": host,
+                "step": step,
+                "start": start,
+                "duration": duration,
+                "ok": ok
+            })
+
+    def first_start(self, command):
+        starts = [span["start"] for span in self.get_spans() if span["command"] == command]
+        return min(starts) if starts else None
+
+    def get_spans(self):
+        with self._spans_lock:
+            return [span.copy() for span in self._spans]
+
+    def to_prometheus(self, labels=None):
+        base_labels = labels if labels is not None else {}
+        durations = {}
+        failures = {}
+        for span in self.get_spans():
+            span_labels = base_labels.copy()
+            for key in ["command", "stage", "host", "step"]:
+                span_labels[key] = span[key] if span[key] is not None else ""
+            key = self.__format_labels(span_labels)
+            total, count = durations.get(key, (0, 0))
+            durations[key] = (total + span["duration"], count + 1)
+            failures[key] = failures.get(key, 0) + (0 if span["ok"] else 1)
+        lines = []
+        for key, (total, count) in durations.items():
+            lines.append("%s_duration_seconds_sum%s %f" % (self.PROMETHEUS_PREFIX, key, total))
+            lines.append("%s_duration_seconds_count%s %d" % (self.PROMETHEUS_PREFIX, key, count))
+            lines.append("%s_failures_total%s %d" % (self.PROMETHEUS_PREFIX, key, failures[key]))
+        return lines
+
+    @classmethod
+    def prometheus_header(cls):
+        return [
+            "# HELP %s_duration_seconds Wall-clock time spent in deploy stages and their steps" % cls.PROMETHEUS_PREFIX,
+            "# TYPE %s_duration_seconds summary" % cls.PROMETHEUS_PREFIX,
+            "# HELP %s_failures_total Deploy stages and steps that raised an error" % cls.PROMETHEUS_PREFIX,
+            "# TYPE %s_failures_total counter" % cls.PROMETHEUS_PREFIX
+        ]
+
+    @contextmanager
+    def __span(self, command, stage, host, step):
+        start = time.time()
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(command, stage, host, step, start, time.monotonic() - started, ok)
+
+    @staticmethod
+    def __format_labels(labels):
+        formatted = []
+        for key, value in sorted(labels.items()):
+            value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+            formatted.append("%s=\"%s\"" % (key, value))
+        return "{%s}" % ",".join(formatted)
@@ -4,15 +4,37 @@ class DockerImagesNameResolver:
     class __DockerImagesNameResolver:
         def __init__(self):
             with open("dinr.yaml") as dinr_file:
-                self.storage = yaml.load(dinr_file)
+                self.storage = yaml.safe_load(dinr_file)
                 #TODO check that when there is the registry key, also the image key is present
+            self.mirror = None
         
         def resolve(self, key):
             if isinstance(self.storage["images"][key], dict):
-                return "{registry}/{image}".format_map(self.storage["images"][key])
+                name = "{registry}/{image}".format_map(self.storage["images"][key])
+                digest = self.storage["images"][key].get("digest")
+                if digest:
+                    # A pinned image is pulled by digest, the tag is just a label
+                    if ":" in name.rsplit("/", 1)[-1]:
+                        name = name.rsplit(":", 1)[0]
+                    name = "{0}@{1}".format(name, digest)
             else:
-                return "{0}/{1}".format(self.storage["registry"], self.storage["images"][key])
+                name = "{0}/{1}".format(self.storage["registry"], self.storage["images"][key])
+            if self.mirror:
+                return "{0}/{1}".format(self.mirror, name)
+            return name
+
+        def get_digest(self, key):
+            if isinstance(self.storage["images"][key], dict):
+                return self.storage["images"][key].get("digest")
+            return None
         
+        def resolve_all(self):
+            return {key: self.resolve(key) for key in self.storage["images"]}
+
+        def set_mirror(self, mirror):
+            # Registry (e.g. a pull-through cache on the controller) prefixed to every image name
+            self.mirror = mirror
+
         def set_global_registry(self, registry):
             self.storage["registry"] = registry
 
@@ -13,11 +13,15 @@ class EthereumNode:
 
     WEB3_PROTOCOL = "http" # TODO Support also the other protocols
     WEB3_PORT = 8545
+    P2P_PORT = 30303
 
-    def __init__(self, host, node_type):
+    def __init__(self, host, node_type, port=WEB3_PORT, p2p_port=P2P_PORT):
         self.host = host
-        self.web3 = Web3(HTTPProvider("%s://%s:%s" % (self.WEB3_PROTOCOL, host, self.WEB3_PORT)))
+        self.port = port
+        self.p2p_port = p2p_port
+        self.web3 = Web3(HTTPProvider("%s://%s:%s" % (self.WEB3_PROTOCOL, host, port)))
         self.enode = ""
+        self.nodekey = None # Private key of the node p2p identity, when generated by the manager
         self.account = ("", "") # (account, password)
         self.status = self.STATUS_STOPPED
         self.node_type = node_type
@@ -54,9 +58,10 @@ class EthereumNode:
                 else:
                     requested_enode = self.web3.admin.nodeInfo["enode"]
                 self.status = self.STATUS_STARTED
+                # The node reports its container address and port, peers reach it through the host mapped port
                 at_index = requested_enode.find("@")
-                port_index = requested_enode.find(":30303")
-                self.enode = requested_enode[0:at_index+1] + self.host + requested_enode[port_index:]
+                port_end_index = requested_enode.find(":%d" % self.P2P_PORT) + len(":%d" % self.P2P_PORT)
+                self.enode = "%s%s:%d%s" % (requested_enode[0:at_index+1], self.host, self.p2p_port, requested_enode[port_end_index:])
                 return True
             except Exception as e: #TODO should see if it is worth to continue basing on which exception is raised
                 if wait:
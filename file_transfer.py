@@ -0,0 +1,260 @@
+import hashlib
+import io
+import logging
+import os
+import shlex
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+class BulkUploader:
+
+    # Packs all the files a host needs in one tar, written straight into a single ssh command as it is built,
+    # instead of one sftp round trip per file. Files are read in chunks, so large ones never sit in memory.
+    # With the cache enabled files are stored on the host once, named by their sha256 and mode, and copied into place:
+    # a batched call asks which digests the host lacks and only those are shipped. Cached blobs are write protected.
+    # Files added as read_only, that nodes never modify, are hard-linked instead, saving the copy of large ones.
+
+    remote_cache_dir = "/home/ubuntu/.bc-benchmark/cache"
+    use_cache = True
+    # Blobs not used for this many days are pruned from the host cache
+    cache_max_age_days = 7
+
+    _digests = {}
+    _digests_lock = Lock()
+
+    def __init__(self):
+        self._files = []
+        self._read_only = set()
+        self.logger = logging.getLogger("BulkUploader")
+
+    def add_file(self, local_path, remote_path, read_only=False):
+        # remote_path is relative to the directory given to upload. read_only files must never be written on the host:
+        # they share their inode with the cache blob.
+        self._files.append((remote_path, local_path, None))
+        if read_only:
+            self._read_only.add(remote_path)
+        return self
+
+    def add_bytes(self, data, remote_path, mode=0o644):
+        self._files.append((remote_path, None, (data, mode)))
+        return self
+
+    def __len__(self):
+        return len(self._files)
+
+    def write_archive(self, stream, files=None, names=None):
+        files = self._files if files is None else files
+        with tarfile.open(fileobj=stream, mode="w|") as archive:
+            for i, (remote_path, local_path, data) in enumerate(files):
+                arcname = remote_path if names is None else names[i]
+                if local_path is not None:
+                    archive.add(local_path, arcname=arcname)
+                else:
+                    info = tarfile.TarInfo(arcname)
+                    info.size = len(data[0])
+                    info.mode = data[1]
+                    archive.addfile(info, io.BytesIO(data[0]))
+
+    def upload(self, connection, remote_dir):
+        if self.use_cache:
+            return self.upload_cached(connection, remote_dir)
+        quoted_dir = shlex.quote(remote_dir)
+        stream_command(connection, "mkdir -p {0} && tar -x -C {0}".format(quoted_dir), self.write_archive)
+        self.logger.debug("[%s]Uploaded %d files to %s" % (connection.host, len(self._files), remote_dir))
+
+    def upload_cached(self, connection, remote_dir):
+        if not self._files:
+            return
+        digests = [self.digest(local_path, data) for _, local_path, data in self._files]
+        missing = self.missing_digests(connection, set(digests))
+        missing_files = []
+        missing_names = []
+        for entry, digest in zip(self._files, digests):
+            if digest in missing and digest not in missing_names:
+                missing_files.append(entry)
+                missing_names.append(digest)
+        cache_dir = shlex.quote(self.remote_cache_dir)
+        commands = ["mkdir -p %s" % cache_dir]
+        archive = b""
+        if missing_files:
+            archive = lambda stream: self.write_archive(stream, missing_files, missing_names)
+            commands.append("tar -x -C %s" % cache_dir)
+        commands.append(self.__link_command(remote_dir, digests))
+        stream_command(connection, " && ".join(commands), archive)
+        self.logger.debug("[%s]Uploaded %d of %d files to %s, the others were cached" % (
+            connection.host, len(missing_files), len(self._files), remote_dir))
+
+    def missing_digests(self, connection, digests):
+        if not digests:
+            return set()
+        cache_dir = shlex.quote(self.remote_cache_dir)
+        command = "mkdir -p {0} && cd {0} && find . -type f -mtime +{1} -delete; for d in {2}; do [ -f $d ] || echo $d; done".format(
+            cache_dir, self.cache_max_age_days, " ".join(sorted(digests)))
+        output = stream_command(connection, command, b"")
+        return set(output.decode().split())
+
+    def __link_command(self, remote_dir, digests):
+        remote_dirs = {remote_dir}
+        links = []
+        for (remote_path, _, _), digest in zip(self._files, digests):
+            target = shlex.quote(os.path.join(remote_dir, remote_path))
+            remote_dirs.add(os.path.dirname(os.path.join(remote_dir, remote_path)))
+            source = shlex.quote(os.path.join(self.remote_cache_dir, digest))
+            # The target is removed first: writing into it could reach the blob, through a link of a previous upload
+            copy = "rm -f {1} && cp --reflink=auto {0} {1} && chmod {2} {1}".format(source, target, digest.split("-")[1])
+            if remote_path in self._read_only:
+                # Hard links work inside containers' bind mounts, copy if cache and datadir are on different filesystems
+                links.append("{{ ln -f {0} {1} 2>/dev/null || {{ {2}; }}; }}".format(source, target, copy))
+            else:
+                links.append(copy)
+        digests_paths = " ".join([shlex.quote(os.path.join(self.remote_cache_dir, digest)) for digest in set(digests)])
+        commands = ["mkdir -p %s" % " ".join([shlex.quote(directory) for directory in sorted(remote_dirs)])]
+        commands.append("chmod a-w %s" % digests_paths)
+        commands.extend(links)
+        commands.append("touch -c %s" % digests_paths)
+        return " && ".join(commands)
+
+    @classmethod
+    def digest(cls, local_path=None, data=None):
+        # Blobs are named by content and mode: linked copies share the inode, so they must share the mode too
+        if local_path is None:
+            return "%s-%o" % (hashlib.sha256(data[0]).hexdigest(), data[1])
+        stat = os.stat(local_path)
+        key = (os.path.abspath(local_path), stat.st_size, stat.st_mtime_ns, stat.st_mode)
+        with cls._digests_lock:
+            if key in cls._digests:
+                return cls._digests[key]
+        sha256 = hashlib.sha256()
+        with open(local_path, "rb") as local_file:
+            for chunk in iter(lambda: local_file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        with cls._digests_lock:
+            cls._digests[key] = "%s-%o" % (sha256.hexdigest(), stat.st_mode & 0o777)
+        return cls._digests[key]
+
+class FanOutDistributor:
+
+    # Spreads a large file into the BulkUploader cache of many hosts without pushing every copy through the
+    # controller uplink. Each round the controller uploads to a few seed hosts, while every host already holding the
+    # file serves it over http to up to fanout other hosts, so the holders roughly multiply by fanout each round.
+    # Every copy is checked against its sha256 before entering the cache. Later uploads of the file are cache hits.
+
+    seeds = 2
+    fanout = 4
+    serve_port = 8765
+    # Fetches of the same host that may fail before giving up on it
+    max_attempts = 3
+
+    def __init__(self, connections, workers=32):
+        # connections maps each host to its ssh connection
+        self.connections = connections
+        self.workers = workers
+        self.logger = logging.getLogger("FanOutDistributor")
+
+    def distribute(self, local_path):
+        # Returns the hosts that couldn't get the file, uploads to them will just miss the cache
+        digest = BulkUploader.digest(local_path)
+        uploader = BulkUploader()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="FanOut") as executor:
+            missing = dict(zip(self.connections, executor.map(
+                lambda host: digest in uploader.missing_digests(self.connections[host], {digest}), self.connections)))
+            pending = [host for host in self.connections if missing[host]]
+            holders = [host for host in self.connections if not missing[host]]
+            self.logger.info("Distributing %s to %d hosts, %d already hold it" % (local_path, len(pending), len(holders)))
+            servers = {}
+            failed = set()
+            attempts = {}
+            try:
+                while pending:
+                    for host in holders:
+                        if host not in servers:
+                            servers[host] = self.__serve(host, digest)
+                    # Hosts are preferred over the controller, which only seeds
+                    sources = []
+                    for host in holders:
+                        if servers[host] is not None:
+                            sources.extend([host] * self.fanout)
+                    sources.extend([None] * self.seeds)
+                    round_hosts = pending[:len(sources)]
+                    pending = pending[len(sources):]
+                    results = executor.map(
+                        lambda transfer: self.__transfer(transfer[0], transfer[1], local_path, digest),
+                        zip(sources, round_hosts))
+                    for host, ok in zip(round_hosts, results):
+                        if ok:
+                            holders.append(host)
+                            continue
+                        attempts[host] = attempts.get(host, 0) + 1
+                        if attempts[host] < self.max_attempts:
+                            pending.append(host)
+                        else:
+                            failed.add(host)
+            finally:
+                for host, server in servers.items():
+                    if server is not None:
+                        self.__stop_serving(host, *server)
+        if failed:
+            self.logger.warning("%s not distributed to %s" % (local_path, ", ".join(sorted(failed))))
+        return failed
+
+    def __transfer(self, source, host, local_path, digest):
+        cache_dir = shlex.quote(BulkUploader.remote_cache_dir)
+        sha256, mode = digest.split("-")
+        # The blob enters the cache under its name only once its content has been verified
+        verify = "[ \"$(sha256sum {0}.part | cut -d' ' -f1)\" = {1} ] && chmod {2} {0}.part && chmod a-w {0}.part && mv {0}.part {0} || {{ rm -f {0}.part; exit 1; }}".format(
+            digest, sha256, mode)
+        try:
+            if source is None:
+                with open(local_path, "rb") as local_file:
+                    stream_command(self.connections[host], "mkdir -p {0} && cd {0} && cat > {1}.part && {2}".format(cache_dir, digest, verify), local_file)
+            else:
+                url = shlex.quote("http://{0}:{1}/{2}".format(source, self.serve_port, digest))
+                fetch = "{{ curl -sf --retry 3 --retry-connrefused -o {0}.part {1} || wget -q -O {0}.part {1}; }}".format(digest, url)
+                stream_command(self.connections[host], "mkdir -p {0} && cd {0} && {1} && {2}".format(cache_dir, fetch, verify), b"")
+        except Exception as error:
+            self.logger.warning("[%s]Transfer from %s failed: %s" % (host, source if source else "controller", error))
+            return False
+        self.logger.debug("[%s]Received %s from %s" % (host, digest, source if source else "controller"))
+        return True
+
+    def __serve(self, host, digest):
+        # Serves the blob being distributed until the distribution ends, from a directory holding only it: the rest of
+        # the cache, keys included, isn't reachable. Returns the server pid and directory. A host that can't serve just
+        # doesn't forward.
+        blob = shlex.quote(os.path.join(BulkUploader.remote_cache_dir, digest))
+        command = ("dir=$(mktemp -d -p {0}) && {{ ln {1} $dir/ 2>/dev/null || cp {1} $dir/; }} && cd $dir && "
+            "{{ setsid nohup python3 -m http.server {2} < /dev/null > /dev/null 2>&1 & }} && pid=$! && sleep 1 && kill -0 $pid && echo $pid $dir || {{ rm -rf \"$dir\"; exit 1; }}").format(
+            shlex.quote(os.path.dirname(BulkUploader.remote_cache_dir)), blob, self.serve_port)
+        try:
+            pid, serve_dir = stream_command(self.connections[host], command, b"").decode().split()
+            return int(pid), serve_dir
+        except Exception as error:
+            self.logger.warning("[%s]Can't serve files to other hosts: %s" % (host, error))
+            return None
+
+    def __stop_serving(self, host, pid, serve_dir):
+        try:
+            stream_command(self.connections[host], "kill %d; rm -rf %s" % (pid, shlex.quote(serve_dir)), b"")
+        except Exception as error:
+            self.logger.warning("[%s]Can't stop file server (pid %d): %s" % (host, pid, error))
+
+def stream_command(connection, command, data):
+    # fabric run() decodes stdin as text, so binary streams go straight through the paramiko channel.
+    # data can be bytes, a binary file, which is streamed in chunks, or a function writing the stream to the file
+    # it is given.
+    connection.open()
+    stdin, stdout, stderr = connection.client.exec_command(command)
+    if callable(data):
+        data(stdin)
+    elif hasattr(data, "read"):
+        for chunk in iter(lambda: data.read(1024 * 1024), b""):
+            stdin.write(chunk)
+    else:
+        stdin.write(data)
+    stdin.channel.shutdown_write()
+    output = stdout.read()
+    exit_status = stdout.channel.recv_exit_status()
+    if exit_status != 0:
+        raise Exception("[%s]'%s' failed with status %d: %s" % (connection.host, command, exit_status, stderr.read().decode(errors="replace").strip()))
+    return output
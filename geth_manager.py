@@ -3,17 +3,20 @@ from fabric import Connection
 import json
 import logging
 import os
-from queue import Queue
 import shutil
 from threading import Event, Thread
 import time
 from web3 import Web3, HTTPProvider, WebsocketProvider
 
+from benchmark_accounts import BenchmarkAccounts, write_genesis
+from chain_snapshot import ChainSnapshots
 from deploy_manager import DeployManager
 from ethereum_node import EthereumNode
+from file_transfer import BulkUploader
 from host_manager import HostManager
-
-# TODO: Implement wait function for bc to be ready
+from keystore import KeystoreGenerator, find_key_file
+from port_allocator import PortAllocator
+from topology import enode_url, generate_node_key
 
 class GethManager(DeployManager):
 
@@ -22,27 +25,59 @@ class GethManager(DeployManager):
 
     local_datadir = "/root/geth"
     remote_datadir = "/home/ubuntu/ethereum"
+    # Chain databases initialized on the controller, extracted in every node datadir instead of running geth init
+    snapshots_dir = "/root/snapshots"
+    remote_snapshot = "/home/ubuntu/geth-snapshot.tar.gz"
+    # Chain state grown elsewhere to start from, e.g. with many accounts. It must be a snapshot made by ChainSnapshots:
+    # nodes run with the genesis, keys and benchmark accounts stored in it.
+    chain_snapshot = None
 
     docker_node_name = "geth-node"
+    images = ("geth-node",)
     docker_network_name = "benchmark"
 
     FILE_CLIQUE = "./geth/clique.json"
     FILE_ETHASH = "./geth/genesis.json"
 
     upload_all_keys = True
+    # Scrypt cost of nodes' keystores. Use KeystoreGenerator.STANDARD_SCRYPT_N for production-grade keys.
+    keystore_scrypt_n = KeystoreGenerator.LIGHT_SCRYPT_N
+    # Funded accounts added to genesis for load generators, their keys are exported at FILE_BENCHMARK_ACCOUNTS
+    benchmark_accounts = 0
+
+    # Density mode: nodes_per_host containers on each host, each with its own datadir and ports
+    nodes_per_host = 1
+    port_allocator = PortAllocator({"rpc": 8545, "ws": 8546, "p2p": 30303})
+
+    # Cleanup doesn't need genesis and start only needs it, so hosts don't wait each other between stages
+    pipelined_stages = {
+        "cleanup_loop": (),
+        "start_loop": ("init_teardown",)
+    }
+    replaceable_cmds = {DeployManager.CMD_START}
 
     @property
     def local_keystore(self):
         return os.path.join(self.local_datadir, "keystore")
 
-    @property
-    def remote_keystore(self):
-        return os.path.join(self.remote_datadir, "keystore")
+    def node_datadir(self, slot):
+        return self.remote_datadir if slot == 0 else "%s-%d" % (self.remote_datadir, slot)
+
+    def node_container_name(self, slot):
+        return self.docker_node_name if slot == 0 else "%s-%d" % (self.docker_node_name, slot)
+
+    def node_name(self, host, slot):
+        # First node keeps the host as name, so that who looks for the node of a host keeps finding it
+        return host if slot == 0 else "%s#%d" % (host, slot)
 
     @property
     def FILE_PASSWORD(self):
         return os.path.join(self.local_datadir, "password.txt")
 
+    @property
+    def FILE_BENCHMARK_ACCOUNTS(self):
+        return os.path.join(self.local_datadir, "benchmark_accounts.bin")
+
     account_password = "password"
 
     def __init__(self, hosts):
@@ -50,10 +85,30 @@ class GethManager(DeployManager):
         self.logger = logging.getLogger("GethManager")
         self.consensus_protocol = self.ETHASH
         self.nodes = {}
+        self.host_nodes = {}
+        self.peers = {}
+        self.moved_nodes = set()
 
     def parse_conf(self, conf_as_dict):
+        super().parse_conf(conf_as_dict)
         if "LOCAL_NODE_DIR" in conf_as_dict:
             self.local_datadir = conf_as_dict["LOCAL_NODE_DIR"]
+        if "BENCHMARK_ACCOUNTS" in conf_as_dict:
+            self.benchmark_accounts = int(conf_as_dict["BENCHMARK_ACCOUNTS"])
+        if "SNAPSHOTS_DIR" in conf_as_dict:
+            self.snapshots_dir = conf_as_dict["SNAPSHOTS_DIR"]
+        if "CHAIN_SNAPSHOT" in conf_as_dict:
+            self.chain_snapshot = conf_as_dict["CHAIN_SNAPSHOT"]
+        if "KEYSTORE_SCRYPT_N" in conf_as_dict:
+            self.keystore_scrypt_n = int(conf_as_dict["KEYSTORE_SCRYPT_N"])
+        if "NODES_PER_HOST" in conf_as_dict:
+            self.set_nodes_per_host(int(conf_as_dict["NODES_PER_HOST"]))
+
+    def set_nodes_per_host(self, nodes_per_host):
+        if nodes_per_host < 1:
+            raise ValueError("At least one node per host is required, given %d" % nodes_per_host)
+        self.port_allocator.check(nodes_per_host)
+        self.nodes_per_host = nodes_per_host
     
     def set_consensus_protocol(self, protocol):
         if protocol == self.ETHASH or protocol == self.CLIQUE:
@@ -70,16 +125,6 @@ class GethManager(DeployManager):
         self.__init_local_dir()
         self.__create_password_file()
         local_docker = self.local_connections["docker"]["client"]
-        # Removes previous executions geth nodes
-        try:
-            local_geth_node = local_docker.containers.get(self.docker_node_name)
-            local_geth_node.stop()
-            local_geth_node.remove()
-            self.logger.info("Geth local node found, stopped and removed")
-        except docker.errors.NotFound:
-            self.logger.info("Geth local node not found, a new one will be created")
-        except:
-            raise
         # Ensure that the docker network exists
         try:
             local_network = local_docker.networks.create(
@@ -94,112 +139,134 @@ class GethManager(DeployManager):
                 self.logger.info("[LOCAL]Network already deployed")
             else:
                 self.logger.error(error)
-        self.__start_local_node()
-        self.accounts = []
+        with self._step("snapshot.restore_identity"):
+            self.snapshot_identity = self.__restore_chain_identity()
+        if self.snapshot_identity is not None:
+            return
+        with self._step("keystore.generate"):
+            generator = KeystoreGenerator(self.local_keystore, self.account_password, scrypt_n=self.keystore_scrypt_n)
+            self.accounts = generator.generate(len(self.hosts) * self.nodes_per_host)
+        if self.benchmark_accounts:
+            with self._step("accounts.generate"):
+                BenchmarkAccounts(self.FILE_BENCHMARK_ACCOUNTS).generate(self.benchmark_accounts)
     
     def _init_loop(self, host):
-        node = EthereumNode(host, EthereumNode.TYPE_GETH)
-        self.nodes[host] = node
-        self.accounts.append(self.local_node.web3.personal.newAccount(self.account_password))
+        self.host_nodes[host] = []
+        first_account = self.hosts.index(host) * self.nodes_per_host
+        for slot in range(self.nodes_per_host):
+            ports = self.port_allocator.ports(slot)
+            node = EthereumNode(host, EthereumNode.TYPE_GETH, port=ports["rpc"], p2p_port=ports["p2p"])
+            # Node keys are generated here, so that every enode is known before any node starts
+            node.nodekey, public_key = generate_node_key()
+            node.enode = enode_url(public_key, host, ports["p2p"])
+            account = Web3.toChecksumAddress(self.accounts[first_account + slot])
+            node.account = account, self.account_password
+            self.nodes[self.node_name(host, slot)] = node
+            self.host_nodes[host].append(self.node_name(host, slot))
 
     def _init_teardown(self):
-        self.__init_genesis()
+        if self.snapshot_identity is not None:
+            # The snapshot chain database was initialized with this genesis, not with one of new accounts
+            shutil.copy(os.path.join(self.snapshot_identity, "genesis.json"), self.__genesis_file())
+        else:
+            self.__init_genesis()
+            with self._step("snapshot.prepare"):
+                self.__init_chain_snapshot()
+        self._distribute_files(self.__genesis_file(), self.snapshot_file)
+        self.peers = self.topology.peers([node_name for host in self.hosts for node_name in self.host_nodes.get(host, [])])
+        self.logger.info("Nodes will connect in a %s topology" % self.topology.kind)
     
-    def _start_setup(self):
-        self.pvt_key_queue = Queue()
-        pvt_key_file_list = os.listdir(os.path.join(self.local_datadir, "keystore"))
-        for key in pvt_key_file_list:
-            self.pvt_key_queue.put(key)
-
     def _start_loop(self, host):
-        etherbase_key_file = self.pvt_key_queue.get()
-        self.logger.debug("Deploying node at %s" % host)
-        self.__upload_node_files(host, os.path.join(self.local_keystore, etherbase_key_file))
-        if self.upload_all_keys:
-            all_keys = os.listdir(os.path.join(self.local_datadir, "keystore"))
-            all_keys.remove(etherbase_key_file)
-            self.__upload_keys(host, all_keys)
-        etherbase = etherbase_key_file.split("--")[2]
-        docker_client = self.hosts_connections[host]["docker"]["client"]
-        try:
-            geth_node = docker_client.containers.get(self.docker_node_name)
-            geth_node.stop()
-            geth_node.remove()
-            self.logger.debug("[{0}]Geth node found, stopped and removed".format(host))
-        except docker.errors.NotFound:
-            pass
-        self.__init_node_network(host)
-        docker_client.containers.run("ethereum/client-go:stable", "init /root/.ethereum/genesis.json", volumes={
-            self.remote_datadir: {
-                "bind": "/root/.ethereum",
-                "mode": "rw"
-            }
-        })
-        self.logger.debug("[{0}]DB initiated".format(host))
-        start_args = "--nodiscover --etherbase {0} --unlock {0} --password {1}".format(etherbase, "/root/.ethereum/password.txt")
-        start_args += " --rpc --rpcaddr 0.0.0.0 --rpcvhosts=* --rpcapi admin,eth,miner,personal,net,web3 --rpccorsdomain '*'"
-        start_args += " --ws --wsaddr 0.0.0.0 --wsapi admin,eth,miner,personal,net,web3 --wsorigins '*'"
-        start_args += " --mine --minerthreads 2 --gasprice 1"
-        start_args += " --verbosity 5"
-        self.hosts_connections[host]["docker"]["containers"][self.docker_node_name] = docker_client.containers.run(
-            "ethereum/client-go:stable",
-            start_args,
-            name=self.docker_node_name,
-            volumes={
-                self.remote_datadir: {
-                    "bind": "/root/.ethereum",
-                    "mode": "rw"
-                }
-            }, ports={
-                '8545/tcp': '8545',
-                '8546/tcp': '8546',
-                '30303/tcp': '30303',
-                '30303/udp': '30303',
-            }, detach=True, network=self.docker_network_name)
-        self.nodes[host].account = Web3.toChecksumAddress("0x" + etherbase), self.account_password
-        if self.nodes[host].ready():
-            self.logger.info("[{0}]Deployed Geth node with etherbase {1}".format(host, self.nodes[host].account))
-        else:
-            self.logger.error("[{0}]Error deploying node".format(host))
-        
+        with self._step("ssh.upload_files"):
+            self.__upload_nodes_files(host)
+        with self._step("docker.network"):
+            self.__init_node_network(host)
+        for slot, node_name in enumerate(self.host_nodes[host]):
+            self.__start_node(host, slot, self.nodes[node_name])
+
     def _start_teardown(self):
-        self.utility_node = self.nodes[self.hosts[0]]
+        for failed_host in self.failed_hosts:
+            for node_name in self.host_nodes.pop(failed_host, []):
+                self.nodes.pop(node_name, None)
+            self.logger.warning("[{0}]Node failed, the network will go on without it".format(failed_host))
+        self.utility_node = self.nodes[next(host for host in self.hosts if host in self.nodes)]
         self.logger.info("Using %s as utility node" % self.utility_node.host)
-        self.__full_mesh()
+        self.__connect_moved_nodes()
+        self.__wait_network_ready(self.CMD_START)
     
     def _cleanup_loop(self, host):
         docker_client = self.hosts_connections[host]["docker"]["client"]
-        try:
-            geth_node = docker_client.containers.get(self.docker_node_name)
-            geth_node.stop()
-            geth_node.remove()
-            self.logger.info("[{0}]Geth node found, stopped and removed".format(host))
-        except docker.errors.APIError as error:
-            if error.status_code == 404:
-                pass
-            else:
-                raise
-        ssh = self.hosts_connections[host]["ssh"]
-        ssh.sudo("rm -rf %s" % self.remote_datadir)
+        # Name filter matches also nodes left by a previous run with a different density
+        geth_nodes = docker_client.containers.list(all=True, filters={"name": self.docker_node_name})
+        with self._step("docker.remove"):
+            self._remove_containers(geth_nodes)
+        if geth_nodes:
+            self.logger.info("[{0}]Removed {1} geth nodes".format(host, len(geth_nodes)))
+        with self._step("ssh.remove_datadir"):
+            self._remove_remote_dirs(host, self.remote_datadir, self.remote_datadir + "-*")
         self.logger.info("[{0}]Data cleaned".format(host))
 
+    def _reset_setup(self):
+        # Every node stops before any restarts, otherwise restarted nodes would sync the old chain from their peers
+        self.reset_started = time.time()
+        self._run_on_hosts(self.CMD_RESET, "setup", self.__stop_host_nodes)
+
+    def _reset_loop(self, host):
+        # Containers and datadirs stay, only the chain database goes back to the snapshot. The local transactions
+        # journal goes too, otherwise nodes would send the previous run's pending transactions again.
+        containers = self.hosts_connections[host]["docker"]["containers"]
+        ssh = self.hosts_connections[host]["ssh"]
+        for slot, node_name in enumerate(self.host_nodes.get(host, [])):
+            datadir = self.node_datadir(slot)
+            container = containers[self.node_container_name(slot)]
+            with self._step("ssh.restore_snapshot"):
+                self._remove_remote_dirs(host, *["{0}/geth/{1}".format(datadir, path) for path in ["chaindata", "lightchaindata", "transactions.rlp"]])
+                # sudo as the geth directory was written by the container, as root
+                ssh.sudo("tar -xzf {1} -C {0} --exclude={2}".format(datadir, self.remote_snapshot, ChainSnapshots.IDENTITY_DIR), hide=True)
+            with self._step("docker.start"):
+                container.start()
+            with self._step("rpc.ready"):
+                ready = self.nodes[node_name].ready()
+            if not ready:
+                raise Exception("[{0}]Error restarting node {1}".format(host, self.node_container_name(slot)))
+        self.logger.info("[%s]Reset" % host)
+
+    def _reset_teardown(self):
+        self.__wait_network_ready(self.CMD_RESET, self.reset_started)
+
     def _stop_loop(self, host):
-        for _, container in self.hosts_connections[host]["docker"]["containers"].items():
-            container.stop()
-            container.remove()
+        containers = self.hosts_connections[host]["docker"]["containers"]
+        with self._step("docker.remove"):
+            self._remove_containers(containers.values())
+        containers.clear()
         self.logger.info("[%s]Stopped" % host)
     
     def _deinit_setup(self):
-        for container_name, container in self.local_connections["docker"]["containers"].items():
-            container.stop()
-            container.remove()
-            self.logger.info("[Localhost]Stopped %s" % container_name)
+        containers = self.local_connections["docker"]["containers"]
+        self._remove_containers(containers.values())
+        self.logger.info("[Localhost]Stopped %s" % ", ".join(containers))
+        containers.clear()
         self.local_connections["docker"]["client"].close()
 
-    def _deinit_loop(self, host):
-        self.hosts_connections[host]["docker"]["client"].close()
-        self.hosts_connections[host]["ssh"].close()
-    
+    def _replace_host(self, failed_host, new_host):
+        super()._replace_host(failed_host, new_host)
+        self.host_nodes[new_host] = []
+        for slot, node_name in enumerate(self.host_nodes.pop(failed_host)):
+            failed_node = self.nodes.pop(node_name)
+            node = EthereumNode(new_host, EthereumNode.TYPE_GETH, port=failed_node.port, p2p_port=failed_node.p2p_port)
+            node.account = failed_node.account
+            node.nodekey = failed_node.nodekey
+            node.enode = enode_url(failed_node.enode[len("enode://"):].split("@")[0], new_host, failed_node.p2p_port)
+            new_node_name = self.node_name(new_host, slot)
+            self.nodes[new_node_name] = node
+            self.host_nodes[new_host].append(new_node_name)
+            if node_name in self.peers:
+                self.peers[new_node_name] = self.peers.pop(node_name)
+                for peer in self.peers[new_node_name]:
+                    self.peers[peer].discard(node_name)
+                    self.peers[peer].add(new_node_name)
+            self.moved_nodes.add(new_node_name)
+
     # Private utility methods
 
     def __init_local_dir(self):
@@ -217,17 +284,16 @@ class GethManager(DeployManager):
         with open(self.FILE_PASSWORD, "w") as pw_file:
             pw_file.write(self.account_password)
 
+    def __genesis_file(self):
+        return self.FILE_ETHASH if self.consensus_protocol == self.ETHASH else self.FILE_CLIQUE
+
     def __init_genesis(self):
-        if self.consensus_protocol == self.ETHASH:
-            genesis_file_path = self.FILE_ETHASH
-        else:
-            genesis_file_path = self.FILE_CLIQUE
+        genesis_file_path = self.__genesis_file()
         with open(genesis_file_path) as genesis_file:
             genesis_dict = json.load(genesis_file)
         alloc_accounts = {}
-        balance_prototype = {"balance":"0x200000000000000000000000000000000000000000000000000000000000000"}
         for account in self.accounts:
-            alloc_accounts[account] = balance_prototype.copy()
+            alloc_accounts[account] = {"balance": BenchmarkAccounts.DEFAULT_BALANCE}
         genesis_dict["alloc"] = alloc_accounts
         if self.consensus_protocol == self.CLIQUE:
             extra_data = "0x0000000000000000000000000000000000000000000000000000000000000000"
@@ -235,61 +301,156 @@ class GethManager(DeployManager):
                 extra_data += account[2:]
             extra_data += "0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000"
             genesis_dict["extraData"] = extra_data
-        with open(genesis_file_path, "w") as genesis_file:
-            json.dump(genesis_dict, genesis_file)
+        extra_addresses = BenchmarkAccounts(self.FILE_BENCHMARK_ACCOUNTS).addresses() if self.benchmark_accounts else ()
+        write_genesis(genesis_file_path, genesis_dict, "alloc", extra_addresses)
         self.logger.info("Genesis block file written at " + genesis_file_path)
 
-    def __upload_node_files(self, host, pvt_key_file):
-        connection = self.hosts_connections[host]["ssh"]
-        make_datadir = connection.run('mkdir -p ' + self.remote_datadir)
-        if not make_datadir.ok:
-            raise Exception("[%s]Error creating datadir %s" % self.remote_datadir)
+    def __snapshot_key(self):
+        # Genesis accounts change every deployment, so the key takes the genesis without them
+        with open(self.__genesis_file()) as genesis_file:
+            genesis_dict = json.load(genesis_file)
+        genesis_dict.pop("alloc", None)
+        if self.consensus_protocol == self.CLIQUE:
+            genesis_dict.pop("extraData", None)
+        return ChainSnapshots.key({
+            "genesis": genesis_dict,
+            "consensus": self.consensus_protocol,
+            "accounts": len(self.hosts) * self.nodes_per_host,
+            "benchmark_accounts": self.benchmark_accounts,
+            "image": self.dinr.resolve("geth-node")
+        })
+
+    def __restore_chain_identity(self):
+        # Takes genesis, node accounts and benchmark accounts from the snapshot to start from, if any, so that they
+        # match its chain database. Returns the restored identity directory, None if there's no snapshot to start from.
+        chain_snapshots = ChainSnapshots(self.snapshots_dir)
+        if self.chain_snapshot is not None:
+            snapshot_file = self.chain_snapshot
+        else:
+            snapshot_file = chain_snapshots.get(self.__snapshot_key())
+            if snapshot_file is None:
+                return None
+        identity_dir = chain_snapshots.extract_identity(snapshot_file, self.local_datadir)
+        if identity_dir is None:
+            if self.chain_snapshot is not None:
+                raise ValueError("Snapshot %s has no genesis and keys, nodes couldn't seal on it" % snapshot_file)
+            self.logger.warning("Snapshot %s has no genesis and keys, creating a new one" % snapshot_file)
+            return None
+        with open(os.path.join(identity_dir, "accounts.json")) as accounts_file:
+            accounts = json.load(accounts_file)
+        if len(accounts) != len(self.hosts) * self.nodes_per_host:
+            raise ValueError("Snapshot %s has %d node accounts, %d nodes are deployed" % (snapshot_file, len(accounts), len(self.hosts) * self.nodes_per_host))
+        shutil.copytree(os.path.join(identity_dir, "keystore"), self.local_keystore)
+        benchmark_accounts_file = os.path.join(identity_dir, os.path.basename(self.FILE_BENCHMARK_ACCOUNTS))
+        if os.path.isfile(benchmark_accounts_file):
+            shutil.copy(benchmark_accounts_file, self.FILE_BENCHMARK_ACCOUNTS)
+            self.benchmark_accounts = len(BenchmarkAccounts(self.FILE_BENCHMARK_ACCOUNTS))
+        else:
+            self.benchmark_accounts = 0
+        self.accounts = accounts
+        self.snapshot_file = snapshot_file
+        self.logger.info("Nodes will start from snapshot %s, with its genesis and keys" % snapshot_file)
+        return identity_dir
+
+    def __init_chain_snapshot(self):
+        image = self.dinr.resolve("geth-node")
+        genesis_file_path = self.__genesis_file()
+        chain_snapshots = ChainSnapshots(self.snapshots_dir)
+        init_dir = os.path.join(self.local_datadir, "snapshot")
+        os.makedirs(init_dir, exist_ok=True)
+        shutil.copy(genesis_file_path, os.path.join(init_dir, "genesis.json"))
+        self.local_connections["docker"]["client"].containers.run(image, "init /root/.ethereum/genesis.json", volumes={
+            HostManager.resolve_local_path(init_dir): { # This points always to the controller host datadir
+                "bind": "/root/.ethereum",
+                "mode": "rw"
+            }
+        }, remove=True)
+        identity_dir = os.path.join(self.local_datadir, ChainSnapshots.IDENTITY_DIR)
+        shutil.copytree(self.local_keystore, os.path.join(identity_dir, "keystore"))
+        shutil.copy(genesis_file_path, os.path.join(identity_dir, "genesis.json"))
+        with open(os.path.join(identity_dir, "accounts.json"), "w") as accounts_file:
+            json.dump(self.accounts, accounts_file)
+        if self.benchmark_accounts:
+            shutil.copy(self.FILE_BENCHMARK_ACCOUNTS, identity_dir)
+        self.snapshot_file = chain_snapshots.create(self.__snapshot_key(), init_dir, ["geth/chaindata", "geth/lightchaindata"], identity_dir)
+        shutil.rmtree(init_dir)
+
+    def __start_node(self, host, slot, node):
+        datadir = self.node_datadir(slot)
+        container_name = self.node_container_name(slot)
+        etherbase_key_file = find_key_file(self.local_keystore, node.account[0])
+        self.logger.debug("[{0}]Deploying node {1}".format(host, container_name))
+        etherbase = etherbase_key_file.split("--")[2]
+        docker_client = self.hosts_connections[host]["docker"]["client"]
+        try:
+            geth_node = docker_client.containers.get(container_name)
+            with self._step("docker.remove_previous"):
+                self._remove_containers([geth_node])
+            self.logger.debug("[{0}]Geth node {1} found and removed".format(host, container_name))
+        except docker.errors.NotFound:
+            pass
+        with self._step("ssh.extract_snapshot"):
+            self.hosts_connections[host]["ssh"].run("mkdir -p {0} && tar -xzf {1} -C {0} --exclude={2}".format(
+                datadir, self.remote_snapshot, ChainSnapshots.IDENTITY_DIR), hide=True)
+        self.logger.debug("[{0}]DB of {1} initiated".format(host, container_name))
+        start_args = "--nodiscover --etherbase {0} --unlock {0} --password {1}".format(etherbase, "/root/.ethereum/password.txt")
+        start_args += " --rpc --rpcaddr 0.0.0.0 --rpcvhosts=* --rpcapi admin,eth,miner,personal,net,web3 --rpccorsdomain '*'"
+        start_args += " --ws --wsaddr 0.0.0.0 --wsapi admin,eth,miner,personal,net,web3 --wsorigins '*'"
+        start_args += " --mine --minerthreads 2 --gasprice 1"
+        start_args += " --verbosity 5"
+        # Static nodes count towards the peers limit
+        start_args += " --maxpeers %d" % max([50] + [len(peers) + 1 for peers in self.peers.values()])
+        ports = self.port_allocator.ports(slot)
+        with self._step("docker.run"):
+            self.hosts_connections[host]["docker"]["containers"][container_name] = docker_client.containers.run(
+                self.dinr.resolve("geth-node"),
+                start_args,
+                name=container_name,
+                volumes={
+                    datadir: {
+                        "bind": "/root/.ethereum",
+                        "mode": "rw"
+                    }
+                }, ports={
+                    '8545/tcp': ports["rpc"],
+                    '8546/tcp': ports["ws"],
+                    '30303/tcp': ports["p2p"],
+                    '30303/udp': ports["p2p"],
+                }, detach=True, network=self.docker_network_name)
+        node.account = Web3.toChecksumAddress("0x" + etherbase), self.account_password
+        with self._step("rpc.ready"):
+            ready = node.ready()
+        if ready:
+            self.logger.info("[{0}]Deployed Geth node {1} with etherbase {2}".format(host, container_name, node.account))
+        else:
+            raise Exception("[{0}]Error deploying node {1}".format(host, container_name))
+
+    def __upload_nodes_files(self, host):
+        # Datadirs of all the nodes of the host are siblings, so a single archive extracted in their parent fills them all
         if self.consensus_protocol == self.ETHASH:
             genesis_file = self.FILE_ETHASH
         else:
             genesis_file = self.FILE_CLIQUE
-        connection.put(genesis_file, remote=os.path.join(self.remote_datadir, "genesis.json"))
-        connection.put(self.FILE_PASSWORD, remote=os.path.join(self.remote_datadir, "password.txt"))
-        make_keystore_dir = connection.run("mkdir -p %s" % self.remote_keystore)
-        if not make_keystore_dir.ok:
-            raise Exception("[%s]Error creating keystore dir %s" % (host, self.remote_keystore))
-        connection.put(pvt_key_file, remote=os.path.join(self.remote_keystore, os.path.basename(pvt_key_file)))
-
-    def __upload_keys(self, host, keys):
-        ssh = self.hosts_connections[host]["ssh"]
-        for key in keys:
-            ssh.put(os.path.join(self.local_keystore, key), remote=os.path.join(self.remote_keystore, os.path.basename(key)))
-        self.logger.info("[%s] All pvt keys uploaded")
+        all_keys = os.listdir(self.local_keystore)
+        uploader = BulkUploader()
+        uploader.add_file(self.snapshot_file, os.path.basename(self.remote_snapshot), read_only=True)
+        for slot, node_name in enumerate(self.host_nodes[host]):
+            node_dir = os.path.basename(self.node_datadir(slot))
+            uploader.add_file(genesis_file, os.path.join(node_dir, "genesis.json"))
+            uploader.add_file(self.FILE_PASSWORD, os.path.join(node_dir, "password.txt"))
+            if self.upload_all_keys:
+                node_keys = all_keys
+            else:
+                node_keys = [find_key_file(self.local_keystore, self.nodes[node_name].account[0])]
+            for key in node_keys:
+                uploader.add_file(os.path.join(self.local_keystore, key), os.path.join(node_dir, "keystore", key))
+            node = self.nodes[node_name]
+            static_nodes = [self.nodes[peer].enode for peer in sorted(self.peers.get(node_name, [])) if peer in self.nodes]
+            uploader.add_bytes(node.nodekey.encode(), os.path.join(node_dir, "geth", "nodekey"), mode=0o600)
+            uploader.add_bytes(json.dumps(static_nodes).encode(), os.path.join(node_dir, "geth", "static-nodes.json"))
+        uploader.upload(self.hosts_connections[host]["ssh"], os.path.dirname(self.remote_datadir))
+        self.logger.info("[%s]Node files uploaded" % host)
     
-    def __start_local_node(self):
-        local_docker = self.local_connections["docker"]["client"]
-        local_geth_node = local_docker.containers.run(
-            self.dinr.resolve("geth-node"),
-            "--rpc --rpcapi admin,eth,miner,personal,net,web3 --rpcaddr 0.0.0.0 --rpcvhosts=* --nodiscover",
-            detach=True,
-            volumes={
-                HostManager.resolve_local_path(self.local_datadir): { # This points always to the controller host datadir
-                    'bind': '/root/.ethereum',
-                    'mode': 'rw'
-                }
-            }, ports={
-                '8545/tcp': '8545',
-                '8546/tcp': '8546',
-                '30303/tcp': '30303',
-                '30303/udp': '30303',
-            }, name=self.docker_node_name, network=self.docker_network_name)
-        self.local_connections["docker"]["containers"][self.docker_node_name] = local_geth_node
-        if HostManager.running_in_container:
-            node = EthereumNode(self.docker_node_name, EthereumNode.TYPE_GETH)
-        else:
-            node = EthereumNode("localhost", EthereumNode.TYPE_GETH)
-        if node.ready():
-            self.local_node = node
-            self.logger.info("Initialized local Geth node")
-            return True
-        else:
-            raise Exception("Can't contact local Geth node. Please abort the deploy.")
-        
     def __init_node_network(self, host):
         if self.docker_network_name in self.hosts_connections[host]["docker"]["networks"]:
             self.logger.info("[{0}]Network already deployed".format(host))
@@ -306,13 +467,28 @@ class GethManager(DeployManager):
             self.hosts_connections[host]["docker"]["networks"][self.docker_network_name] = network
             self.logger.info("[{0}]Network deployed".format(host))
 
-    def __full_mesh(self):
-        for node in self.nodes.values():
-            for peer in self.nodes.values():
-                if node != peer:
-                    node.web3.admin.addPeer(peer.enode)
-                    self.logger.debug("Added %s to %s" % (peer.enode, node.enode))
-        self.logger.info("Nodes connected in a full mesh network")
+    def __stop_host_nodes(self, host):
+        containers = self.hosts_connections[host]["docker"]["containers"]
+        for slot in range(len(self.host_nodes.get(host, []))):
+            with self._step("docker.stop"):
+                containers[self.node_container_name(slot)].stop(timeout=self.stop_timeout)
+
+    def __wait_network_ready(self, cmd, since=None):
+        expected_peers = {name: len(self.peers.get(name, set()) & set(self.nodes)) for name in self.nodes}
+        self._wait_network_ready(self.nodes, expected_peers, cmd=cmd, since=since)
+
+    def __connect_moved_nodes(self):
+        # Peers started before a node was moved to a new host have its old address in their static nodes
+        for node_name in self.moved_nodes:
+            if node_name not in self.nodes:
+                continue
+            node = self.nodes[node_name]
+            for peer_name in self.peers.get(node_name, []):
+                if peer_name in self.nodes:
+                    with self._step("rpc.add_peer", self.nodes[peer_name].host):
+                        self.nodes[peer_name].web3.admin.addPeer(node.enode)
+                    self.logger.debug("Added %s to %s" % (node.enode, self.nodes[peer_name].enode))
+        self.moved_nodes = set()
             
 
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 import docker
-from fabric import Connection
 import logging
 import os
 import queue
 import sys
 import threading
 
-# TODO: Implement checks on received host
+from connection_pool import HostConnectionPool
+from docker_images_name_resolver import DockerImagesNameResolver
+
 # TODO: Fill container_volumes without hard-coding it
 
 class HostManager:
@@ -19,20 +21,63 @@ class HostManager:
 
         host_conf = {
                 "ssh_username": "ubuntu",
-                "docker_remote_api_port": 2375
+                "docker_remote_api_port": 2375,
+                "probe_dir": "/home/ubuntu",
+                "min_free_disk_mb": 2048,
+                "min_free_memory_mb": 512
         }
 
+        STATUS_PROBING = "probing"
+        STATUS_READY = "ready"
+        STATUS_FAILED = "failed"
+
+        N_PROBE_THREADS = 8
+
+        ROLE_NODE = "node"
+        ROLE_LOAD = "load"
+
+        # Score of a host for a role is the weighted sum of its inventory. Nodes need memory and disk for the chain
+        # state, load generators mostly need cores.
+        placement_weights = {
+                ROLE_NODE: {"cpus": 1, "memory_gb": 1, "free_disk_gb": 0.02},
+                ROLE_LOAD: {"cpus": 2, "memory_gb": 0.25, "free_disk_gb": 0}
+        }
+
+        connection_pool = HostConnectionPool(host_conf["docker_remote_api_port"], host_conf["ssh_username"])
+
         def __init__(self):
                 self._hosts = []
                 self._reserved_hosts = []
+                self._reserved_roles = {}
                 self._hosts_lock = threading.Lock()
                 self._hosts_connections = {}
+                self._hosts_info = {}
+                self._probe_executor = ThreadPoolExecutor(max_workers=self.N_PROBE_THREADS, thread_name_prefix="HostProbe")
                 self.logger = logging.getLogger("HostManager")
         
         def add_host(self, host):
+                # The host becomes available only once the background probe verifies it
                 with self._hosts_lock:
-                        self._hosts.append(host)
-                self.logger.info("Added host {0}".format(host))
+                        if host in self._hosts or host in self._reserved_hosts or self.get_host_status(host) == self.STATUS_PROBING:
+                                self.logger.info("Host {0} already registered".format(host))
+                                return
+                        self._hosts_info[host] = {"status": self.STATUS_PROBING}
+                self._probe_executor.submit(self.__probe_host, host)
+                self.logger.info("Probing host {0}".format(host))
+
+        def get_host_status(self, host):
+                return self._hosts_info.get(host, {}).get("status")
+
+        def get_hosts_info(self):
+                with self._hosts_lock:
+                        return {host: info.copy() for host, info in self._hosts_info.items()}
+
+        def count_hosts_by_status(self):
+                counts = {self.STATUS_PROBING: 0, self.STATUS_READY: 0, self.STATUS_FAILED: 0}
+                with self._hosts_lock:
+                        for info in self._hosts_info.values():
+                                counts[info["status"]] += 1
+                return counts
 
         def add_hosts_from_file(self, hosts_file_path):
                 with open(hosts_file_path) as hosts_file:
@@ -47,39 +92,133 @@ class HostManager:
                 with self._hosts_lock:
                         return self._hosts.copy()
         
-        def reserve_hosts(self, n_hosts):
+        def reserve_hosts(self, n_hosts, role=ROLE_NODE):
+                # Hosts are returned strongest first, so that managers place seed and utility nodes on hosts[0]
                 with self._hosts_lock:
                         if len(self._hosts) < n_hosts:
                                 return False
-                        for _ in range(n_hosts):
-                                self._reserved_hosts.append(self._hosts.pop())
-                                self.logger.debug("Reserved host {0}".format(self._reserved_hosts[-1]))
-                        return self._reserved_hosts.copy()
+                        reserved = self.__rank_hosts(role)[:n_hosts]
+                        for host in reserved:
+                                self._hosts.remove(host)
+                                self._reserved_hosts.append(host)
+                                self._reserved_roles[host] = role
+                                self.logger.debug("Reserved host {0} as {1} (score {2:.1f})".format(host, role, self.score_host(host, role)))
+                        return reserved
+
+        def get_reserved_hosts(self, role=None):
+                with self._hosts_lock:
+                        return [host for host in self._reserved_hosts if role is None or self._reserved_roles.get(host) == role]
 
+        def score_host(self, host, role=ROLE_NODE):
+                info = self._hosts_info.get(host, {})
+                inventory = {
+                        "cpus": info.get("cpus", 0),
+                        "memory_gb": info.get("memory", 0) / 1024 ** 3,
+                        "free_disk_gb": info.get("free_disk", 0) / 1024 ** 3
+                }
+                return sum(weight * inventory[key] for key, weight in self.placement_weights[role].items())
+
+        def __rank_hosts(self, role):
+                # Stable sort: hosts without inventory, e.g. added from file, keep their order
+                return sorted(self._hosts, key=lambda host: self.score_host(host, role), reverse=True)
         
         def free_hosts(self, hosts):
                 with self._hosts_lock:
                         for host in hosts:
                                 try:
                                         self._reserved_hosts.remove(host)
+                                        self._reserved_roles.pop(host, None)
                                         self._hosts.append(host)
                                 except ValueError:
                                         self.logger.error("Can't free host {0}. It wasn't previously reserved".format(host))
 
+        def replace_host(self, failed_host):
+                with self._hosts_lock:
+                        if len(self._hosts) < 1:
+                                return False
+                        try:
+                                self._reserved_hosts.remove(failed_host)
+                        except ValueError:
+                                self.logger.warning("Replacing host {0} that wasn't reserved".format(failed_host))
+                        role = self._reserved_roles.pop(failed_host, self.ROLE_NODE)
+                        new_host = self.__rank_hosts(role)[0]
+                        self._hosts.remove(new_host)
+                        self._reserved_hosts.append(new_host)
+                        self._reserved_roles[new_host] = role
+                        self._hosts_info[failed_host] = {"status": self.STATUS_FAILED, "error": "Failed during deploy"}
+                self.logger.warning("Host {0} dropped and replaced by {1}".format(failed_host, new_host))
+                return new_host
+
+        def __probe_host(self, host):
+                info = {"status": self.STATUS_FAILED}
+                try:
+                        pooled = HostManager.connection_pool.lease(host)
+                        try:
+                                pooled.docker_client.ping()
+                                info["docker"] = True
+                                docker_info = pooled.docker_client.info()
+                                info["cpus"] = docker_info["NCPU"]
+                                info["memory"] = docker_info["MemTotal"]
+                                resources = pooled.ssh.run("df -Pk %s | tail -1; free -b | grep Mem:" % self.host_conf["probe_dir"], hide=True)
+                                info["ssh"] = True
+                                disk_line, memory_line = resources.stdout.strip().splitlines()[-2:]
+                                info["free_disk"] = int(disk_line.split()[3]) * 1024
+                                info["free_memory"] = int(memory_line.split()[-1])
+                                info["images"] = self.__present_images(pooled.docker_client)
+                        finally:
+                                HostManager.connection_pool.release(pooled)
+                        if info["free_disk"] < self.host_conf["min_free_disk_mb"] * 1024 * 1024:
+                                info["error"] = "Not enough free disk space"
+                        elif info["free_memory"] < self.host_conf["min_free_memory_mb"] * 1024 * 1024:
+                                info["error"] = "Not enough free memory"
+                        else:
+                                info["status"] = self.STATUS_READY
+                except Exception as error:
+                        info["error"] = str(error)
+                        HostManager.connection_pool.evict(host)
+                with self._hosts_lock:
+                        self._hosts_info[host] = info
+                        if info["status"] == self.STATUS_READY:
+                                self._hosts.append(host)
+                if info["status"] == self.STATUS_READY:
+                        self.logger.info("Added host {0}".format(host))
+                else:
+                        self.logger.error("Host {0} failed probe: {1}".format(host, info["error"]))
+
+        @staticmethod
+        def __present_images(docker_client):
+                present = []
+                for key, image in DockerImagesNameResolver().resolve_all().items():
+                        try:
+                                docker_client.images.get(image)
+                                present.append(key)
+                        except docker.errors.ImageNotFound:
+                                pass
+                return present
+
         @staticmethod
         def get_hosts_connections(hosts):
                 hosts_connections = {}
                 for host in hosts:
+                        pooled = HostManager.connection_pool.lease(host)
                         hosts_connections[host] = {
                                 "docker": {
-                                        "client": docker.DockerClient(base_url='tcp://%s:%d' % (host, HostManager.host_conf["docker_remote_api_port"])),
+                                        "client": pooled.docker_client,
                                         "containers": {},
                                         "networks": {}
                                 },
-                                "ssh": Connection(host=host, user=HostManager.host_conf["ssh_username"])
+                                "ssh": pooled.ssh,
+                                "pooled": pooled
                         }
                 return hosts_connections
 
+        @staticmethod
+        def release_hosts_connections(hosts_connections, evict=False):
+                for host, connections in hosts_connections.items():
+                        if evict:
+                                HostManager.connection_pool.evict(host, connections["pooled"])
+                        HostManager.connection_pool.release(connections["pooled"])
+
         @staticmethod
         def get_local_connections(check=True):
                 local_connections = {}
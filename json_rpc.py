@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+class JsonRpcError(Exception):
+    pass
+
+class JsonRpcConnection:
+
+    # Persistent HTTP/1.1 connection to an Ethereum node JSON-RPC endpoint, for asyncio clients. Requests on the same
+    # connection are serialized, so concurrent clients open one connection each. The connection is reopened when the
+    # node closes it.
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._next_id = 0
+        self._request_head = "POST / HTTP/1.1\r\nHost: %s:%d\r\nContent-Type: application/json\r\nContent-Length: " % (host, port)
+
+    async def connect(self):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader, self._writer = None, None
+
+    async def call(self, method, params=()):
+        self._next_id += 1
+        response = await self.request(json.dumps({"jsonrpc": "2.0", "id": self._next_id, "method": method, "params": list(params)}).encode())
+        if "error" in response:
+            raise JsonRpcError("%s: %s" % (method, response["error"].get("message", response["error"])))
+        return response["result"]
+
+    async def batch(self, calls):
+        # calls are (method, params) pairs. Returns results in the same order, errors as JsonRpcError instances.
+        payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": list(params)} for i, (method, params) in enumerate(calls)]
+        responses = await self.request(json.dumps(payload).encode())
+        if not isinstance(responses, list):
+            # Nodes answer a batch they can't process as a whole with a single error
+            error = responses.get("error", responses) if isinstance(responses, dict) else responses
+            raise JsonRpcError("batch of %d calls: %s" % (len(calls), error.get("message", error) if isinstance(error, dict) else error))
+        results = [None] * len(calls)
+        for response in responses:
+            if "error" in response:
+                results[response["id"]] = JsonRpcError(response["error"].get("message", response["error"]))
+            else:
+                results[response["id"]] = response["result"]
+        return results
+
+    async def send_raw_transaction(self, raw_transaction):
+        # Hot path of load generation: the request is formatted without going through json
+        self._next_id += 1
+        body = ('{"jsonrpc":"2.0","id":%d,"method":"eth_sendRawTransaction","params":["%s"]}' % (self._next_id, raw_transaction)).encode()
+        response = await self.request(body)
+        if "error" in response:
+            raise JsonRpcError(response["error"].get("message", response["error"]))
+        return response["result"]
+
+    async def request(self, body):
+        async with self._lock:
+            try:
+                return await asyncio.wait_for(self.__exchange(body), self.timeout)
+            except Exception:
+                await self.close()
+                raise
+
+    async def __exchange(self, body):
+        await self.connect()
+        self._writer.write(("%s%d\r\n\r\n" % (self._request_head, len(body))).encode() + body)
+        head = await self._reader.readuntil(b"\r\n\r\n")
+        status_line, _, header_lines = head.decode("latin-1").partition("\r\n")
+        headers = {}
+        for line in header_lines.split("\r\n"):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+        if "content-length" in headers:
+            data = await self._reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            data = await self.__read_chunked()
+        else:
+            data = await self._reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection") == "close":
+            await self.close()
+        status = status_line.split(" ", 2)
+        if len(status) < 2 or status[1] != "200":
+            raise JsonRpcError("HTTP %s from %s:%d" % (" ".join(status[1:]), self.host, self.port))
+        return json.loads(data)
+
+    async def __read_chunked(self):
+        chunks = []
+        while True:
+            size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                await self._reader.readuntil(b"\r\n")
+                return b"".join(chunks)
+            chunks.append(await self._reader.readexactly(size))
+            await self._reader.readexactly(2)
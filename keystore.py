@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+import logging
+import os
+import secrets
+
+from eth_keyfile import create_keyfile_json
+
+class KeystoreGenerator:
+
+    # Creates accounts in process as geth compatible V3 keystore files, spreading the scrypt work over the CPU cores.
+    # STANDARD_SCRYPT_N is geth default, LIGHT_SCRYPT_N is geth --lightkdf one: weak, but enough for benchmark accounts.
+
+    STANDARD_SCRYPT_N = 262144
+    LIGHT_SCRYPT_N = 4096
+
+    def __init__(self, keystore_dir, password, scrypt_n=LIGHT_SCRYPT_N, processes=None):
+        self.keystore_dir = keystore_dir
+        self.password = password
+        self.scrypt_n = scrypt_n
+        self.processes = processes
+        self.logger = logging.getLogger("KeystoreGenerator")
+
+    def generate(self, count):
+        # Returns the addresses of the new accounts, in creation order
+        os.makedirs(self.keystore_dir, exist_ok=True)
+        if count < 1:
+            return []
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            addresses = list(executor.map(
+                create_key_file,
+                [self.keystore_dir] * count,
+                [self.password] * count,
+                [self.scrypt_n] * count))
+        self.logger.info("Created %d accounts in %s" % (count, self.keystore_dir))
+        return addresses
+
+def key_file_name(address):
+    # Same naming of geth, that sorts keys by creation time
+    timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%S.%f")
+    return "UTC--%s000Z--%s" % (timestamp, address.lower())
+
+def find_key_file(keystore_dir, address):
+    for key_file in os.listdir(keystore_dir):
+        if key_file.endswith(address[2:].lower()):
+            return key_file
+    raise Exception("Key file for account %s not found in %s" % (address, keystore_dir))
+
+def create_key_file(keystore_dir, password, scrypt_n):
+    private_key = secrets.token_bytes(32)
+    key_json = create_keyfile_json(private_key, password.encode(), version=3, kdf="scrypt", iterations=scrypt_n)
+    with open(os.path.join(keystore_dir, key_file_name(key_json["address"])), "w") as key_file:
+        json.dump(key_json, key_file)
+    return "0x" + key_json["address"]
@@ -0,0 +1,100 @@
+import math
+
+class LatencyHistogram:
+
+    # Log-bucketed histogram in the HDR style: values are counted in buckets whose width grows with the value, so that
+    # every recorded value is known within a relative error of 10^-significant_digits, whatever its magnitude.
+    # Buckets are sparse and histograms of the same precision can be merged, e.g. across load generators.
+
+    PERCENTILES = [50, 90, 99, 99.9]
+
+    def __init__(self, significant_digits=2, unit=1e-6):
+        # Values are recorded in seconds and counted in integer multiples of unit
+        self.significant_digits = significant_digits
+        self.unit = unit
+        self.sub_bucket_bits = int(math.ceil(math.log2(2 * 10 ** significant_digits)))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds, count=1):
+        value = max(int(round(seconds / self.unit)), 0)
+        index = self.__index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        if (other.significant_digits, other.unit) != (self.significant_digits, self.unit):
+            raise ValueError("Can't merge histograms of different precision")
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def percentile(self, percentile):
+        # Highest value equivalent to the one at percentile, in seconds. None if empty.
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(percentile / 100 * self.count)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.__highest_equivalent(index), self.max) * self.unit
+        return self.max * self.unit
+
+    def summary(self):
+        summary = {"count": self.count, "min": None, "mean": None, "max": None}
+        if self.count:
+            summary["min"] = self.min * self.unit
+            summary["mean"] = self.total / self.count * self.unit
+            summary["max"] = self.max * self.unit
+        for percentile in self.PERCENTILES:
+            summary["p%s" % ("%g" % percentile)] = self.percentile(percentile)
+        return summary
+
+    def to_dict(self):
+        return {
+            "significant_digits": self.significant_digits,
+            "unit": self.unit,
+            "counts": {str(index): count for index, count in self.counts.items()},
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, histogram_dict):
+        histogram = cls(histogram_dict["significant_digits"], histogram_dict["unit"])
+        histogram.counts = {int(index): count for index, count in histogram_dict["counts"].items()}
+        histogram.count = histogram_dict["count"]
+        histogram.total = histogram_dict["total"]
+        histogram.min = histogram_dict["min"]
+        histogram.max = histogram_dict["max"]
+        return histogram
+
+    def __index(self, value):
+        # Values below sub_bucket_count have their own bucket, then each power of two is split in sub_bucket_half
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return self.sub_bucket_count + (shift - 1) * self.sub_bucket_half + (value >> shift) - self.sub_bucket_half
+
+    def __highest_equivalent(self, index):
+        if index < self.sub_bucket_count:
+            return index
+        shift = (index - self.sub_bucket_count) // self.sub_bucket_half + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.sub_bucket_half + self.sub_bucket_half
+        return ((sub_bucket + 1) << shift) - 1
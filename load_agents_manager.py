@@ -0,0 +1,264 @@
+import json
+import logging
+import os
+import shutil
+from threading import Event, Lock
+import time
+
+import docker
+import yaml
+
+from deploy_manager import DeployManager
+from file_transfer import BulkUploader
+from host_manager import HostManager
+from latency_histogram import LatencyHistogram
+from loadgen import parse_workload
+
+class LoadAgentsManager(DeployManager):
+
+    # Runs a workload on an Ethereum deployment from load agents (loadgen_agent.py) placed on their own hosts. Every
+    # agent signs its transactions, reports ready, and sends its share of the load from its slice of benchmark accounts,
+    # all starting at the same wall-clock time once every agent is ready, and streams its per-interval counters to the controller, that merges them in a live timeline.
+
+    remote_datadir = "/home/ubuntu/loadgen"
+    docker_container_name = "loadgen-agent"
+    docker_container_datadir = "/agent/run"
+    images = ("loadgen-agent",)
+    local_datadir = "/root/loadgen"
+
+    # Seconds from the last agent ready to the synchronized start, enough for all agents to poll it
+    start_delay = 5
+    # Seconds an agent waits for the synchronized start once ready, before giving up
+    ready_timeout = 600
+    report_interval = 1
+    # Seconds between checks of agent containers, for agents that exit without reporting
+    container_check_interval = 5
+
+    def __init__(self, hosts, ethereum_manager, workload_file, report_url):
+        # report_url is the controller endpoint agents post their results to, forwarded to report()
+        super().__init__(hosts)
+        self.logger = logging.getLogger("LoadAgentsManager")
+        self.ethereum_manager = ethereum_manager
+        with open(workload_file) as workload_data:
+            self.workload = yaml.safe_load(workload_data)
+        self.round_labels = [benchmark_round.label for benchmark_round in parse_workload(self.workload)]
+        self.report_url = report_url
+        self.agent_conf = {}
+        self.agents_ready = set()
+        self.start_at = None
+        self.intervals = []
+        self.agent_results = {}
+        self.agent_histograms = {}
+        self.agent_errors = {}
+        self.agents_done = Event()
+        self._results_lock = Lock()
+        self._last_container_check = 0
+
+    def parse_conf(self, conf_as_dict):
+        super().parse_conf(conf_as_dict)
+        if "LOADGEN_START_DELAY" in conf_as_dict:
+            self.start_delay = float(conf_as_dict["LOADGEN_START_DELAY"])
+        if "LOADGEN_READY_TIMEOUT" in conf_as_dict:
+            self.ready_timeout = float(conf_as_dict["LOADGEN_READY_TIMEOUT"])
+        if "LOADGEN_REPORT_INTERVAL" in conf_as_dict:
+            self.report_interval = float(conf_as_dict["LOADGEN_REPORT_INTERVAL"])
+        if "LOADGEN_CONNECTIONS" in conf_as_dict:
+            self.agent_conf["connections"] = int(conf_as_dict["LOADGEN_CONNECTIONS"])
+        if "LOADGEN_INCLUSION_TIMEOUT" in conf_as_dict:
+            self.agent_conf["inclusion_timeout"] = float(conf_as_dict["LOADGEN_INCLUSION_TIMEOUT"])
+        if "LOADGEN_OPEN_LOOP" in conf_as_dict:
+            self.agent_conf["open_loop"] = conf_as_dict["LOADGEN_OPEN_LOOP"].lower() in ["1", "true", "yes"]
+        if "LOADGEN_DROP_TIMEOUT" in conf_as_dict:
+            self.agent_conf["drop_timeout"] = float(conf_as_dict["LOADGEN_DROP_TIMEOUT"])
+
+    def _init_setup(self):
+        self.__init_local_dir()
+        with self._step("connect"):
+            self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
+
+    def _start_setup(self):
+        self.ethereum_manager.wait_cmd(DeployManager.CMD_START)
+        self.accounts_file = self.ethereum_manager.FILE_BENCHMARK_ACCOUNTS
+        self._distribute_files(self.accounts_file)
+        with self._results_lock:
+            self.agents_ready.clear()
+            self.start_at = None
+            self.intervals = []
+            self.agent_results = {}
+            self.agent_histograms = {}
+            self.agent_errors = {}
+            self.agents_done.clear()
+        nodes = [(node.host, node.port) for node in self.ethereum_manager.nodes.values()]
+        for agent, host in enumerate(self.hosts):
+            spec = dict(self.agent_conf, **{
+                "agent": agent,
+                "agents": len(self.hosts),
+                "nodes": nodes,
+                "workload": self.workload,
+                "report_url": self.report_url,
+                "report_interval": self.report_interval,
+                "ready_timeout": self.ready_timeout
+            })
+            with open(self.__spec_file(host), "w") as spec_file:
+                json.dump(spec, spec_file)
+        self.logger.info("%d agents will start %ss after all of them are ready" % (len(self.hosts), self.start_delay))
+
+    def _start_loop(self, host):
+        uploader = BulkUploader()
+        # The agent mounts them read-only
+        uploader.add_file(self.__spec_file(host), "spec.json", read_only=True)
+        uploader.add_file(self.accounts_file, "accounts.bin", read_only=True)
+        with self._step("ssh.upload_files"):
+            uploader.upload(self.hosts_connections[host]["ssh"], self.remote_datadir)
+        docker_client = self.hosts_connections[host]["docker"]["client"]
+        try:
+            self._remove_containers([docker_client.containers.get(self.docker_container_name)])
+        except docker.errors.NotFound:
+            pass
+        with self._step("docker.run"):
+            agent_container = docker_client.containers.run(
+                self.dinr.resolve("loadgen-agent"),
+                "%s %s" % (os.path.join(self.docker_container_datadir, "spec.json"), os.path.join(self.docker_container_datadir, "accounts.bin")),
+                detach=True,
+                name=self.docker_container_name,
+                network_mode="host",
+                volumes={
+                    self.remote_datadir: {
+                        "bind": self.docker_container_datadir,
+                        "mode": "ro"
+                    }
+                })
+        self.hosts_connections[host]["docker"]["containers"][self.docker_container_name] = agent_container
+        self.logger.info("[%s]Agent deployed" % host)
+
+    def _stop_loop(self, host):
+        containers = self.hosts_connections[host]["docker"]["containers"]
+        with self._step("docker.remove"):
+            self._remove_containers(containers.values())
+        containers.clear()
+        self.logger.info("[%s]Agent stopped" % host)
+
+    def _cleanup_loop(self, host):
+        self._remove_remote_dirs(host, self.remote_datadir)
+
+    def report(self, message):
+        # Called with the messages agents post to report_url, returns the answer to the agent. Ready agents are
+        # answered the synchronized start time, None until the other agents are ready, or failed, too.
+        if message["type"] == "ready":
+            self.__check_containers()
+        with self._results_lock:
+            agent = message.pop("agent")
+            message_type = message.pop("type")
+            if message_type == "ready":
+                self.agents_ready.add(agent)
+                if self.start_at is None and len(self.agents_ready | set(self.agent_errors)) == len(self.hosts):
+                    self.start_at = time.time() + self.start_delay
+                    self.logger.info("%d agents ready, starting at %s" % (len(self.agents_ready), time.ctime(self.start_at)))
+                return {"start_at": self.start_at}
+            if message_type == "interval":
+                message["agent"] = agent
+                self.intervals.append(message)
+            elif message_type == "done":
+                self.agent_results[agent] = message["results"]
+                self.agent_histograms[agent] = message["histograms"]
+                self.__update_done()
+            else:
+                self.__agent_failed(agent, message.get("error"))
+            return {}
+
+    def results(self):
+        # Rounds merged across agents and the timeline of the whole offered load, one point per report interval
+        self.__check_containers()
+        with self._results_lock:
+            rounds = [self.__merge_round(label) for label in self.round_labels]
+            return {
+                "completed": self.agents_done.is_set(),
+                "agents": len(self.hosts),
+                "agents_ready": len(self.agents_ready),
+                "start_at": self.start_at,
+                "agents_done": sorted(self.agent_results),
+                "agents_failed": self.agent_errors,
+                "rounds": rounds,
+                "timeline": self.__timeline()
+            }
+
+    def __agent_failed(self, agent, error):
+        # Called holding _results_lock
+        self.agent_errors[agent] = error
+        self.logger.error("Agent %d failed: %s" % (agent, error))
+        self.__update_done()
+
+    def __update_done(self):
+        if len(set(self.agent_results) | set(self.agent_errors)) == len(self.hosts):
+            self.agents_done.set()
+
+    def __check_containers(self):
+        # Agents whose container exited without their final report, e.g. crashed or couldn't start, are failed, so
+        # that the others don't wait for them to be ready and results complete. Checked every container_check_interval.
+        with self._results_lock:
+            if time.monotonic() - self._last_container_check < self.container_check_interval:
+                return
+            self._last_container_check = time.monotonic()
+            pending = [(agent, host) for agent, host in enumerate(self.hosts) if agent not in self.agent_results and agent not in self.agent_errors]
+        hosts_connections = getattr(self, "hosts_connections", {})
+        for agent, host in pending:
+            containers = hosts_connections[host]["docker"]["containers"] if host in hosts_connections else {}
+            container = containers.get(self.docker_container_name)
+            if container is None:
+                continue
+            try:
+                container.reload()
+            except Exception as error:
+                self.logger.warning("[%s]Can't check agent container: %s" % (host, error))
+                continue
+            if container.status in ["exited", "dead"]:
+                with self._results_lock:
+                    if agent not in self.agent_results and agent not in self.agent_errors:
+                        self.__agent_failed(agent, "Agent container exited with status %s" % container.attrs["State"].get("ExitCode"))
+
+    def __merge_round(self, label):
+        merged = {"label": label, "sent": 0, "failed": 0, "included": 0, "send_tps": 0, "throughput_tps": 0}
+        histograms = {"confirmation": LatencyHistogram(), "submission": LatencyHistogram()}
+        for agent, results in self.agent_results.items():
+            for result in results:
+                if result["label"] != label:
+                    continue
+                for key in ["sent", "failed", "included", "send_tps", "throughput_tps"]:
+                    merged[key] += result[key]
+                for kind, histogram in histograms.items():
+                    histogram.merge(LatencyHistogram.from_dict(self.agent_histograms[agent][label][kind]))
+        merged["confirmation_latency"] = histograms["confirmation"].summary()
+        merged["submission_latency"] = histograms["submission"].summary()
+        return merged
+
+    def __timeline(self):
+        # Agents intervals are bucketed by the report interval since the synchronized start
+        timeline = {}
+        start_at = self.start_at or 0
+        for interval in self.intervals:
+            bucket = int((interval["end"] - start_at) // self.report_interval)
+            point = timeline.setdefault(bucket, {"sent": 0, "acknowledged": 0, "failed": 0, "included": 0, "confirmation": LatencyHistogram()})
+            for key in ["sent", "acknowledged", "failed", "included"]:
+                point[key] += interval[key]
+            point["confirmation"].merge(LatencyHistogram.from_dict(interval["confirmation"]))
+        points = []
+        for bucket in sorted(timeline):
+            point = timeline[bucket]
+            point["time"] = (bucket + 1) * self.report_interval
+            point["confirmation_p99"] = point.pop("confirmation").percentile(99)
+            points.append(point)
+        return points
+
+    def __spec_file(self, host):
+        return os.path.join(self.local_datadir, "spec-%s.json" % host)
+
+    def __init_local_dir(self):
+        try:
+            shutil.rmtree(self.local_datadir)
+            os.makedirs(self.local_datadir)
+            self.logger.info("Local datadir (%s) successfully cleaned" % self.local_datadir)
+        except FileNotFoundError:
+            os.makedirs(self.local_datadir)
+            self.logger.info("Created local datadir (%s)" % self.local_datadir)
+        except Exception as error:
+            self.logger.error(error)
@@ -0,0 +1,483 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import json
+import logging
+import os
+import tempfile
+import time
+
+import yaml
+
+from benchmark_accounts import BenchmarkAccounts
+from json_rpc import JsonRpcConnection
+from latency_histogram import LatencyHistogram
+from nonce_manager import NonceManager
+from tx_corpus import TransactionCorpus, sign_transfer
+
+class RateControl:
+
+    # Send schedule of a round, named after the Caliper rate controllers it replaces. fixed-rate sends tps
+    # transactions per second, linear-rate goes from start_tps to end_tps over the round and step-rate holds the tps
+    # of each step for its duration.
+
+    FIXED = "fixed-rate"
+    RAMP = "linear-rate"
+    STEP = "step-rate"
+
+    AVAILABLE_KINDS = {FIXED, RAMP, STEP}
+
+    # Lowest rate a schedule advances at, so that a ramp starting from 0 tps doesn't stall
+    MIN_TPS = 0.1
+
+    def __init__(self, kind=FIXED, tps=10, end_tps=None, steps=()):
+        # steps are (tps, duration) pairs
+        if kind not in self.AVAILABLE_KINDS:
+            raise ValueError("{0} isn't an available rate control".format(kind))
+        if kind == self.STEP and not steps:
+            raise ValueError("step-rate requires at least one step")
+        self.kind = kind
+        self.tps = tps
+        self.end_tps = tps if end_tps is None else end_tps
+        self.steps = [(float(step_tps), float(step_duration)) for step_tps, step_duration in steps]
+
+    @classmethod
+    def from_spec(cls, spec):
+        # Caliper rateControl syntax, e.g. {"type": "linear-rate", "opts": {"startingTps": 10, "finishingTps": 100}}
+        opts = spec.get("opts", {})
+        kind = spec.get("type", cls.FIXED)
+        if kind == cls.RAMP:
+            return cls(kind, tps=float(opts.get("startingTps", 10)), end_tps=float(opts.get("finishingTps", 10)))
+        if kind == cls.STEP:
+            return cls(kind, steps=[(step["tps"], step["duration"]) for step in opts.get("steps", [])])
+        return cls(kind, tps=float(opts.get("tps", 10)))
+
+    def scaled(self, factor):
+        return RateControl(self.kind, self.tps * factor, self.end_tps * factor, [(step_tps * factor, step_duration) for step_tps, step_duration in self.steps])
+
+    def duration(self):
+        # Own duration of the schedule, None when the round has to bound it
+        if self.kind == self.STEP:
+            return sum(step_duration for _, step_duration in self.steps)
+        return None
+
+    def send_times(self, tx_number=None, duration=None):
+        # Offsets in seconds from the round start of each transaction. A ramp progresses over tx_number when given,
+        # otherwise over duration.
+        duration = self.duration() if duration is None and tx_number is None else duration
+        if tx_number is None and duration is None:
+            raise ValueError("{0} rounds need a number of transactions or a duration".format(self.kind))
+        offset, index = 0.0, 0
+        while (tx_number is None or index < tx_number) and (duration is None or offset < duration):
+            yield offset
+            index += 1
+            progress = index / tx_number if tx_number else offset / duration
+            offset += 1 / max(self.rate_at(offset, progress), self.MIN_TPS)
+
+    def rate_at(self, offset, progress):
+        if self.kind == self.RAMP:
+            return self.tps + (self.end_tps - self.tps) * min(progress, 1)
+        if self.kind == self.STEP:
+            step_end = 0
+            for step_tps, step_duration in self.steps:
+                step_end += step_duration
+                if offset < step_end:
+                    return step_tps
+            return self.steps[-1][0]
+        return self.tps
+
+class Round:
+
+    def __init__(self, label, rate_control, tx_number=None, duration=None):
+        self.label = label
+        self.rate_control = rate_control
+        self.tx_number = tx_number
+        self.duration = duration
+
+    def share(self, index, count):
+        # Part of the round run by the index-th of count load generators running it together
+        tx_number = None
+        if self.tx_number is not None:
+            tx_number = self.tx_number // count + (1 if index < self.tx_number % count else 0)
+        return Round(self.label, self.rate_control.scaled(1 / count), tx_number, self.duration)
+
+def load_workload(path):
+    # Rounds of a workload file, JSON or YAML, in Caliper benchmark syntax: a list of rounds, under test if it's a
+    # whole Caliper config, each with label, rateControl and txNumber or txDuration. Lists of txNumber or txDuration
+    # are repetitions of the round, each with the rateControl at the same index.
+    with open(path) as workload_file:
+        return parse_workload(yaml.safe_load(workload_file))
+
+def parse_workload(workload):
+    if isinstance(workload, dict):
+        workload = workload.get("test", workload).get("rounds", [])
+    rounds = []
+    for round_spec in workload:
+        bounds_key = "txNumber" if "txNumber" in round_spec else "txDuration"
+        bounds = round_spec.get(bounds_key, [None])
+        bounds = bounds if isinstance(bounds, list) else [bounds]
+        rate_controls = round_spec.get("rateControl", [{}])
+        rate_controls = rate_controls if isinstance(rate_controls, list) else [rate_controls]
+        for repetition, bound in enumerate(bounds):
+            label = round_spec.get("label", "round-%d" % len(rounds))
+            if len(bounds) > 1:
+                label = "%s-%d" % (label, repetition)
+            rounds.append(Round(
+                label,
+                RateControl.from_spec(rate_controls[min(repetition, len(rate_controls) - 1)]),
+                tx_number=int(bound) if bounds_key == "txNumber" and bound is not None else None,
+                duration=float(bound) if bounds_key == "txDuration" and bound is not None else None))
+    return rounds
+
+class TransactionRecord:
+
+    # Wall-clock times of a transaction: intended when the schedule wanted it sent, submitted when written to the node,
+    # acknowledged when the node answered and included when its block was first seen. Times stay None when not reached.
+
+    __slots__ = ["round", "hash", "sender", "nonce", "node", "intended", "submitted", "acknowledged", "included", "block", "error"]
+
+    FIELDS = __slots__
+
+    def __init__(self, round_label, tx_hash, sender, nonce, node):
+        self.round = round_label
+        self.hash = tx_hash
+        self.sender = sender
+        self.nonce = nonce
+        self.node = node
+        self.intended = None
+        self.submitted = None
+        self.acknowledged = None
+        self.included = None
+        self.block = None
+        self.error = None
+
+class LoadGenerator:
+
+    # Drives value transfers between benchmark accounts straight to the JSON-RPC endpoints of Ethereum nodes, from a
+    # single asyncio loop over persistent connections. Transactions of all the rounds are signed before the first one
+    # starts into a TransactionCorpus, so that sending them is just I/O. Nonces are owned by a NonceManager sharded by
+    # node: each sender always goes to the same node, to keep its nonces in order. Senders whose transactions fail or
+    # get dropped are resynced in batch, then the nonces they left unused are filled by transactions signed in a
+    # process pool, so that their following corpus transactions have the right nonces again.
+    # Latencies are measured from the intended send time of the schedule, not from the actual send, so that a node
+    # falling behind shows up in them instead of slowing the load down unnoticed (coordinated omission).
+
+    def __init__(self, nodes, accounts_path, connections_per_node=8, inclusion_timeout=60, poll_interval=0.2, open_loop=False, shard=(0, 1),
+            corpus_path=None, signing_processes=None, drop_timeout=60):
+        # nodes are EthereumNode, accounts_path a BenchmarkAccounts file of accounts funded in genesis. Closed loop
+        # sends over at most connections_per_node in flight requests per node, open loop opens more connections
+        # whenever they are all busy, so that transactions always leave at their intended time. shard (index, count)
+        # restricts senders to one of count disjoint slices, for load generators sharing the same accounts. The
+        # corpus goes to corpus_path, or to a temporary file removed after the run. Transactions not included after
+        # drop_timeout seconds are considered dropped by the node, and their sender resynced.
+        if not nodes:
+            raise ValueError("At least one node is required")
+        self.nodes = list(nodes)
+        self.accounts_path = accounts_path
+        self.connections_per_node = connections_per_node
+        self.inclusion_timeout = inclusion_timeout
+        self.poll_interval = poll_interval
+        self.open_loop = open_loop
+        self.shard = shard
+        self.corpus_path = corpus_path
+        self.signing_processes = signing_processes
+        self.drop_timeout = drop_timeout
+        # on_ready, if set, is called from a worker thread once the corpus is signed and returns the wall-clock time to
+        # start the first round at, overriding the one given to run
+        self.on_ready = None
+        # on_report, if set, is called from a worker thread with the counters of every report_interval of a round
+        self.on_report = None
+        self.report_interval = 1
+        self.records = []
+        self.results = []
+        # Per round label, "confirmation" (intended to inclusion) and "submission" (intended to acknowledge) histograms
+        self.histograms = {}
+        self.logger = logging.getLogger("LoadGenerator")
+
+    def parse_conf(self, conf_as_dict):
+        if "LOADGEN_CONNECTIONS" in conf_as_dict:
+            self.connections_per_node = int(conf_as_dict["LOADGEN_CONNECTIONS"])
+        if "LOADGEN_INCLUSION_TIMEOUT" in conf_as_dict:
+            self.inclusion_timeout = float(conf_as_dict["LOADGEN_INCLUSION_TIMEOUT"])
+        if "LOADGEN_POLL_INTERVAL" in conf_as_dict:
+            self.poll_interval = float(conf_as_dict["LOADGEN_POLL_INTERVAL"])
+        if "LOADGEN_OPEN_LOOP" in conf_as_dict:
+            self.open_loop = conf_as_dict["LOADGEN_OPEN_LOOP"].lower() in ["1", "true", "yes"]
+        if "LOADGEN_SIGNING_PROCESSES" in conf_as_dict:
+            self.signing_processes = int(conf_as_dict["LOADGEN_SIGNING_PROCESSES"])
+        if "LOADGEN_DROP_TIMEOUT" in conf_as_dict:
+            self.drop_timeout = float(conf_as_dict["LOADGEN_DROP_TIMEOUT"])
+
+    def run(self, rounds, start_at=None):
+        # Runs the rounds one after the other and returns their summaries, also kept in results. The first round
+        # starts at start_at wall-clock time if given, so that load generators on different hosts start together.
+        return asyncio.run(self.__run(rounds, start_at))
+
+    def write_records(self, path):
+        with open(path, "w", newline="") as records_file:
+            writer = csv.writer(records_file)
+            writer.writerow(TransactionRecord.FIELDS)
+            for record in self.records:
+                writer.writerow([getattr(record, field) for field in TransactionRecord.FIELDS])
+
+    async def __run(self, rounds, start_at):
+        self.__connections = [[JsonRpcConnection(node.host, node.port) for _ in range(self.connections_per_node)] for node in self.nodes]
+        self.__tracker_connection = JsonRpcConnection(self.nodes[0].host, self.nodes[0].port)
+        # Dedicated to nonce syncs, one per node as nonce shards are
+        self.__nonce_connections = [JsonRpcConnection(node.host, node.port) for node in self.nodes]
+        maintainer, tracker = None, None
+        corpus_path = self.corpus_path
+        if corpus_path is None:
+            corpus_fd, corpus_path = tempfile.mkstemp(suffix=".corpus")
+            os.close(corpus_fd)
+        self.__corpus = TransactionCorpus(corpus_path, processes=self.signing_processes)
+        # Signs the transactions filling nonce gaps of resynced senders, off the sending loop
+        self.__signer = ProcessPoolExecutor(max_workers=1)
+        try:
+            await self.__prepare()
+            schedules = [list(r.rate_control.send_times(r.tx_number, r.duration)) for r in rounds]
+            nonces = [self.nonce_manager.next_nonces[address] for address, _ in self.senders]
+            await asyncio.get_event_loop().run_in_executor(None, self.__corpus.build,
+                self.senders, nonces, sum(len(send_times) for send_times in schedules), self.chain_id, self.gas_price)
+            self.__corpus_offset = 0
+            if self.on_ready is not None:
+                start_at = await asyncio.get_event_loop().run_in_executor(None, self.on_ready)
+            maintainer = asyncio.ensure_future(self.__maintain_nonces())
+            # Transactions waiting for inclusion, by hash. Those of a round still pending when it ends are kept, so
+            # that their inclusion in a later round still settles their sender nonces.
+            self.__pending = {}
+            last_block = int(await self.__tracker_connection.call("eth_blockNumber"), 16)
+            tracker = asyncio.ensure_future(self.__track_inclusions(last_block))
+            for benchmark_round, send_times in zip(rounds, schedules):
+                self.results.append(await self.__run_round(benchmark_round, send_times, start_at))
+                start_at = None
+        finally:
+            for task in [maintainer, tracker]:
+                if task is not None:
+                    task.cancel()
+            for connection in [self.__tracker_connection] + self.__nonce_connections + [c for node_connections in self.__connections for c in node_connections]:
+                await connection.close()
+            self.__signer.shutdown(wait=False, cancel_futures=True)
+            self.__corpus.close()
+            if self.corpus_path is None:
+                os.remove(corpus_path)
+        return self.results
+
+    async def __prepare(self):
+        try:
+            self.chain_id = int(await self.__tracker_connection.call("eth_chainId"), 16)
+        except Exception:
+            self.chain_id = int(await self.__tracker_connection.call("net_version"))
+        self.gas_price = int(await self.__tracker_connection.call("eth_gasPrice"), 16)
+        shard_index, shard_count = self.shard
+        self.senders = list(BenchmarkAccounts(self.accounts_path).keys())[shard_index::shard_count]
+        if not self.senders:
+            raise ValueError("No benchmark accounts in %s" % self.accounts_path)
+        self.nonce_manager = NonceManager([address for address, _ in self.senders], shards=len(self.nodes), drop_timeout=self.drop_timeout)
+        await self.nonce_manager.sync(self.__nonce_connections)
+        self.logger.info("Loaded %d senders, chain id %d, gas price %d" % (len(self.senders), self.chain_id, self.gas_price))
+
+    async def __run_round(self, benchmark_round, send_times, start_at=None):
+        corpus_start = self.__corpus_offset
+        self.__corpus_offset += len(send_times)
+        records = []
+        resyncs = self.nonce_manager.resyncs
+        self.__idle = []
+        for node_connections in self.__connections:
+            idle = asyncio.Queue()
+            for connection in node_connections:
+                idle.put_nowait(connection)
+            self.__idle.append(idle)
+        if start_at is not None:
+            if start_at < time.time():
+                self.logger.warning("[%s]Starting %.1fs late on the synchronized start" % (benchmark_round.label, time.time() - start_at))
+            await asyncio.sleep(max(start_at - time.time(), 0))
+        loop = asyncio.get_event_loop()
+        started = time.time()
+        self.__interval = self.__new_interval(benchmark_round.label, started)
+        reporter = asyncio.ensure_future(self.__report_intervals()) if self.on_report else None
+        start = loop.time()
+        sends = []
+        for send_time, (sender, nonce, tx_hash, raw_transaction) in zip(send_times, self.__corpus.records(corpus_start, self.__corpus_offset)):
+            delay = start + send_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            address = self.senders[sender][0]
+            node = self.nonce_manager.shard(address)
+            if address in self.nonce_manager.dirty:
+                # Its nonce is unknown until resynced
+                record = TransactionRecord(benchmark_round.label, None, address, None, self.nodes[node].host)
+                record.intended = started + send_time
+                record.error = "Sender nonce resync pending"
+                records.append(record)
+                self.__interval["failed"] += 1
+                continue
+            if not self.nonce_manager.expect(address, nonce):
+                next_nonce = self.nonce_manager.next_nonces[address]
+                if nonce < next_nonce:
+                    # Resynced ahead of the corpus, e.g. after fillers: skipped until its records catch up
+                    record = TransactionRecord(benchmark_round.label, None, address, None, self.nodes[node].host)
+                    record.intended = started + send_time
+                    record.error = "Nonce %d already used after resync" % nonce
+                    records.append(record)
+                    self.__interval["failed"] += 1
+                    continue
+                # Resynced behind the corpus: the nonces the node doesn't hold are filled, then the corpus record is
+                # valid again
+                fillers = []
+                for gap_nonce in self.nonce_manager.fill(address, nonce):
+                    filler = TransactionRecord(benchmark_round.label, None, address, gap_nonce, self.nodes[node].host)
+                    filler.intended = started + send_time
+                    fillers.append(filler)
+                if fillers:
+                    records.extend(fillers)
+                    sends.append(asyncio.ensure_future(self.__send_fillers(sender, fillers, node)))
+                self.nonce_manager.expect(address, nonce)
+            record = TransactionRecord(benchmark_round.label, tx_hash, address, nonce, self.nodes[node].host)
+            record.intended = started + send_time
+            records.append(record)
+            sends.append(asyncio.ensure_future(self.__send(record, raw_transaction, node)))
+        await asyncio.gather(*sends)
+        sent = time.time()
+        deadline = loop.time() + self.inclusion_timeout
+        while loop.time() < deadline and any(record.round == benchmark_round.label for record in self.__pending.values()):
+            await asyncio.sleep(self.poll_interval)
+        if reporter is not None:
+            reporter.cancel()
+            await self.__flush_interval()
+        self.records.extend(records)
+        return self.__summary(benchmark_round, records, started, sent, self.nonce_manager.resyncs - resyncs)
+
+    async def __send_fillers(self, sender, fillers, node):
+        # Signs the fillers of a resynced sender in the signing pool and sends them in nonce order
+        recipient = self.senders[(sender + 1) % len(self.senders)][0]
+        loop = asyncio.get_event_loop()
+        for record in fillers:
+            try:
+                tx_hash, raw_transaction = await loop.run_in_executor(self.__signer, sign_transfer,
+                    self.senders[sender][1], record.nonce, recipient, self.chain_id, self.gas_price)
+            except Exception as error:
+                self.nonce_manager.failed(record.sender, record.nonce, error)
+                record.error = str(error)
+                self.__interval["failed"] += 1
+                continue
+            record.hash = "0x" + tx_hash.hex()
+            await self.__send(record, "0x" + raw_transaction.hex(), node)
+
+    async def __send(self, record, raw_transaction, node):
+        idle = self.__idle[node]
+        if self.open_loop and idle.empty():
+            connection = JsonRpcConnection(self.nodes[node].host, self.nodes[node].port)
+            self.__connections[node].append(connection)
+        else:
+            connection = await idle.get()
+        try:
+            # A transaction is sent once it can leave: failing to connect doesn't count as a send
+            await connection.connect()
+            self.__pending[record.hash] = record
+            record.submitted = time.time()
+            self.nonce_manager.sent(record.sender, record.nonce, record.submitted)
+            self.__interval["sent"] += 1
+            try:
+                await connection.send_raw_transaction(raw_transaction)
+            except Exception as error:
+                if self.nonce_manager.failed(record.sender, record.nonce, error):
+                    raise
+            record.acknowledged = time.time()
+            self.__interval["acknowledged"] += 1
+        except Exception as error:
+            if record.submitted is None:
+                # Its nonce is left unused
+                self.nonce_manager.failed(record.sender, record.nonce, error)
+            record.error = str(error)
+            self.__interval["failed"] += 1
+            self.__pending.pop(record.hash, None)
+        finally:
+            idle.put_nowait(connection)
+
+    async def __track_inclusions(self, last_block):
+        while True:
+            try:
+                head = int(await self.__tracker_connection.call("eth_blockNumber"), 16)
+                for number in range(last_block + 1, head + 1):
+                    block = await self.__tracker_connection.call("eth_getBlockByNumber", (hex(number), False))
+                    seen = time.time()
+                    for tx_hash in block["transactions"]:
+                        record = self.__pending.pop(tx_hash, None)
+                        if record is not None:
+                            self.nonce_manager.included(record.sender, record.nonce)
+                            record.included = seen
+                            record.block = number
+                            self.__interval["included"] += 1
+                            self.__interval["confirmation"].record(seen - record.intended)
+                    last_block = number
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.logger.warning("Can't track inclusions: %s" % error)
+            await asyncio.sleep(self.poll_interval)
+
+    async def __maintain_nonces(self):
+        while True:
+            try:
+                dropped = self.nonce_manager.find_dropped()
+                if dropped:
+                    self.logger.warning("%d senders have transactions not included after %ds" % (len(dropped), self.drop_timeout))
+                await self.nonce_manager.resync(self.__nonce_connections)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.logger.warning("Can't resync nonces: %s" % error)
+            await asyncio.sleep(self.poll_interval)
+
+    @staticmethod
+    def __new_interval(label, start):
+        return {"round": label, "start": start, "sent": 0, "acknowledged": 0, "failed": 0, "included": 0, "confirmation": LatencyHistogram()}
+
+    async def __report_intervals(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            await self.__flush_interval()
+
+    async def __flush_interval(self):
+        interval, now = self.__interval, time.time()
+        self.__interval = self.__new_interval(interval["round"], now)
+        interval["end"] = now
+        interval["confirmation"] = interval["confirmation"].to_dict()
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self.on_report, interval)
+        except Exception as error:
+            self.logger.warning("Can't report interval: %s" % error)
+
+    def __summary(self, benchmark_round, records, started, sent, resynced_senders):
+        # Transactions that failed before leaving, e.g. on a connection error, aren't sent
+        submitted = [record for record in records if record.submitted is not None]
+        included = [record for record in records if record.included is not None]
+        failed = [record for record in records if record.error is not None]
+        histograms = {"confirmation": LatencyHistogram(), "submission": LatencyHistogram()}
+        for record in included:
+            histograms["confirmation"].record(record.included - record.intended)
+        for record in records:
+            if record.acknowledged is not None:
+                histograms["submission"].record(record.acknowledged - record.intended)
+        self.histograms[benchmark_round.label] = histograms
+        inclusion_window = max([record.included for record in included] + [started]) - started
+        summary = {
+            "label": benchmark_round.label,
+            "sent": len(submitted),
+            "failed": len(failed),
+            "included": len(included),
+            "send_duration": sent - started,
+            "send_tps": len(submitted) / (sent - started) if sent > started else 0,
+            "throughput_tps": len(included) / inclusion_window if inclusion_window > 0 else 0,
+            "open_loop": self.open_loop,
+            "max_send_lag": max([record.submitted - record.intended for record in submitted] + [0]),
+            "connections": sum(len(node_connections) for node_connections in self.__connections),
+            "resynced_senders": resynced_senders,
+            "confirmation_latency": histograms["confirmation"].summary(),
+            "submission_latency": histograms["submission"].summary()
+        }
+        if failed:
+            self.logger.warning("[%s]%d transactions failed, e.g. %s" % (benchmark_round.label, len(failed), failed[0].error))
+        self.logger.info("[%s]%s" % (benchmark_round.label, json.dumps(summary)))
+        return summary
@@ -0,0 +1,82 @@
+from collections import namedtuple
+import json
+import logging
+import sys
+import time
+
+import requests
+
+from loadgen import LoadGenerator, parse_workload
+
+# Load generation agent, run in a container on load hosts by LoadAgentsManager. Its spec file gives the nodes to
+# target, the workload, the agent slice of senders and load and where to report. Once its transactions are signed
+# the agent reports ready until the controller answers with the synchronized start time, set when all agents are.
+# Counters of every interval are posted to report_url as they come, then a final message with round summaries and
+# latency histograms, so that the controller can merge them with the other agents' ones.
+
+Endpoint = namedtuple("Endpoint", ["host", "port"])
+
+class LoadAgent:
+
+    # Seconds between ready reports while waiting for the synchronized start
+    ready_interval = 1
+
+    def __init__(self, spec, accounts_path):
+        self.spec = spec
+        self.agent = spec["agent"]
+        self.agents = spec["agents"]
+        self.report_url = spec["report_url"]
+        self.logger = logging.getLogger("LoadAgent")
+        self.load_generator = LoadGenerator(
+            [Endpoint(host, port) for host, port in spec["nodes"]],
+            accounts_path,
+            connections_per_node=spec.get("connections", 8),
+            inclusion_timeout=spec.get("inclusion_timeout", 60),
+            open_loop=spec.get("open_loop", False),
+            drop_timeout=spec.get("drop_timeout", 60),
+            shard=(self.agent, self.agents))
+        self.load_generator.on_ready = self.__wait_start
+        self.load_generator.on_report = self.__report_interval
+        self.load_generator.report_interval = spec.get("report_interval", 1)
+
+    def run(self):
+        rounds = [benchmark_round.share(self.agent, self.agents) for benchmark_round in parse_workload(self.spec["workload"])]
+        try:
+            results = self.load_generator.run(rounds)
+        except Exception as error:
+            self.logger.exception("Load generation failed")
+            self.__post({"type": "failed", "error": str(error)})
+            raise
+        self.__post({
+            "type": "done",
+            "results": results,
+            "histograms": {label: {kind: histogram.to_dict() for kind, histogram in histograms.items()}
+                for label, histograms in self.load_generator.histograms.items()}
+        })
+
+    def __wait_start(self):
+        deadline = time.monotonic() + self.spec.get("ready_timeout", 600)
+        while True:
+            start_at = self.__post({"type": "ready"}).get("start_at")
+            if start_at is not None:
+                self.logger.info("Starting at %s" % time.ctime(start_at))
+                return start_at
+            if time.monotonic() > deadline:
+                raise TimeoutError("No synchronized start after %ds ready" % self.spec.get("ready_timeout", 600))
+            time.sleep(self.ready_interval)
+
+    def __report_interval(self, interval):
+        interval["type"] = "interval"
+        self.__post(interval)
+
+    def __post(self, message):
+        message["agent"] = self.agent
+        response = requests.post(self.report_url, json=message, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with open(sys.argv[1]) as spec_file:
+        agent_spec = json.load(spec_file)
+    LoadAgent(agent_spec, sys.argv[2]).run()
@@ -3,6 +3,7 @@ import logging
 import os
 
 from deploy_manager import DeployManager
+from file_transfer import BulkUploader
 from host_manager import HostManager
 
 class MultichainManager(DeployManager):
@@ -15,6 +16,10 @@ class MultichainManager(DeployManager):
 
     conf_dir = "./multichain"
 
+    images = ("multichain-node",)
+    # Stopped nodes keep their datadir for the next start, so they get docker's default time to shut down cleanly
+    stop_timeout = 10
+
     host_conf = {
         "datadir": "/home/ubuntu/multichain",
         "network_name": "benchmark",
@@ -42,7 +47,8 @@ class MultichainManager(DeployManager):
         return os.path.join(self.host_conf["datadir"], self.bc_name)
 
     def _init(self):
-        self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
+        with self._step("connect"):
+            self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
     
     def _start_setup(self):
         if len(self.hosts) < 1:
@@ -64,7 +70,8 @@ class MultichainManager(DeployManager):
         docker_client = self.hosts_connections[host]["docker"]["client"]
         try:
             node = docker_client.containers.get(self.host_conf["container_name"])
-            node.stop()
+            with self._step("docker.stop"):
+                node.stop(timeout=self.stop_timeout)
         except docker.errors.NotFound:
             pass
         self.logger.info("[%s]Successfully stopped" % host)
@@ -73,10 +80,10 @@ class MultichainManager(DeployManager):
         docker_client = self.hosts_connections[host]["docker"]["client"]
         try:
             node = docker_client.containers.get(self.host_conf["container_name"])
-            node.remove(force=True)
+            self._remove_containers([node])
         except docker.errors.NotFound:
             pass
-        self.hosts_connections[host]["ssh"].sudo("rm -rf " + self.get_datadir())
+        self._remove_remote_dirs(host, self.get_datadir())
         self.logger.info("[%s]Successfully cleaned" % host)
         
     def _deploy_seed(self, host):
@@ -88,15 +95,15 @@ class MultichainManager(DeployManager):
             return False
         connection = self.hosts_connections[host]["ssh"]
         datadir = self.get_datadir()
-        make_datadir = connection.run('mkdir -p ' + datadir)
-        if not make_datadir.ok:
-            self.logger.error("[%s]Error creating datadir. Seed deploy aborted." % host)
+        uploader = BulkUploader()
+        uploader.add_file(os.path.join(self.conf_dir, 'params.dat'), 'params.dat')
+        uploader.add_file(os.path.join(self.conf_dir, 'multichain.conf'), 'multichain.conf')
+        try:
+            uploader.upload(connection, datadir)
+        except Exception as error:
+            self.logger.error("[%s]Error uploading node files (%s). Seed deploy aborted." % (host, error))
             return False
-        self.logger.debug("[%s][SEED]Created datadir directory" % host)
-        connection.put(os.path.join(self.conf_dir, 'params.dat'), remote=datadir)
-        self.logger.debug("[%s][SEED]Uploaded params.dat" % host)
-        connection.put(os.path.join(self.conf_dir, 'multichain.conf'), remote=datadir)
-        self.logger.debug("[%s][SEED]Uploaded multichain.conf" % host)
+        self.logger.debug("[%s][SEED]Uploaded params.dat and multichain.conf" % host)
         self.hosts_connections[host]["docker"]["containers"] = docker_client.containers.run(
             self.dinr.resolve("multichain-node"),
             "multichaind %s -logtimemillis -shrinkdebugfile=0" % self.bc_name,
@@ -128,18 +135,17 @@ class MultichainManager(DeployManager):
         except docker.errors.APIError:
             self.logger.error("[%s]Can't contact docker engine. Seed deploy aborted." % host)
             return False
-        connection = self.hosts_connections[host]["ssh"]
         datadir = self.get_datadir()
-        make_datadir = connection.run('mkdir -p ' + datadir)
-        if not make_datadir.ok:
-            self.logger.error("[%s]Error creating datadir. Seed deploy aborted." % host)
-            return False
-        self.logger.debug("[%s]Created datadir directory" % host)
+        uploader = BulkUploader()
         if self.bc_protocol == self.BITCOIN:
-            connection.put(self.compiled_params, remote=os.path.join(datadir, "params.dat"))
-            self.logger.debug("[%s]Uploaded params.dat" % host)
-        connection.put(os.path.join(self.conf_dir, 'multichain.conf'), remote=datadir)
-        self.logger.debug("[%s]Uploaded multichain.conf" % host)
+            uploader.add_file(self.compiled_params, "params.dat")
+        uploader.add_file(os.path.join(self.conf_dir, 'multichain.conf'), 'multichain.conf')
+        try:
+            uploader.upload(self.hosts_connections[host]["ssh"], datadir)
+        except Exception as error:
+            self.logger.error("[%s]Error uploading node files (%s). Node deploy aborted." % (host, error))
+            return False
+        self.logger.debug("[%s]Uploaded node files" % host)
         self.hosts_connections[host]["docker"]["containers"] = docker_client.containers.run(
             self.dinr.resolve("multichain-node"),
             "multichaind {0}@{1}:{2}".format(self.bc_name, seed, self.host_conf["node_network_port"]),
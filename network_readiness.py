@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+
+class NetworkReadiness:
+
+    # Blocks until an Ethereum network is fit for a benchmark: nodes connected to their peers, not syncing and sealing
+    # blocks at the same pace. Every poll queries all the nodes concurrently.
+
+    def __init__(self, min_blocks=1, peer_ratio=1.0, max_head_lag=2, node_ratio=1.0, timeout=300, poll_interval=1, workers=32):
+        # A node is ready when it has peer_ratio of its expected peers, isn't syncing, has at least min_blocks blocks
+        # and is at most max_head_lag blocks behind the highest head. The network is ready with node_ratio ready nodes.
+        self.min_blocks = min_blocks
+        self.peer_ratio = peer_ratio
+        self.max_head_lag = max_head_lag
+        self.node_ratio = node_ratio
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.workers = workers
+        self.logger = logging.getLogger("NetworkReadiness")
+
+    @classmethod
+    def from_conf(cls, conf_as_dict):
+        return cls(
+            min_blocks=int(conf_as_dict.get("READY_MIN_BLOCKS", 1)),
+            peer_ratio=float(conf_as_dict.get("READY_PEER_RATIO", 1.0)),
+            max_head_lag=int(conf_as_dict.get("READY_MAX_HEAD_LAG", 2)),
+            node_ratio=float(conf_as_dict.get("READY_NODE_RATIO", 1.0)),
+            timeout=float(conf_as_dict.get("READY_TIMEOUT", 300)))
+
+    def wait(self, nodes, expected_peers, since=None):
+        # nodes maps names to EthereumNode, expected_peers names to their number of peers in the topology.
+        # Returns the seconds from since (default now) to the first block and to full connectivity, None if not reached.
+        since = time.time() if since is None else since
+        deadline = time.monotonic() + self.timeout
+        report = {"ready": False, "time_to_first_block": None, "time_to_full_mesh": None}
+        names = list(nodes)
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(names)), 1), thread_name_prefix="NetworkReadiness") as executor:
+            while True:
+                statuses = dict(zip(names, executor.map(lambda name: self.__poll(nodes[name]), names)))
+                elapsed = time.time() - since
+                reachable = {name: status for name, status in statuses.items() if status is not None}
+                highest_head = max([status["head"] for status in reachable.values()] + [0])
+                if report["time_to_first_block"] is None and highest_head >= 1:
+                    report["time_to_first_block"] = elapsed
+                connected = [name for name, status in reachable.items() if status["peers"] >= self.peer_ratio * expected_peers.get(name, 0)]
+                if report["time_to_full_mesh"] is None and len(connected) == len(names):
+                    report["time_to_full_mesh"] = elapsed
+                ready = [name for name in connected if not reachable[name]["syncing"]
+                    and reachable[name]["head"] >= self.min_blocks
+                    and highest_head - reachable[name]["head"] <= self.max_head_lag]
+                if len(ready) >= self.node_ratio * len(names):
+                    report["ready"] = True
+                    self.logger.info("Network ready: %d/%d nodes at head %d after %.1fs" % (len(ready), len(names), highest_head, elapsed))
+                    return report
+                if time.monotonic() > deadline:
+                    self.logger.error("Network not ready after %.1fs: %d/%d nodes ready, %d/%d connected, highest head %d" % (
+                        elapsed, len(ready), len(names), len(connected), len(names), highest_head))
+                    return report
+                self.logger.debug("Waiting network: %d/%d nodes ready, %d/%d connected, highest head %d" % (
+                    len(ready), len(names), len(connected), len(names), highest_head))
+                time.sleep(self.poll_interval)
+
+    def __poll(self, node):
+        try:
+            return {
+                "peers": node.web3.net.peerCount,
+                "syncing": node.web3.eth.syncing is not False,
+                "head": node.web3.eth.blockNumber
+            }
+        except Exception as error:
+            self.logger.debug("[%s]Can't poll node: %s" % (node.host, error))
+            return None
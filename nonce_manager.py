@@ -0,0 +1,112 @@
+import logging
+import time
+
+class NonceManager:
+
+    # Next nonces of many sender accounts, for load generators sending from all of them at once. Senders are split in
+    # shards, e.g. one per node: a sender is only used by its shard's worker, so its state is never contended.
+    # Sent nonces stay outstanding until included. Senders with a failed transaction, or with one outstanding for too
+    # long (dropped by the node), are marked dirty and resynced in batch from eth_getTransactionCount. The count stops
+    # at the first nonce the node misses: outstanding nonces above it are held in the node queue, and only the missing
+    # ones need to be sent again to fill the gap.
+
+    # Errors meaning that the node already holds the transaction: resending a transaction is not a failure
+    KNOWN_TRANSACTION_ERRORS = ["known transaction", "already known", "alreadyimported", "already imported"]
+
+    SYNC_BATCH_SIZE = 500
+
+    def __init__(self, addresses, shards=1, drop_timeout=60):
+        # The i-th address belongs to shard i % shards
+        self.addresses = list(addresses)
+        self.shards = shards
+        self.drop_timeout = drop_timeout
+        self.address_shards = {address: i % shards for i, address in enumerate(self.addresses)}
+        self.next_nonces = {address: 0 for address in self.addresses}
+        self.outstanding = {address: {} for address in self.addresses}
+        self.dirty = set()
+        self.resyncs = 0
+        self.logger = logging.getLogger("NonceManager")
+
+    def shard(self, address):
+        return self.address_shards[address]
+
+    def expect(self, address, nonce):
+        # Claims nonce, signed ahead of time, if it's the next one of address. False if address was resynced since.
+        if self.next_nonces[address] != nonce:
+            return False
+        self.next_nonces[address] = nonce + 1
+        return True
+
+    def allocate(self, address):
+        nonce = self.next_nonces[address]
+        self.next_nonces[address] = nonce + 1
+        return nonce
+
+    def fill(self, address, nonce):
+        # Claims the nonces from the next one up to nonce, excluded, and returns those not outstanding, to be sent
+        # again before nonce
+        outstanding = self.outstanding[address]
+        gap = [n for n in range(self.next_nonces[address], nonce) if n not in outstanding]
+        self.next_nonces[address] = max(self.next_nonces[address], nonce)
+        return gap
+
+    def sent(self, address, nonce, sent_at=None):
+        self.outstanding[address][nonce] = time.time() if sent_at is None else sent_at
+
+    def included(self, address, nonce):
+        # Nonces below an included one are included too
+        outstanding = self.outstanding[address]
+        for outstanding_nonce in [n for n in outstanding if n <= nonce]:
+            del outstanding[outstanding_nonce]
+
+    def failed(self, address, nonce, error):
+        # Returns False when error just means the node already has the transaction
+        if self.is_known_transaction(error):
+            return False
+        self.outstanding[address].pop(nonce, None)
+        self.dirty.add(address)
+        return True
+
+    def find_dropped(self, now=None):
+        # Marks dirty the senders with a transaction outstanding for more than drop_timeout, and returns them
+        deadline = (time.time() if now is None else now) - self.drop_timeout
+        dropped = [address for address, outstanding in self.outstanding.items()
+            if address not in self.dirty and outstanding and min(outstanding.values()) < deadline]
+        self.dirty.update(dropped)
+        return dropped
+
+    async def sync(self, connections, addresses=None):
+        # Sets next nonces of addresses (default all) from the pending transaction count of the node of their
+        # shard. connections are JsonRpcConnection, one per shard.
+        by_shard = {}
+        for address in self.addresses if addresses is None else addresses:
+            by_shard.setdefault(self.address_shards[address], []).append(address)
+        for shard, shard_addresses in by_shard.items():
+            for start in range(0, len(shard_addresses), self.SYNC_BATCH_SIZE):
+                chunk = shard_addresses[start:start + self.SYNC_BATCH_SIZE]
+                counts = await connections[shard].batch([("eth_getTransactionCount", (address, "pending")) for address in chunk])
+                for address, count in zip(chunk, counts):
+                    if isinstance(count, Exception):
+                        raise count
+                    self.next_nonces[address] = int(count, 16)
+
+    async def resync(self, connections):
+        # Resyncs dirty senders. Outstanding nonces up to the node count are forgotten, the ones above it are kept
+        # as queued by the node, with their drop timeout restarting from now.
+        dirty = list(self.dirty)
+        if not dirty:
+            return 0
+        await self.sync(connections, dirty)
+        now = time.time()
+        for address in dirty:
+            count = self.next_nonces[address]
+            self.outstanding[address] = {nonce: now for nonce in self.outstanding[address] if nonce > count}
+        self.dirty.difference_update(dirty)
+        self.resyncs += len(dirty)
+        self.logger.info("Resynced nonces of %d senders" % len(dirty))
+        return len(dirty)
+
+    @classmethod
+    def is_known_transaction(cls, error):
+        message = str(error).lower()
+        return any(known in message for known in cls.KNOWN_TRANSACTION_ERRORS)
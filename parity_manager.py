@@ -1,3 +1,4 @@
+import copy
 import json
 import logging
 import os
@@ -10,9 +11,13 @@ import toml
 import docker
 from web3 import Web3, HTTPProvider
 
+from benchmark_accounts import BenchmarkAccounts, write_genesis
 from deploy_manager import DeployManager
 from ethereum_node import EthereumNode
+from file_transfer import BulkUploader
 from host_manager import HostManager
+from keystore import KeystoreGenerator, find_key_file
+from topology import enode_url, generate_node_key
 
 class ParityManager(DeployManager):
 
@@ -24,8 +29,11 @@ class ParityManager(DeployManager):
     docker_network_name = "benchmark"
     # Docker container name. In the docker_network_name network it can be used as node alias. 
     docker_node_name = "parity-node"
+    images = ("parity-node",)
     # Password to encrypt new accounts
     account_password = "password"
+    # Scrypt cost of validators' keystores. Use KeystoreGenerator.STANDARD_SCRYPT_N for production-grade keys.
+    keystore_scrypt_n = KeystoreGenerator.LIGHT_SCRYPT_N
 
     local_datadir = "/root/parity"
 
@@ -33,54 +41,103 @@ class ParityManager(DeployManager):
     FILE_GENESIS = "./parity/genesis.json"
     FILE_PASSWORD = os.path.join(local_datadir, "password.txt")
     FILE_ENODES = "./parity/enodes.txt"
+    LOCAL_KEYSTORE = os.path.join(local_datadir, "keys")
+    FILE_BENCHMARK_ACCOUNTS = os.path.join(local_datadir, "benchmark_accounts.bin")
+
+    # Funded accounts added to genesis for load generators, their keys are exported at FILE_BENCHMARK_ACCOUNTS
+    benchmark_accounts = 0
 
     def __init__(self, hosts):
         super().__init__(hosts)
         self.logger = logging.getLogger("ParityManager")
         self.nodes = {}
+        self.peers = {}
+
+    def parse_conf(self, conf_as_dict):
+        super().parse_conf(conf_as_dict)
+        if "BENCHMARK_ACCOUNTS" in conf_as_dict:
+            self.benchmark_accounts = int(conf_as_dict["BENCHMARK_ACCOUNTS"])
+        if "KEYSTORE_SCRYPT_N" in conf_as_dict:
+            self.keystore_scrypt_n = int(conf_as_dict["KEYSTORE_SCRYPT_N"])
 
     def _init_setup(self):
-        self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
+        with self._step("connect"):
+            self.hosts_connections = HostManager.get_hosts_connections(self.hosts)
         self.__init_local_dir()
         with open(self.FILE_CONFIG) as conf_file:
             self.node_config_template = toml.loads(conf_file.read())
         with open(self.FILE_PASSWORD, "w") as pw_file:
             pw_file.write(self.account_password)
+        if self.benchmark_accounts:
+            with self._step("accounts.generate"):
+                BenchmarkAccounts(self.FILE_BENCHMARK_ACCOUNTS).generate(self.benchmark_accounts)
+        with self._step("keystore.generate"):
+            generator = KeystoreGenerator(self.LOCAL_KEYSTORE, self.account_password, scrypt_n=self.keystore_scrypt_n)
+            self.accounts = generator.generate(len(self.hosts))
     
     def _init_loop(self, host):
-        self.check_docker(host)
-        self.create_remote_datadir(host)
-        self.__upload_config(host)
-        self.__upload_genesis(host)
+        # Validator account and node key are generated here, so that the node container starts only once, in start
+        with self._step("docker.check"):
+            self.check_docker(host)
         node = EthereumNode(host, EthereumNode.TYPE_PARITY)
-        self.__start_remote_node(node)
-        node.account = node.web3.personal.newAccount(self.account_password), self.account_password
+        node.account = Web3.toChecksumAddress(self.accounts[self.hosts.index(host)]), self.account_password
+        node.nodekey, public_key = generate_node_key()
+        node.enode = enode_url(public_key, host, node.p2p_port)
         self.__write_host_config(host, node.account[0])
-        self.__stop_remote_node(node)
         self.nodes[host] = node
-        self.logger.info("[%s]Generated account %s" % (host, node.account[0]))
+        self.logger.info("[%s]Validator account %s" % (host, node.account[0]))
 
     def _start_setup(self):
-        self.__init_genesis(self.FILE_GENESIS)
-        self.__write_enodes_file(self.FILE_ENODES)
+        genesis_dict = self.__init_genesis(self.FILE_GENESIS)
+        # Parity looks for the keys of a chain in keys/<dataDir or name of its spec>
+        self.chain_data_dir = genesis_dict.get("dataDir", genesis_dict["name"])
+        self.__write_enodes_files()
+        self._distribute_files(self.FILE_GENESIS)
     
     def _start_loop(self, host):
-        self.__upload_config(host, mining=True)
-        self.__upload_password(host)
-        self.__upload_enodes(host)
-        self.__upload_genesis(host)
-        try:
-            self.__start_remote_node(self.nodes[host], mining=True, with_peers=True)
-        except Exception as e:
-            self.logger.error(e)
+        with self._step("ssh.upload_files"):
+            self.__upload_node_files(host)
+        self.__stop_remote_node(self.nodes[host]) # Leftovers of a previous failed attempt
+        self.__start_remote_node(self.nodes[host])
     
     def _start_teardown(self):
         self.utility_node = self.nodes[self.hosts[0]]
         self.logger.info("Node at %s will serve as utility" % self.hosts[0])
+        self.__wait_network_ready(self.CMD_START)
+
+    def _reset_setup(self):
+        # Every node stops before any restarts, otherwise restarted nodes would sync the old chain from their peers
+        self.reset_started = time.time()
+        self._run_on_hosts(self.CMD_RESET, "setup", self.__stop_container)
+
+    def _reset_loop(self, host):
+        # The node restarts in the same container with the same keys, parity rebuilds the database from genesis
+        container = self.hosts_connections[host]["docker"]["containers"][self.docker_node_name]
+        with self._step("ssh.remove_db"):
+            self.hosts_connections[host]["ssh"].sudo("rm -rf %s/chains/*/db" % self.datadir, hide=True)
+        with self._step("docker.start"):
+            container.start()
+        with self._step("rpc.ready"):
+            ready = self.nodes[host].ready()
+        if not ready:
+            raise Exception("[%s]Can't contact Parity node after reset" % host)
+        self.logger.info("[%s]Reset" % host)
+
+    def _reset_teardown(self):
+        self.__wait_network_ready(self.CMD_RESET, self.reset_started)
 
     def _stop_loop(self, host):
         self.__stop_remote_node(self.nodes[host])
 
+    def __stop_container(self, host):
+        with self._step("docker.stop"):
+            self.hosts_connections[host]["docker"]["containers"][self.docker_node_name].stop(timeout=self.stop_timeout)
+
+    def __wait_network_ready(self, cmd, since=None):
+        running_nodes = {host: node for host, node in self.nodes.items() if host not in self.failed_hosts}
+        expected_peers = {host: len(self.peers.get(host, set()) & set(running_nodes)) for host in running_nodes}
+        self._wait_network_ready(running_nodes, expected_peers, cmd=cmd, since=since)
+
     def __init_local_dir(self):
         try:
             shutil.rmtree(self.local_datadir)
@@ -92,30 +149,31 @@ class ParityManager(DeployManager):
         except Exception as error:
             self.logger.error(error)
 
-    def __start_remote_node(self, node, mining=False, with_peers=False):
+    def __start_remote_node(self, node):
         start_cmd = "--chain genesis.json --config config.toml --geth --identity Parity-%s" % node.host
-        if mining:
-            start_cmd += " --unlock {0} --password {1}".format(node.account[0], os.path.join(self.docker_container_datadir, "password.txt"))
-        if with_peers:
-            start_cmd += " --reserved-peers=%s --reserved-only" % os.path.join(self.docker_container_datadir, os.path.basename(self.FILE_ENODES))
+        start_cmd += " --unlock {0} --password {1}".format(node.account[0], os.path.join(self.docker_container_datadir, "password.txt"))
+        start_cmd += " --reserved-peers=%s --reserved-only" % os.path.join(self.docker_container_datadir, os.path.basename(self.FILE_ENODES))
         docker_cnx = self.hosts_connections[node.host]["docker"]
-        parity_container = docker_cnx["client"].containers.run(
-            self.dinr.resolve("parity-node"),
-            start_cmd,
-            detach=True,
-            volumes={
-                self.datadir: {
-                    "bind": self.docker_container_datadir,
-                    "mode": "rw"
-                }
-            },
-            ports={
-                "8545/tcp":"8545",
-                "30303/tcp":"30303",
-                "30303/udp":"30303"
-            }, name=self.docker_node_name, network=self.docker_network_name)
+        with self._step("docker.run", node.host):
+            parity_container = docker_cnx["client"].containers.run(
+                self.dinr.resolve("parity-node"),
+                start_cmd,
+                detach=True,
+                volumes={
+                    self.datadir: {
+                        "bind": self.docker_container_datadir,
+                        "mode": "rw"
+                    }
+                },
+                ports={
+                    "8545/tcp":"8545",
+                    "30303/tcp":"30303",
+                    "30303/udp":"30303"
+                }, name=self.docker_node_name, network=self.docker_network_name)
         docker_cnx["containers"][self.docker_node_name] = parity_container
-        if node.ready():
+        with self._step("rpc.ready", node.host):
+            ready = node.ready()
+        if ready:
             self.logger.info("[%s]Initialized node" % node.host)
         else:
             raise Exception("[%s]Can't contact Parity node with account %s" % (node.host, node.account[0]))
@@ -123,9 +181,9 @@ class ParityManager(DeployManager):
     def __stop_remote_node(self, node):
         containers = self.hosts_connections[node.host]["docker"]["containers"]
         if self.docker_node_name in containers:
-            containers[self.docker_node_name].stop()
+            with self._step("docker.remove", node.host):
+                self._remove_containers([containers.pop(self.docker_node_name)])
             node.status = EthereumNode.STATUS_STOPPED
-            containers[self.docker_node_name].remove()
             self.logger.info("[%s]Node stopped" % node.host)
     
     def __init_genesis(self, genesis_path):
@@ -135,48 +193,46 @@ class ParityManager(DeployManager):
         accounts_balances = {}
         for node in self.nodes.values():
             accounts.append(node.account[0])
-            accounts_balances[node.account[0]] = {"balance": "0x200000000000000000000000000000000000000000000000000000000000000"}
+            accounts_balances[node.account[0]] = {"balance": BenchmarkAccounts.DEFAULT_BALANCE}
         genesis_dict["engine"]["authorityRound"]["params"]["validators"]["list"] = accounts
         genesis_dict["accounts"] = accounts_balances
-        with open(genesis_path, "w") as genesis_file:
-            json.dump(genesis_dict, genesis_file)
+        extra_addresses = BenchmarkAccounts(self.FILE_BENCHMARK_ACCOUNTS).addresses() if self.benchmark_accounts else ()
+        write_genesis(genesis_path, genesis_dict, "accounts", extra_addresses)
         return genesis_dict
 
     def __write_host_config(self, host, account):
-        node_config = self.node_config_template.copy()
+        # Nested sections are written per host, from concurrent init loops
+        node_config = copy.deepcopy(self.node_config_template)
         node_config["mining"]["author"] = account
         node_config["mining"]["engine_signer"] = account
         with open(os.path.join(self.local_datadir, "%s.toml" % host), "w") as conf_file:
             conf_file.write(toml.dumps(node_config))
 
-    def __upload_password(self, host):
-        self.hosts_connections[host]["ssh"].put(self.FILE_PASSWORD, remote=os.path.join(self.datadir, "password.txt"))
-        self.logger.info("[%s]Password file uploaded" % host)
-
-    def __upload_genesis(self, host):
-        self.hosts_connections[host]["ssh"].put(self.FILE_GENESIS, remote=os.path.join(self.datadir, "genesis.json"))
-        self.logger.info("[%s]Genesis file uploaded" % host)
+    def __upload_node_files(self, host):
+        # Keys land where parity looks for them under its base path: the validator keystore and the p2p node key
+        node = self.nodes[host]
+        key_file = find_key_file(self.LOCAL_KEYSTORE, node.account[0])
+        uploader = BulkUploader()
+        uploader.add_file(os.path.join(self.local_datadir, "%s.toml" % host), "config.toml")
+        uploader.add_file(self.FILE_GENESIS, "genesis.json")
+        uploader.add_file(self.FILE_PASSWORD, "password.txt")
+        uploader.add_file(self.__enodes_file(host), os.path.basename(self.FILE_ENODES))
+        uploader.add_file(os.path.join(self.LOCAL_KEYSTORE, key_file), os.path.join("keys", self.chain_data_dir, key_file))
+        uploader.add_bytes(node.nodekey.encode(), os.path.join("network", "key"), mode=0o600)
+        uploader.upload(self.hosts_connections[host]["ssh"], self.datadir)
+        self.logger.info("[%s]Node files uploaded" % host)
 
-    def __upload_config(self, host, mining=False):
-        if mining:
-            conf_file_path = os.path.join(self.local_datadir, "%s.toml" % host)
-        else:
-            conf_file_path = self.FILE_CONFIG
-        if os.path.isfile(conf_file_path):
-            self.hosts_connections[host]["ssh"].put(conf_file_path, remote=os.path.join(self.datadir, "config.toml"))
-            self.logger.info("[%s]Config file uploaded" % host)
-        else:
-            self.logger.warning("[%s]Couldn't update conf file. (Mining: %d)" % (host, mining))
+    def __enodes_file(self, host):
+        return os.path.join(self.local_datadir, "enodes-%s.txt" % host)
 
-    def __upload_enodes(self, host):
-        self.hosts_connections[host]["ssh"].put(self.FILE_ENODES, remote=os.path.join(self.datadir, "enodes.txt"))
-        self.logger.info("[%s]Enodes file uploaded" % host)
-
-    def __write_enodes_file(self, file_path):
-        with open(file_path, "w") as enodes_file:
-            for node in self.nodes.values():
-                enodes_file.write("%s\n" % node.enode)
-        self.logger.info("Written enodes file")
+    def __write_enodes_files(self):
+        # Each node only reserves its peers in the topology
+        self.peers = self.topology.peers([host for host in self.hosts if host in self.nodes])
+        for host, host_peers in self.peers.items():
+            with open(self.__enodes_file(host), "w") as enodes_file:
+                for peer in sorted(host_peers):
+                    enodes_file.write("%s\n" % self.nodes[peer].enode)
+        self.logger.info("Written enodes files for a %s topology" % self.topology.kind)
 
     def check_docker(self, host):
         docker_connection = self.hosts_connections[host]["docker"]
@@ -193,19 +249,14 @@ class ParityManager(DeployManager):
                 self.logger.error(error)
         try:
             parity_node = docker_connection["client"].containers.get(self.docker_node_name)
-            parity_node.stop()
-            parity_node.remove()
-            self.logger.info("[{0}]Parity node found, stopped and removed".format(host))
+            self._remove_containers([parity_node])
+            self.logger.info("[{0}]Parity node found and removed".format(host))
         except docker.errors.APIError as error:
             if error.status_code == 404:
                 pass
             else:
                 self.logger.error(error)
-    
-    def create_remote_datadir(self, host):
-        mkdir = self.hosts_connections[host]["ssh"].run("mkdir -p %s" % self.datadir)
-        if not mkdir.ok:
-            raise Exception("[%s]Can't create datadir" % host)
+
 
 
 if __name__ == "__main__":
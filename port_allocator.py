@@ -0,0 +1,21 @@
+class PortAllocator:
+
+    # Gives every node packed on a host its own set of host ports. Slot 0 keeps the base ports, so that a single node
+    # per host is reachable where it always was, slot i gets base port + i * stride.
+
+    def __init__(self, base_ports, stride=10):
+        self.base_ports = base_ports
+        self.stride = stride
+
+    def ports(self, slot):
+        return {name: port + slot * self.stride for name, port in self.base_ports.items()}
+
+    def check(self, slots):
+        used = {}
+        for slot in range(slots):
+            for name, port in self.ports(slot).items():
+                if port > 65535:
+                    raise ValueError("Port {0} of slot {1} is out of range".format(name, slot))
+                if port in used:
+                    raise ValueError("Port {0} of slot {1} collides with {2}".format(port, slot, used[port]))
+                used[port] = "{0} of slot {1}".format(name, slot)
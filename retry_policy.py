@@ -0,0 +1,58 @@
+import logging
+from threading import Thread
+import time
+
+class AttemptTimeout(Exception):
+    pass
+
+class RetryPolicy:
+
+    # Attempts that exceed timeout aren't retried: they can't be stopped and keep running in background, so a new
+    # attempt would act on the same containers and directories at the same time.
+
+    def __init__(self, attempts=1, backoff=1, backoff_factor=2, max_backoff=60, timeout=None):
+        if attempts < 1:
+            raise ValueError("At least one attempt is required, given {0}".format(attempts))
+        self.attempts = attempts
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.logger = logging.getLogger("RetryPolicy")
+
+    def delay(self, attempt):
+        return min(self.backoff * (self.backoff_factor ** (attempt - 1)), self.max_backoff)
+
+    def call(self, name, fn, *args, **kwargs):
+        attempt = 1
+        while True:
+            try:
+                return self.__call_with_timeout(name, fn, args, kwargs)
+            except AttemptTimeout:
+                raise
+            except Exception as error:
+                if attempt >= self.attempts:
+                    raise
+                delay = self.delay(attempt)
+                self.logger.warning("%s failed at attempt %d/%d (%s). Retrying in %.1fs" % (name, attempt, self.attempts, error, delay))
+                time.sleep(delay)
+                attempt += 1
+
+    def __call_with_timeout(self, name, fn, args, kwargs):
+        if self.timeout is None:
+            return fn(*args, **kwargs)
+        outcome = {}
+        def target():
+            try:
+                outcome["result"] = fn(*args, **kwargs)
+            except BaseException as error:
+                outcome["error"] = error
+        # Python threads can't be killed: on timeout the call is abandoned and left running in background
+        call_thread = Thread(target=target, name="%s-attempt" % name, daemon=True)
+        call_thread.start()
+        call_thread.join(self.timeout)
+        if call_thread.is_alive():
+            raise AttemptTimeout("%s didn't complete in %.1fs" % (name, self.timeout))
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
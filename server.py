@@ -1,17 +1,22 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file
 import json
 import logging
 import os
 import queue
 import sys
+from threading import Thread
 import uuid
 
 from burrow_manager import BurrowManager
 from block_propagation_manager import BlockPropagationManager
 from caliper_manager import CaliperManager
 from caliper_ethereum import CaliperEthereum
+from deploy_metrics import DeployMetrics
+from docker_images_name_resolver import DockerImagesNameResolver
 from geth_manager import GethManager
 from host_manager import HostManager
+from load_agents_manager import LoadAgentsManager
+from loadgen import LoadGenerator, load_workload
 from multichain_manager import MultichainManager
 from parity_manager import ParityManager
 
@@ -30,15 +35,34 @@ if "UPLOAD_FOLDER" in os.environ:
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+if "REGISTRY_MIRROR" in os.environ:
+    DockerImagesNameResolver().set_mirror(os.environ["REGISTRY_MIRROR"])
+
 app = Flask("BC-Orch-Controller")
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
 host_manager = HostManager()
 bc_manager = {}
+load_runs = {}
 
 @app.route('/ready')
 def get_ready_count():
-    return jsonify({"count": len(host_manager.get_hosts())})
+    counts = host_manager.count_hosts_by_status()
+    return jsonify({
+        "count": len(host_manager.get_hosts()),
+        "probing": counts[HostManager.STATUS_PROBING],
+        "failed": counts[HostManager.STATUS_FAILED]
+    })
+
+@app.route('/hosts')
+def get_hosts_inventory():
+    hosts_info = host_manager.get_hosts_info()
+    for host, info in hosts_info.items():
+        info["score"] = {
+            HostManager.ROLE_NODE: host_manager.score_host(host, HostManager.ROLE_NODE),
+            HostManager.ROLE_LOAD: host_manager.score_host(host, HostManager.ROLE_LOAD)
+        }
+    return jsonify(hosts_info)
 
 @app.route('/ready/<string:ip_ready>')
 def notify_ready(ip_ready):
@@ -54,7 +78,10 @@ def status_deploy(deploy_id):
         if deploy_manager.current_stage:
             return jsonify({
                 "stage": deploy_manager.current_stage,
-                "completed": deploy_manager.cmd_events[deploy_manager.current_stage].is_set()
+                "completed": deploy_manager.cmd_events[deploy_manager.current_stage].is_set(),
+                "error": str(deploy_manager.cmd_errors[deploy_manager.current_stage]) if deploy_manager.current_stage in deploy_manager.cmd_errors else None,
+                "failed_hosts": list(deploy_manager.failed_hosts),
+                "timings": deploy_manager.metrics.get_spans()
             })
         else:
             return jsonify({
@@ -62,6 +89,15 @@ def status_deploy(deploy_id):
             }), 500
     return jsonify({"message": 'Deploy session not found'}), 404
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    lines = DeployMetrics.prometheus_header()
+    for deploy_id, deploy_manager in list(bc_manager.items()):
+        lines.extend(deploy_manager.metrics.to_prometheus({
+            "deploy_id": str(deploy_id),
+            "manager": type(deploy_manager).__name__
+        }))
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 @app.route('/start/multichain/<int:nodes_count>/<string:protocol>', methods=['POST'])
 def start_multichain(nodes_count, protocol):
@@ -79,6 +115,7 @@ def start_multichain(nodes_count, protocol):
         file.save(params_file_path)
         deploy_id = uuid.uuid4()
         multichain_manager = MultichainManager(hosts)
+        multichain_manager.parse_conf(os.environ)
         multichain_manager.set_bc_protocol(protocol)
         multichain_manager.init()
         multichain_manager.cleanup()
@@ -103,6 +140,7 @@ def start_geth(nodes_count):
         deploy_id = uuid.uuid4()
         geth_manager = GethManager(hosts)
         geth_manager.parse_conf(os.environ)
+        geth_manager.enable_host_replacement(host_manager)
         with open(genesis_file) as genesis_file_data:
             genesis_dict = json.load(genesis_file_data)
             if "clique" in genesis_dict['config']:
@@ -110,6 +148,10 @@ def start_geth(nodes_count):
                 geth_manager.FILE_CLIQUE = genesis_file
             else:
                 geth_manager.FILE_ETHASH = genesis_file
+        if 'snapshot' in request.files and request.files['snapshot'].filename != '':
+            snapshot_file = os.path.join(app.config['UPLOAD_FOLDER'], request.files['snapshot'].filename)
+            request.files['snapshot'].save(snapshot_file)
+            geth_manager.chain_snapshot = snapshot_file
         geth_manager.init()
         geth_manager.cleanup()
         geth_manager.start()
@@ -132,6 +174,7 @@ def start_parity(nodes_count):
         file.save(genesis_file)
         deploy_id = uuid.uuid4()
         parity_manager = ParityManager(hosts)
+        parity_manager.parse_conf(os.environ)
         parity_manager.FILE_GENESIS = genesis_file
         parity_manager.init()
         parity_manager.start()
@@ -147,6 +190,7 @@ def start_burrow(nodes_count, proposal_threshold):
     if hosts:
         deploy_id = uuid.uuid4()
         burrow_manager = BurrowManager(hosts, proposal_threshold)
+        burrow_manager.parse_conf(os.environ)
         burrow_manager.init()
         burrow_manager.start()
         bc_manager[deploy_id] = burrow_manager
@@ -166,6 +210,29 @@ def stop_blockchain(deploy_id):
         return jsonify({"message": 'Nodes stopping and session closed'})
     return jsonify({"message": 'Deploy session not found'}), 404
 
+@app.route('/reset/<string:deploy_id>', methods=['GET', 'POST'])
+def reset_blockchain(deploy_id):
+    global bc_manager
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(deploy_id))
+    if uuidObj in bc_manager:
+        manager = bc_manager[uuidObj]
+        if not manager.check_enabled(manager.CMD_RESET):
+            return jsonify({"message": 'Only running blockchains can be reset'}), 409
+        manager.reset()
+        return jsonify({"message": 'Blockchain resetting'})
+    return jsonify({"message": 'Deploy session not found'}), 404
+
+@app.route('/benchmark/accounts/<string:deploy_id>', methods=['GET'])
+def get_benchmark_accounts(deploy_id):
+    global bc_manager
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(deploy_id))
+    if uuidObj in bc_manager:
+        deploy_manager = bc_manager[uuidObj]
+        if getattr(deploy_manager, "benchmark_accounts", 0) and os.path.isfile(deploy_manager.FILE_BENCHMARK_ACCOUNTS):
+            return send_file(deploy_manager.FILE_BENCHMARK_ACCOUNTS, mimetype="application/octet-stream")
+        return jsonify({"message": 'No benchmark accounts in this deploy session'}), 404
+    return jsonify({"message": 'Deploy session not found'}), 404
+
 @app.route('/benchmark/start/caliper/<string:deploy_id>', methods=['POST'])
 def start_caliper(deploy_id):
     global bc_manager
@@ -204,6 +271,129 @@ def start_caliper(deploy_id):
         })
     return jsonify({"message": 'Deploy session not found'}), 404
 
+@app.route('/benchmark/start/loadgen/<string:deploy_id>', methods=['POST'])
+def start_loadgen(deploy_id):
+    global bc_manager
+    if 'workload' not in request.files:
+        return jsonify({"message": 'Workload file is required in order to start load generation'}), 403
+    file = request.files['workload']
+    if file.filename == '':
+        return jsonify({"message": 'Empty workload file found'}), 403
+    workload_file = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+    file.save(workload_file)
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(deploy_id))
+    if uuidObj in bc_manager:
+        ethereum_manager = bc_manager[uuidObj]
+        if not isinstance(ethereum_manager, GethManager) and not isinstance(ethereum_manager, ParityManager):
+            return jsonify({"message": 'Deploy session is not a Geth or Parity session'}), 403
+        if not ethereum_manager.benchmark_accounts:
+            return jsonify({"message": 'Load generation requires a deployment started with BENCHMARK_ACCOUNTS'}), 412
+        try:
+            rounds = load_workload(workload_file)
+        except Exception as error:
+            return jsonify({"message": 'Invalid workload file: %s' % error}), 403
+        loadgen_id = uuid.uuid4()
+        load_runs[loadgen_id] = {
+            "status": "waiting",
+            "generator": None,
+            "error": None,
+            "records_file": os.path.join(app.config['UPLOAD_FOLDER'], "loadgen-%s.csv" % loadgen_id)
+        }
+        Thread(target=run_load, args=(load_runs[loadgen_id], ethereum_manager, rounds), daemon=True).start()
+        return jsonify({"message": "Load generation starting once the network is ready", "loadgen_id": loadgen_id})
+    return jsonify({"message": 'Deploy session not found'}), 404
+
+def run_load(load_run, ethereum_manager, rounds):
+    try:
+        ethereum_manager.wait_cmd(ethereum_manager.CMD_START)
+        load_generator = LoadGenerator(ethereum_manager.nodes.values(), ethereum_manager.FILE_BENCHMARK_ACCOUNTS)
+        load_generator.parse_conf(os.environ)
+        load_run["generator"] = load_generator
+        load_run["status"] = "running"
+        load_generator.run(rounds)
+        load_generator.write_records(load_run["records_file"])
+        load_run["status"] = "completed"
+    except Exception as error:
+        logger.exception("Load generation failed")
+        load_run["error"] = str(error)
+        load_run["status"] = "failed"
+
+@app.route('/benchmark/results/<string:loadgen_id>', methods=['GET'])
+def get_loadgen_results(loadgen_id):
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(loadgen_id))
+    if uuidObj in load_runs:
+        load_run = load_runs[uuidObj]
+        return jsonify({
+            "status": load_run["status"],
+            "error": load_run["error"],
+            "rounds": load_run["generator"].results if load_run["generator"] else []
+        })
+    return jsonify({"message": 'Load generation not found'}), 404
+
+@app.route('/benchmark/results/<string:loadgen_id>/transactions', methods=['GET'])
+def get_loadgen_transactions(loadgen_id):
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(loadgen_id))
+    if uuidObj in load_runs:
+        if load_runs[uuidObj]["status"] != "completed":
+            return jsonify({"message": 'Load generation not completed'}), 409
+        return send_file(load_runs[uuidObj]["records_file"], mimetype="text/csv")
+    return jsonify({"message": 'Load generation not found'}), 404
+
+@app.route('/benchmark/start/agents/<string:deploy_id>/<int:agents_count>', methods=['POST'])
+def start_load_agents(deploy_id, agents_count):
+    global bc_manager
+    if 'workload' not in request.files:
+        return jsonify({"message": 'Workload file is required in order to start load agents'}), 403
+    file = request.files['workload']
+    if file.filename == '':
+        return jsonify({"message": 'Empty workload file found'}), 403
+    workload_file = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+    file.save(workload_file)
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(deploy_id))
+    if uuidObj in bc_manager:
+        ethereum_manager = bc_manager[uuidObj]
+        if not isinstance(ethereum_manager, GethManager) and not isinstance(ethereum_manager, ParityManager):
+            return jsonify({"message": 'Deploy session is not a Geth or Parity session'}), 403
+        if not ethereum_manager.benchmark_accounts:
+            return jsonify({"message": 'Load agents require a deployment started with BENCHMARK_ACCOUNTS'}), 412
+        # Agents report to the controller at this address
+        if not os.environ.get("SERVER_IP"):
+            return jsonify({"message": 'Load agents require SERVER_IP, the controller address reachable from hosts'}), 412
+        if not os.environ.get("SERVER_PORT", "5000").isdigit():
+            return jsonify({"message": 'SERVER_PORT must be a port number'}), 412
+        hosts = host_manager.reserve_hosts(agents_count, HostManager.ROLE_LOAD)
+        if not hosts:
+            return jsonify({"message": 'Not enough nodes ready or available'}), 412
+        agents_id = uuid.uuid4()
+        report_url = "http://%s:%d/benchmark/agents/%s/report" % (os.environ["SERVER_IP"], int(os.environ.get("SERVER_PORT", 5000)), agents_id)
+        try:
+            agents_manager = LoadAgentsManager(hosts, ethereum_manager, workload_file, report_url)
+        except Exception as error:
+            host_manager.free_hosts(hosts)
+            return jsonify({"message": 'Invalid workload file: %s' % error}), 403
+        agents_manager.parse_conf(os.environ)
+        agents_manager.init()
+        agents_manager.cleanup()
+        agents_manager.start()
+        bc_manager[agents_id] = agents_manager
+        return jsonify({"message": "Load agents starting", "deploy_id": agents_id})
+    return jsonify({"message": 'Deploy session not found'}), 404
+
+@app.route('/benchmark/agents/<string:agents_id>/report', methods=['POST'])
+def report_load_agent(agents_id):
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(agents_id))
+    if uuidObj in bc_manager and isinstance(bc_manager[uuidObj], LoadAgentsManager):
+        answer = bc_manager[uuidObj].report(request.get_json())
+        return jsonify(dict(answer, message='understood'))
+    return jsonify({"message": 'Load agents session not found'}), 404
+
+@app.route('/benchmark/agents/<string:agents_id>/results', methods=['GET'])
+def get_load_agents_results(agents_id):
+    uuidObj = uuid.UUID('urn:uuid:{0}'.format(agents_id))
+    if uuidObj in bc_manager and isinstance(bc_manager[uuidObj], LoadAgentsManager):
+        return jsonify(bc_manager[uuidObj].results())
+    return jsonify({"message": 'Load agents session not found'}), 404
+
 @app.route('/benchmark/start/block-propagation/<string:deploy_id>', methods=['POST'])
 def start_block_propagation(deploy_id):
     global bc_manager
@@ -214,6 +404,7 @@ def start_block_propagation(deploy_id):
             return jsonify({"message": 'Deploy session is not a Geth session'}), 403
         geth_manager = bc_manager[uuidObj]
         bp_manager = BlockPropagationManager(geth_manager.hosts)
+        bp_manager.parse_conf(os.environ)
         bp_manager.init()
         bp_manager.start()
         bc_manager[bp_id] = bp_manager
@@ -225,4 +416,4 @@ def start_block_propagation(deploy_id):
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0')
\ No newline at end of file
+    app.run(host='0.0.0.0', port=int(os.environ.get("SERVER_PORT", 5000)))
\ No newline at end of file
@@ -0,0 +1,82 @@
+from concurrent.futures import Future
+import logging
+from threading import Lock
+
+class DependencyFailed(Exception):
+    pass
+
+class StageScheduler:
+
+    # Runs stage calls on a WorkerPool as soon as all the futures they depend on are done.
+    # Dependencies in requires must also succeed: when one fails, the call is skipped and fails with DependencyFailed,
+    # so that the failure reaches the calls requiring it in turn. Failures of the other dependencies just order calls.
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.logger = logging.getLogger("StageScheduler")
+
+    def schedule(self, key, name, fn, args=(), depends_on=(), requires=()):
+        node = Future()
+        required = [dependency for dependency in requires if dependency is not None]
+        waiting = [dependency for dependency in depends_on if dependency is not None]
+        waiting.extend([dependency for dependency in required if dependency not in waiting])
+        if not waiting:
+            self.__submit(node, key, name, fn, args)
+            return node
+        remaining = [len(waiting)]
+        remaining_lock = Lock()
+        def on_dependency_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if not ready:
+                return
+            failed = [dependency for dependency in required if dependency.exception() is not None]
+            if failed:
+                self.logger.warning("Skipping %s, a stage it requires failed" % name)
+                node.set_exception(DependencyFailed("%s skipped: %s" % (name, failed[0].exception())))
+            else:
+                self.__submit(node, key, name, fn, args)
+        for dependency in waiting:
+            dependency.add_done_callback(on_dependency_done)
+        return node
+
+    @staticmethod
+    def gather(nodes):
+        # Done when all nodes are, failed if any failed, with the first error not coming from a dependency
+        gathered = Future()
+        pending = [len(nodes)]
+        pending_lock = Lock()
+        def on_node_done(_):
+            with pending_lock:
+                pending[0] -= 1
+                completed = pending[0] == 0
+            if not completed:
+                return
+            errors = [node.exception() for node in nodes if node.exception() is not None]
+            errors.sort(key=lambda error: isinstance(error, DependencyFailed))
+            if errors:
+                gathered.set_exception(errors[0])
+            else:
+                gathered.set_result(None)
+        if not nodes:
+            gathered.set_result(None)
+        for node in nodes:
+            node.add_done_callback(on_node_done)
+        return gathered
+
+    def __submit(self, node, key, name, fn, args):
+        try:
+            execution = self.pool.submit(key, fn, *args)
+        except RuntimeError as error: # Pool already shut down
+            node.set_exception(error)
+            return
+        execution.add_done_callback(lambda done: self.__resolve(node, name, done))
+
+    def __resolve(self, node, name, execution):
+        error = execution.exception()
+        if error is None:
+            node.set_result(execution.result())
+        else:
+            self.logger.error("%s failed" % name, exc_info=error)
+            node.set_exception(error)
@@ -0,0 +1,137 @@
+import random
+import secrets
+
+from eth_keys import keys
+
+class Topology:
+
+    # Peers of each blockchain node. peers() maps every node to the set of nodes it connects to. Links are
+    # symmetric, so that each link can be configured on both of its ends.
+
+    FULL_MESH = "full_mesh"
+    RING = "ring"
+    K_REGULAR = "k_regular"
+    SMALL_WORLD = "small_world"
+    CLUSTERS = "clusters"
+
+    AVAILABLE_KINDS = {FULL_MESH, RING, K_REGULAR, SMALL_WORLD, CLUSTERS}
+
+    def __init__(self, kind=FULL_MESH, degree=4, rewire_probability=0.1, clusters=4, bridges=1, seed=None):
+        # degree applies to k_regular and small_world, clusters and bridges (links between consecutive clusters) to
+        # clusters. A seed makes random topologies repeatable.
+        if kind not in self.AVAILABLE_KINDS:
+            raise ValueError("{0} isn't an available topology".format(kind))
+        self.kind = kind
+        self.degree = degree
+        self.rewire_probability = rewire_probability
+        self.clusters = clusters
+        self.bridges = bridges
+        self.seed = seed
+
+    @classmethod
+    def from_conf(cls, conf_as_dict):
+        return cls(
+            kind=conf_as_dict.get("TOPOLOGY", cls.FULL_MESH),
+            degree=int(conf_as_dict.get("TOPOLOGY_DEGREE", 4)),
+            rewire_probability=float(conf_as_dict.get("TOPOLOGY_REWIRE_PROBABILITY", 0.1)),
+            clusters=int(conf_as_dict.get("TOPOLOGY_CLUSTERS", 4)),
+            bridges=int(conf_as_dict.get("TOPOLOGY_BRIDGES", 1)),
+            seed=int(conf_as_dict["TOPOLOGY_SEED"]) if "TOPOLOGY_SEED" in conf_as_dict else None)
+
+    def peers(self, nodes):
+        nodes = list(nodes)
+        rng = random.Random(self.seed)
+        peers = {node: set() for node in nodes}
+        if self.kind == self.FULL_MESH:
+            links = [(i, j) for i in range(len(nodes)) for j in range(i + 1, len(nodes))]
+        elif self.kind == self.RING:
+            links = self.__lattice(len(nodes), 2)
+        elif self.kind == self.K_REGULAR:
+            links = self.__k_regular(len(nodes), rng)
+        elif self.kind == self.SMALL_WORLD:
+            links = self.__small_world(len(nodes), rng)
+        else:
+            links = self.__clusters(len(nodes))
+        for i, j in links:
+            peers[nodes[i]].add(nodes[j])
+            peers[nodes[j]].add(nodes[i])
+        return peers
+
+    def max_degree(self, nodes_count):
+        if self.kind == self.FULL_MESH:
+            return max(nodes_count - 1, 0)
+        elif self.kind == self.RING:
+            return min(2, max(nodes_count - 1, 0))
+        elif self.kind == self.CLUSTERS:
+            cluster_size = -(-nodes_count // max(self.clusters, 1))
+            return max(cluster_size - 1, 0) + 2 * self.bridges
+        # Rewiring can pile links on a node: no tight bound for small world
+        return min(2 * self.degree, max(nodes_count - 1, 0))
+
+    @staticmethod
+    def __lattice(nodes_count, degree):
+        # Each node linked to its degree / 2 closest nodes on each side of a ring
+        links = set()
+        for i in range(nodes_count):
+            for distance in range(1, max(degree // 2, 1) + 1):
+                j = (i + distance) % nodes_count
+                if i != j:
+                    links.add((min(i, j), max(i, j)))
+        return links
+
+    def __k_regular(self, nodes_count, rng):
+        # A lattice shuffled by degree preserving double edge swaps. Odd degrees are rounded down.
+        links = self.__lattice(nodes_count, min(self.degree, nodes_count - 1))
+        if len(links) < 2:
+            return links
+        ordered_links = sorted(links)
+        for _ in range(10 * len(ordered_links)):
+            first, second = rng.sample(range(len(ordered_links)), 2)
+            (a, b), (c, d) = ordered_links[first], ordered_links[second]
+            if rng.random() < 0.5:
+                c, d = d, c
+            new_first, new_second = (min(a, d), max(a, d)), (min(c, b), max(c, b))
+            if a == d or c == b or new_first in links or new_second in links:
+                continue
+            links.difference_update([ordered_links[first], ordered_links[second]])
+            links.update([new_first, new_second])
+            ordered_links[first], ordered_links[second] = new_first, new_second
+        return links
+
+    def __small_world(self, nodes_count, rng):
+        # Watts-Strogatz: lattice links are moved to a random node with rewire_probability
+        links = self.__lattice(nodes_count, min(self.degree, nodes_count - 1))
+        for i, j in sorted(links):
+            if rng.random() >= self.rewire_probability:
+                continue
+            candidates = [k for k in range(nodes_count) if k != i and (min(i, k), max(i, k)) not in links]
+            if candidates:
+                k = rng.choice(candidates)
+                links.discard((i, j))
+                links.add((min(i, k), max(i, k)))
+        return links
+
+    def __clusters(self, nodes_count):
+        # Contiguous groups fully meshed inside, each bridged to the next one in a ring
+        clusters_count = max(min(self.clusters, nodes_count), 1)
+        bounds = [nodes_count * c // clusters_count for c in range(clusters_count + 1)]
+        clusters = [list(range(bounds[c], bounds[c + 1])) for c in range(clusters_count)]
+        links = set()
+        for cluster in clusters:
+            links.update((cluster[i], cluster[j]) for i in range(len(cluster)) for j in range(i + 1, len(cluster)))
+        if clusters_count > 1:
+            for c, cluster in enumerate(clusters):
+                next_cluster = clusters[(c + 1) % clusters_count]
+                for bridge in range(self.bridges):
+                    i, j = cluster[bridge % len(cluster)], next_cluster[bridge % len(next_cluster)]
+                    if i != j:
+                        links.add((min(i, j), max(i, j)))
+        return links
+
+def generate_node_key():
+    # Returns the private key, as expected in a geth nodekey file, and the public key of an enode url
+    private_key = keys.PrivateKey(secrets.token_bytes(32))
+    return private_key.to_hex()[2:], private_key.public_key.to_hex()[2:]
+
+def enode_url(public_key, host, port):
+    return "enode://%s@%s:%d" % (public_key, host, port)
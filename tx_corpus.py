@@ -0,0 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import mmap
+import os
+import struct
+
+from eth_account import Account
+
+class TransactionCorpus:
+
+    # Signed raw transactions built ahead of a benchmark, so that signing (secp256k1, RLP and keccak) stays out of
+    # the measured window and off the nodes under test. Transactions are signed in a process pool and stored as fixed
+    # size records in a flat file, read back through mmap. Record i is sent by sender i % senders with its
+    # (i // senders)-th nonce, so that reading the corpus in order gives every sender its nonces in order.
+
+    MAGIC = b"BCTX"
+    MAX_RAW_SIZE = 160
+    HEADER = struct.Struct("<4sIQ") # magic, record size, records count
+    RECORD = struct.Struct("<IQH32s%ds" % MAX_RAW_SIZE) # sender index, nonce, raw size, hash, raw
+
+    def __init__(self, path, processes=None, chunk_size=1000):
+        self.path = path
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self._file = None
+        self._mmap = None
+        self.count = 0
+        self.logger = logging.getLogger("TransactionCorpus")
+
+    def build(self, senders, nonces, count, chain_id, gas_price):
+        # senders are (address, private key) pairs, nonces their next nonces. Each sender pays 1 wei to the next one.
+        self.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        chunks = []
+        for start in range(0, count, self.chunk_size):
+            chunk = []
+            for index in range(start, min(start + self.chunk_size, count)):
+                sender = index % len(senders)
+                recipient = senders[(sender + 1) % len(senders)][0]
+                chunk.append((sender, senders[sender][1], nonces[sender] + index // len(senders), recipient))
+            chunks.append(chunk)
+        with open(self.path, "wb") as corpus_file:
+            corpus_file.write(self.HEADER.pack(self.MAGIC, self.RECORD.size, count))
+            if chunks:
+                with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                    for records in executor.map(sign_records, chunks, [chain_id] * len(chunks), [gas_price] * len(chunks)):
+                        corpus_file.write(records)
+        self.logger.info("Signed %d transactions of %d senders in %s" % (count, len(senders), self.path))
+        return self.open()
+
+    def open(self):
+        self.close()
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_size, self.count = self.HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC or record_size != self.RECORD.size:
+            self.close()
+            raise ValueError("%s isn't a transaction corpus" % self.path)
+        return self
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap, self._file = None, None
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        # Returns sender index, nonce, hash and raw transaction, the latter two as 0x prefixed hex
+        if not 0 <= index < self.count:
+            raise IndexError("Transaction %d out of a corpus of %d" % (index, self.count))
+        sender, nonce, raw_size, tx_hash, raw_transaction = self.RECORD.unpack_from(self._mmap, self.HEADER.size + index * self.RECORD.size)
+        return sender, nonce, "0x" + tx_hash.hex(), "0x" + raw_transaction[:raw_size].hex()
+
+    def records(self, start=0, end=None):
+        for index in range(start, self.count if end is None else min(end, self.count)):
+            yield self.record(index)
+
+def sign_transfer(private_key, nonce, to, chain_id, gas_price, value=1, gas=21000):
+    # Returns hash and raw transaction as bytes. to is a hex address in any case.
+    signed = Account.sign_transaction({
+        "to": bytes.fromhex(to[2:]),
+        "value": value,
+        "gas": gas,
+        "gasPrice": gas_price,
+        "nonce": nonce,
+        "chainId": chain_id
+    }, private_key)
+    raw_transaction = getattr(signed, "raw_transaction", None) or signed.rawTransaction
+    return bytes(signed.hash), bytes(raw_transaction)
+
+def sign_records(chunk, chain_id, gas_price):
+    # chunk holds (sender index, private key, nonce, recipient) of consecutive records
+    records = bytearray()
+    for sender, private_key, nonce, recipient in chunk:
+        tx_hash, raw_transaction = sign_transfer(private_key, nonce, recipient, chain_id, gas_price)
+        if len(raw_transaction) > TransactionCorpus.MAX_RAW_SIZE:
+            raise ValueError("Transaction of %d bytes exceeds corpus records" % len(raw_transaction))
+        records += TransactionCorpus.RECORD.pack(sender, nonce, len(raw_transaction), tx_hash, raw_transaction)
+    return bytes(records)
@@ -0,0 +1,115 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+from threading import Condition, Lock
+import time
+
+class RampLimiter:
+
+    def __init__(self, interval=0):
+        self.interval = interval
+        self._next_slot = 0
+        self._lock = Lock()
+
+    def wait(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class WorkerPool:
+
+    # Keeps a fixed set of threads alive for the whole manager lifetime. Each key (a deploy command)
+    # gets its own concurrency limit and start ramp, so that stages share threads but not limits.
+    # Calls of a key over its limit wait in the key queue, not on a pool thread, so that they never hold up the
+    # threads calls of other keys could run on.
+
+    def __init__(self, max_workers, name="WorkerPool"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._limits = {}
+        self._ramps = {}
+        self._queues = {}
+        self._running = {}
+        self._closed = False
+        self._limits_lock = Condition()
+        self.logger = logging.getLogger(name)
+
+    def set_limit(self, key, workers, ramp_interval=0):
+        if workers > self.max_workers:
+            self.logger.warning("%s limit (%d) exceeds pool size, capping to %d" % (key, workers, self.max_workers))
+            workers = self.max_workers
+        with self._limits_lock:
+            self.__add_key(key)
+            self._limits[key] = workers
+            self._ramps[key] = RampLimiter(ramp_interval)
+            self.__dispatch(key)
+
+    def submit(self, key, fn, *args, **kwargs):
+        future = Future()
+        with self._limits_lock:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a shut down pool")
+            self.__add_key(key)
+            self._queues[key].append((future, fn, args, kwargs))
+            self.__dispatch(key)
+        return future
+
+    def shutdown(self, wait=True):
+        # Calls already submitted still run. Without wait, the threads are shut down once the last of them ends.
+        with self._limits_lock:
+            self._closed = True
+            if wait:
+                self._limits_lock.wait_for(self.__drained)
+            elif not self.__drained():
+                return
+        self._executor.shutdown(wait=wait)
+
+    def __add_key(self, key):
+        if key not in self._limits:
+            self._limits[key] = self.max_workers
+            self._ramps[key] = RampLimiter()
+            self._queues[key] = deque()
+            self._running[key] = 0
+
+    def __drained(self):
+        return not any(self._queues.values()) and not any(self._running.values())
+
+    def __dispatch(self, key):
+        # Hands calls of key to the executor while key is under its limit. Called holding _limits_lock, reentrant for
+        # done callbacks submitting again.
+        queue = self._queues[key]
+        while queue and self._running[key] < self._limits[key]:
+            future, fn, args, kwargs = queue.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._running[key] += 1
+            try:
+                self._executor.submit(self.__run, key, future, fn, args, kwargs)
+            except RuntimeError as error: # Executor shut down, e.g. at interpreter exit
+                self._running[key] -= 1
+                future.set_exception(error)
+
+    def __run(self, key, future, fn, args, kwargs):
+        error, result = None, None
+        try:
+            self._ramps[key].wait()
+            result = fn(*args, **kwargs)
+        except BaseException as raised:
+            error = raised
+        # The slot is freed before the outcome is set, so that calls submitted by done callbacks can take it
+        with self._limits_lock:
+            self._running[key] -= 1
+            self.__dispatch(key)
+            drained = self._closed and self.__drained()
+            self._limits_lock.notify_all()
+        if drained:
+            self._executor.shutdown(wait=False)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)